@@ -0,0 +1 @@
+"""Shared building blocks for the Ahat API servers (main.py and backend/server.py)"""
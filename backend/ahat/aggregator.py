@@ -0,0 +1,187 @@
+"""Concurrent fetching of several product sources into one deduplicated list
+
+Sources are fetched on a shared, bounded thread pool, so a refresh takes about
+as long as its slowest healthy source instead of the sum of all of them. Each
+source has its own timeout and circuit breaker: a source that keeps failing is
+skipped (not waited on) until its breaker lets a trial request through again.
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+Source = namedtuple('Source', ['name', 'url', 'timeout'])
+
+# status: ok, failed, timeout or open (skipped by its circuit breaker)
+SourceReport = namedtuple('SourceReport', ['name', 'status', 'products', 'seconds', 'error'])
+
+AggregateResult = namedtuple('AggregateResult', [
+    'products',   # merged raw products, first source wins on duplicate keys
+    'reports',    # one SourceReport per configured source, in order
+    'changed',    # False when every source said "not modified" and none came or went
+    'seconds',
+])
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 10.0
+
+
+def load_sources(path):
+    """Read sources and FeedAggregator options from a JSON file; returns ``(sources, options)``
+
+    ``{"sources": [{"name", "url", "timeout"}, ...], "max_concurrency": 4, ...}``;
+    every key besides ``sources`` is passed on to FeedAggregator.
+    """
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    sources = [Source(s.get('name') or s['url'], s['url'], float(s.get('timeout', DEFAULT_TIMEOUT)))
+               for s in config.pop('sources')]
+    return sources, config
+
+
+class CircuitBreaker:
+    """Closed until ``failure_threshold`` failures in a row, then open for ``reset_timeout``
+
+    Once the timeout has passed the breaker is half-open: one trial request is
+    allowed, and its outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial = False
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = error
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._trial = False
+
+
+class FeedAggregator:
+    """Fetch every source concurrently and merge the results
+
+    ``fetch(source)`` returns ``(products, changed)`` for one source (None for
+    products counts as a failure) and should honour ``source.timeout`` itself (e.g. as the HTTP timeout); ``key(product)``
+    gives the deduplication key, or None for products that should never be
+    merged. ``deadline`` bounds the whole collect even if a fetch hangs.
+    """
+
+    def __init__(self, sources, fetch, key, max_concurrency=DEFAULT_CONCURRENCY, deadline=None,
+                 failure_threshold=3, reset_timeout=60.0, clock=time.monotonic):
+        self.sources = list(sources)
+        if not self.sources:
+            raise ValueError('at least one source is required')
+        names = [source.name for source in self.sources]
+        if len(set(names)) != len(names):
+            raise ValueError('source names must be unique')
+        self.fetch = fetch
+        self.key = key
+        self.max_concurrency = max_concurrency
+        # Queued sources wait for a free worker, so allow for the rounds the pool needs
+        rounds = -(-len(self.sources) // max_concurrency)
+        self.deadline = deadline or rounds * max(source.timeout for source in self.sources) + 1
+        self.clock = clock
+        self.breakers = {name: CircuitBreaker(failure_threshold, reset_timeout, clock) for name in names}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='ahat-source')
+        self._lock = threading.Lock()
+        self._last_ok = None
+
+    def collect(self):
+        """Fetch all sources whose breakers allow it; returns an AggregateResult"""
+        with self._lock:
+            started = self.clock()
+            pending = {}
+            reports = {}
+            for source in self.sources:
+                breaker = self.breakers[source.name]
+                if breaker.allow():
+                    pending[source.name] = self._executor.submit(self._fetch_one, source)
+                else:
+                    reports[source.name] = SourceReport(source.name, 'open', 0, 0.0, breaker.last_error)
+
+            wait(pending.values(), timeout=self.deadline)
+            results = {}
+            changed = False
+            for name, future in pending.items():
+                breaker = self.breakers[name]
+                if not future.done():
+                    # Left to finish in the background; its result is ignored
+                    future.cancel()
+                    error = f'no response within {self.deadline:g}s'
+                    breaker.record_failure(error)
+                    reports[name] = SourceReport(name, 'timeout', 0, self.clock() - started, error)
+                    continue
+                outcome, seconds = future.result()
+                if isinstance(outcome, Exception):
+                    error = str(outcome) or type(outcome).__name__
+                    breaker.record_failure(error)
+                    reports[name] = SourceReport(name, 'failed', 0, seconds, error)
+                    continue
+                products, source_changed = outcome
+                breaker.record_success()
+                results[name] = products or []
+                changed = changed or source_changed
+                reports[name] = SourceReport(name, 'ok', len(results[name]), seconds, None)
+
+            ok = tuple(source.name for source in self.sources if source.name in results)
+            changed = changed or ok != self._last_ok
+            self._last_ok = ok
+            products = self._merge(results)
+            return AggregateResult(products, [reports[source.name] for source in self.sources],
+                                   changed, self.clock() - started)
+
+    def _fetch_one(self, source):
+        started = self.clock()
+        try:
+            outcome = self.fetch(source)
+            if outcome[0] is None:
+                outcome = ValueError('no products found')
+        except Exception as e:
+            outcome = e
+        return outcome, self.clock() - started
+
+    def _merge(self, results):
+        merged = []
+        seen = set()
+        for source in self.sources:
+            for product in results.get(source.name, ()):
+                key = self.key(product)
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                merged.append(product)
+        return merged
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
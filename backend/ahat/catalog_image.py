@@ -0,0 +1,659 @@
+"""Catalog images: a catalog's products and indexes in one file, served in place through mmap
+
+Loading a catalog from its JSON records means decoding every product and
+building every index again, in every process that loads it: seconds and tens
+of megabytes per process at 10^4-10^5 products. An image holds the products
+and their indexes already built, as flat arrays of machine numbers, so a
+process maps the file and serves it at once, and processes mapping the same
+file share its pages instead of holding a copy each.
+
+The file is a small header, the sections (each 8-byte aligned, in native byte
+order) and a JSON directory saying where each section is, with the stats and
+the search settings. The sections:
+
+* ``records``: each product's JSON, in catalog order (a product's place in
+  it is its record number), and where each one starts
+* ``keys``: each product's key, JSON-encoded, and the record numbers in key
+  order, so a key is found by bisection
+* a table per hash field: the distinct values, JSON-encoded and sorted, each
+  with the record numbers having it (ascending)
+* per sort field: the ``(value, record number)`` pairs in order, and the
+  values by record number (NaN for None); sort fields must be numbers
+* search: the sorted vocabulary, each term's postings (record numbers and
+  weighted term frequencies), document lengths, and the symmetric-delete
+  table of typo corrections as a table of term numbers
+* rankings: for each ranking, overall and per category, the record numbers
+  best first
+
+MappedStore, MappedSearchIndex and MappedRankings serve these arrays through
+the ProductStore, SearchIndex and Rankings interfaces (the first two run the
+same query and ranking code over views of them). A product is decoded from
+its JSON only when a response needs it. They are read-only: a changed
+catalog is a new image.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from .records import to_json
+from .search import SearchIndex, _deletes
+from .snapshot import _fsync_directory
+from .stats import FrozenStats
+from .store import CATALOG_ORDER, ProductStore
+
+MAGIC = b'AHATIMG1'
+FORMAT = 1
+# magic, directory offset, directory length
+_HEADER = struct.Struct('<8sQQ')
+_ALIGN = 8
+# Postings a process keeps decoded, in entries (about 100 bytes each); see _Postings
+POSTING_CACHE_ENTRIES = 1 << 17
+
+_ENCODE = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=to_json).encode
+
+
+def encode_value(value):
+    """The bytes a key or hash-field value is stored (and looked up) as: its compact JSON"""
+    return _ENCODE(value).encode('utf-8', 'surrogatepass')
+
+
+def _encode_term(term):
+    # UTF-8 keeps code point order, so terms sort the same encoded or not
+    return term.encode('utf-8', 'surrogatepass')
+
+
+def _decode_term(raw):
+    return raw.decode('utf-8', 'surrogatepass')
+
+
+def write_image(path, store, stats, search, rankings, meta=None, sync=False):
+    """Write the catalog of ``store`` and its ``stats`` to ``path`` as an image; returns the product count
+
+    ``search`` (a SearchIndex) and ``rankings`` (a Rankings) are only read for
+    their settings: the postings and rankings are computed from the products,
+    so empty ones will do. ``meta`` is JSON-serializable data kept with the
+    image. The file is written next to ``path`` and renamed over it, so
+    readers only ever open a complete image; with ``sync`` both reach the
+    disk before this returns, as snapshots must. Raises OSError when the file
+    cannot be written (a previous image is then left untouched).
+    """
+    # Products and stats from the same state of the store
+    with store.hold():
+        products = store.all()
+        frozen = stats.freeze()
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with open(fd, 'wb') as f:
+            _write(f, products, store, frozen, search, rankings, meta)
+            if sync:
+                # The rename must not reach the disk before the data it points at
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
+        raise
+    if sync:
+        _fsync_directory(directory)
+    return len(products)
+
+
+class _Writer:
+    """Appends sections to an image file and keeps the directory of where they are"""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = _HEADER.size
+        # name -> [offset, array typecode ('' for bytes), length in items]
+        self.sections = {}
+        f.write(bytes(_HEADER.size))
+
+    def add(self, name, data, typecode=''):
+        padding = -self.offset % _ALIGN
+        self.f.write(bytes(padding))
+        self.offset += padding
+        self.sections[name] = [self.offset, typecode, len(data)]
+        self.f.write(data)
+        self.offset += len(data) * (data.itemsize if typecode else 1)
+
+    def strings(self, name, values):
+        """A section of byte strings, and one of where each starts"""
+        offsets = array('Q', [0])
+        end = 0
+        for value in values:
+            end += len(value)
+            offsets.append(end)
+        self.add(f'{name}.offsets', offsets, 'Q')
+        self.add(name, b''.join(values))
+
+    def table(self, name, groups):
+        """A lookup table: ``groups`` maps byte strings to lists of numbers"""
+        values = sorted(groups)
+        starts = array('I', [0])
+        items = array('I')
+        for value in values:
+            items.extend(groups[value])
+            starts.append(len(items))
+        self.strings(f'{name}.values', values)
+        self.add(f'{name}.starts', starts, 'I')
+        self.add(f'{name}.items', items, 'I')
+
+    def finish(self, directory):
+        body = json.dumps(directory, separators=(',', ':')).encode('utf-8')
+        self.f.write(body)
+        self.f.seek(0)
+        self.f.write(_HEADER.pack(MAGIC, self.offset, len(body)))
+
+
+def _write(f, products, store, frozen, search, rankings, meta):
+    out = _Writer(f)
+    count = len(products)
+    out.strings('records', [encode_value(product) for product in products])
+    keys = [encode_value(store.key(product)) for product in products]
+    out.strings('keys', keys)
+    out.add('keys.order', array('I', sorted(range(count), key=keys.__getitem__)), 'I')
+
+    for field, getter in store.hash_fields.items():
+        # Grouped by value first: each distinct value is encoded once
+        groups = {}
+        for recno, product in enumerate(products):
+            value = getter(product)
+            if value is not None:
+                groups.setdefault(value, []).append(recno)
+        out.table(f'hash.{field}', {encode_value(value): recnos for value, recnos in groups.items()})
+    for field, getter in store.sort_fields.items():
+        column = array('d', [_NONE]) * count
+        entries = []
+        for recno, product in enumerate(products):
+            value = getter(product)
+            if value is not None:
+                column[recno] = value
+                entries.append((value, recno))
+        entries.sort()
+        out.add(f'sort.{field}.values', array('d', [value for value, _ in entries]), 'd')
+        out.add(f'sort.{field}.recnos', array('I', [recno for _, recno in entries]), 'I')
+        out.add(f'sort.{field}.column', column, 'd')
+
+    # term -> ([record numbers], [weighted term frequencies])
+    postings = {}
+    lengths = array('d')
+    for recno, product in enumerate(products):
+        counts = search.analyze(product)
+        lengths.append(sum(counts.values()))
+        for term, frequency in counts.items():
+            posting = postings.get(term)
+            if posting is None:
+                posting = postings[term] = ([], [])
+            posting[0].append(recno)
+            posting[1].append(frequency)
+    vocabulary = sorted(postings)
+    starts = array('Q', [0])
+    docs = array('I')
+    frequencies = array('d')
+    deletes = {}
+    for number, term in enumerate(vocabulary):
+        recnos, counts = postings[term]
+        docs.extend(recnos)
+        frequencies.extend(counts)
+        starts.append(len(docs))
+        if len(term) >= search.min_typo_length:
+            for deletion in _deletes(term):
+                deletes.setdefault(_encode_term(deletion), []).append(number)
+    out.strings('search.terms', [_encode_term(term) for term in vocabulary])
+    out.add('search.starts', starts, 'Q')
+    out.add('search.docs', docs, 'I')
+    out.add('search.frequencies', frequencies, 'd')
+    out.add('search.lengths', lengths, 'd')
+    out.table('search.deletes', deletes)
+
+    ranked = {}
+    categories = [rankings.category(product) for product in products]
+    for name, score in rankings.scores.items():
+        entries = []
+        for recno, product in enumerate(products):
+            value = score(product)
+            if value is not None:
+                entries.append((-value, recno))
+        entries.sort()
+        overall = [recno for _, recno in entries]
+        ranked[encode_value([name])] = overall
+        by_category = {}
+        for recno in overall:
+            by_category.setdefault(categories[recno], []).append(recno)
+        for category, recnos in by_category.items():
+            ranked[encode_value([name, category])] = recnos
+    out.table('rankings', ranked)
+
+    out.finish({
+        'format': FORMAT,
+        'byteorder': sys.byteorder,
+        'count': count,
+        'saved_at': time.time(),
+        'meta': meta or {},
+        'sections': out.sections,
+        'hash_fields': list(store.hash_fields),
+        'sort_fields': list(store.sort_fields),
+        'stats': frozen,
+        'search': {'k1': search.k1, 'b': search.b, 'min_typo_length': search.min_typo_length,
+                   'total_length': sum(lengths)},
+        'rankings': list(rankings.scores),
+    })
+
+
+_NONE = float('nan')
+
+
+class CatalogImage:
+    """An image file mapped into memory; ``open()`` serves its catalog
+
+    Raises OSError when the file cannot be read and ValueError when it is not
+    a complete image of a format (and byte order) this code reads. The mapping
+    lives as long as anything served from it.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, offset, length = _HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a catalog image')
+            directory = json.loads(self._map[offset:offset + length])
+            if directory['format'] != FORMAT or directory['byteorder'] != sys.byteorder:
+                raise ValueError(f'{path} is a catalog image of another format or byte order')
+        except (struct.error, ValueError, KeyError) as e:
+            self._map.close()
+            raise ValueError(f'unreadable catalog image {path}: {e}') from e
+        self.path = path
+        self.count = directory['count']
+        self.saved_at = directory['saved_at']
+        self.meta = directory['meta']
+        self._directory = directory
+        self._sections = directory['sections']
+        self._memory = memoryview(self._map)
+
+    def open(self, key, convert=None):
+        """``(store, stats, search, rankings)`` serving the image
+
+        ``key`` is the store's key function; ``convert`` is applied to every
+        decoded product (``Product.from_dict``, say).
+        """
+        store = MappedStore(self, key, convert)
+        search = MappedSearchIndex(self, self._directory['search'])
+        return store, FrozenStats(self._directory['stats']), search, MappedRankings(self, store)
+
+    def array(self, name):
+        offset, typecode, length = self._sections[name]
+        size = array(typecode).itemsize
+        return self._memory[offset:offset + length * size].cast(typecode)
+
+    def strings(self, name):
+        return _Strings(self._map, self._sections[name][0], self.array(f'{name}.offsets'))
+
+    def table(self, name):
+        return _Table(self, name)
+
+
+class _Strings:
+    """The byte strings of a section, by number"""
+
+    __slots__ = ('_map', '_base', '_offsets')
+
+    def __init__(self, mapped, base, offsets):
+        self._map = mapped
+        self._base = base
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        offsets, base = self._offsets, self._base
+        return self._map[base + offsets[i]:base + offsets[i + 1]]
+
+
+class _Table:
+    """Numbers filed under byte strings, looked up by bisection"""
+
+    __slots__ = ('values', 'starts', 'items')
+
+    def __init__(self, image, name):
+        self.values = image.strings(f'{name}.values')
+        self.starts = image.array(f'{name}.starts')
+        self.items = image.array(f'{name}.items')
+
+    def get(self, encoded):
+        """The numbers filed under ``encoded``, or None"""
+        values = self.values
+        i = bisect_left(values, encoded)
+        if i == len(values) or values[i] != encoded:
+            return None
+        return self.items[self.starts[i]:self.starts[i + 1]]
+
+
+class _Records:
+    """Products by record number, decoded on every read"""
+
+    __slots__ = ('_strings', '_convert')
+
+    def __init__(self, image, convert):
+        self._strings = image.strings('records')
+        self._convert = convert
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, recno):
+        product = json.loads(self._strings[recno])
+        return product if self._convert is None else self._convert(product)
+
+
+class _Bucket:
+    """The record numbers (ascending) with one hash-field value"""
+
+    __slots__ = ('_recnos',)
+
+    def __init__(self, recnos):
+        self._recnos = recnos
+
+    def __len__(self):
+        return len(self._recnos)
+
+    def __iter__(self):
+        return iter(self._recnos)
+
+    def __contains__(self, recno):
+        recnos = self._recnos
+        i = bisect_left(recnos, recno)
+        return i < len(recnos) and recnos[i] == recno
+
+
+class _HashIndex:
+    """A hash field's index: value -> _Bucket"""
+
+    __slots__ = ('_table',)
+
+    def __init__(self, table):
+        self._table = table
+
+    def get(self, value, default=None):
+        recnos = self._table.get(encode_value(value))
+        return default if recnos is None else _Bucket(recnos)
+
+
+class _SortedIndex:
+    """A sort field's ``(value, record number, record number)`` entries, in order"""
+
+    __slots__ = ('values', 'recnos')
+
+    def __init__(self, values, recnos):
+        self.values = values
+        self.recnos = recnos
+
+    def __len__(self):
+        return len(self.recnos)
+
+    def __getitem__(self, i):
+        recno = self.recnos[i]
+        return self.values[i], recno, recno
+
+
+class _CatalogOrder:
+    """``(recno, recno, recno)`` for every record number: catalog order"""
+
+    __slots__ = ('_count',)
+
+    def __init__(self, count):
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return i, i, i
+
+
+class _Identity:
+    __slots__ = ()
+
+    def __getitem__(self, recno):
+        return recno
+
+
+def _read_only(*args, **kwargs):
+    raise ValueError('a catalog served from an image is read-only')
+
+
+class MappedStore(ProductStore):
+    """A ProductStore over an image: the same queries, answered from its arrays
+
+    Inside the store a product is known by its record number, which is also
+    its catalog order; keys are mapped to it by bisection. Writes raise
+    ValueError.
+    """
+
+    writable = False
+    load = upsert = remove = subscribe = _read_only
+
+    def __init__(self, image, key, convert=None):
+        self.key = key
+        # No getters: the image holds what they returned
+        self.hash_fields = dict.fromkeys(image._directory['hash_fields'])
+        self.sort_fields = dict.fromkeys(image._directory['sort_fields'])
+        self._lock = threading.RLock()
+        self._products = _Records(image, convert)
+        self._seq = _Identity()
+        self._keys = image.strings('keys')
+        self._key_order = image.array('keys.order')
+        self._hash = {field: _HashIndex(image.table(f'hash.{field}')) for field in self.hash_fields}
+        self._sorted = {field: _SortedIndex(image.array(f'sort.{field}.values'), image.array(f'sort.{field}.recnos'))
+                        for field in self.sort_fields}
+        self._sorted[CATALOG_ORDER] = _CatalogOrder(image.count)
+        self._columns = {field: image.array(f'sort.{field}.column') for field in self.sort_fields}
+        self._unmerged = {}
+        self._listeners = []
+        self.version = 0
+
+    def __contains__(self, key):
+        return self._internal_key(key) is not None
+
+    def get(self, key):
+        recno = self._internal_key(key)
+        return None if recno is None else self._products[recno]
+
+    def all(self):
+        products = self._products
+        return [products[recno] for recno in range(len(products))]
+
+    def position(self, product, sort=CATALOG_ORDER):
+        recno = self._internal_key(self.key(product))
+        if recno is None:
+            raise KeyError(self.key(product))
+        return self._value_of(sort)(recno), recno
+
+    def _internal_key(self, key):
+        encoded, keys, order = encode_value(key), self._keys, self._key_order
+        i = bisect_left(order, encoded, key=keys.__getitem__)
+        if i < len(order) and keys[order[i]] == encoded:
+            return order[i]
+        return None
+
+    def _value_of(self, field):
+        if field is CATALOG_ORDER:
+            return self._seq.__getitem__
+        column = self._columns[field]
+
+        def value_of(recno):
+            value = column[recno]
+            return None if value != value else value
+        return value_of
+
+    def _source_keys(self, source):
+        _, kind, field, data = source
+        if kind == 'hash':
+            return iter(data)
+        lo, hi = data
+        return iter(self._sorted[field].recnos[lo:hi])
+
+
+class _Postings:
+    """term -> ``{record number: weighted term frequency}``, over the sorted vocabulary
+
+    A query probes a term's postings about once per candidate, which a dict
+    answers much faster than a bisection of the arrays, so the postings a
+    query reads are copied into dicts and the latest are kept, up to
+    POSTING_CACHE_ENTRIES in all.
+    """
+
+    def __init__(self, image):
+        self.terms = image.strings('search.terms')
+        self._starts = image.array('search.starts')
+        self._docs = image.array('search.docs')
+        self._frequencies = image.array('search.frequencies')
+        self._cache = {}
+        self._cached_entries = 0
+
+    def number(self, term):
+        """The term's number in the vocabulary, or -1"""
+        encoded, terms = _encode_term(term), self.terms
+        i = bisect_left(terms, encoded)
+        return i if i < len(terms) and terms[i] == encoded else -1
+
+    def count(self, term):
+        """How many products have ``term``"""
+        i = self.number(term)
+        return self._starts[i + 1] - self._starts[i] if i >= 0 else 0
+
+    def __contains__(self, term):
+        return term in self._cache or self.number(term) >= 0
+
+    def __getitem__(self, term):
+        posting = self._cache.get(term)
+        if posting is not None:
+            return posting
+        i = self.number(term)
+        if i < 0:
+            raise KeyError(term)
+        start, end = self._starts[i], self._starts[i + 1]
+        posting = dict(zip(self._docs[start:end], self._frequencies[start:end]))
+        if self._cached_entries + len(posting) > POSTING_CACHE_ENTRIES:
+            # Full: forget everything and start over with the terms queried from now on
+            self._cache.clear()
+            self._cached_entries = 0
+        self._cache[term] = posting
+        self._cached_entries += len(posting)
+        return posting
+
+
+class _Vocabulary:
+    """The sorted vocabulary as a sequence of strings"""
+
+    __slots__ = ('_terms',)
+
+    def __init__(self, terms):
+        self._terms = terms
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [_decode_term(self._terms[j]) for j in range(*i.indices(len(self._terms)))]
+        return _decode_term(self._terms[i])
+
+
+class _Deletes:
+    """deletion -> the vocabulary terms it comes from, as ``{term: None}``"""
+
+    __slots__ = ('_table', '_terms')
+
+    def __init__(self, table, terms):
+        self._table = table
+        self._terms = terms
+
+    def get(self, deletion, default=None):
+        numbers = self._table.get(_encode_term(deletion))
+        return default if numbers is None else dict.fromkeys(_decode_term(self._terms[number]) for number in numbers)
+
+
+class _Keys:
+    """Product keys by record number"""
+
+    __slots__ = ('_strings',)
+
+    def __init__(self, strings):
+        self._strings = strings
+
+    def __getitem__(self, recno):
+        return json.loads(self._strings[recno])
+
+
+class MappedSearchIndex(SearchIndex):
+    """A SearchIndex over an image: the same BM25 ranking, typo corrections and suggestions
+
+    Documents are record numbers. Writes raise ValueError.
+    """
+
+    add = update = remove = _read_only
+
+    def __init__(self, image, settings):
+        self.key = None
+        self.fields = {}
+        self.k1 = settings['k1']
+        self.b = settings['b']
+        self.min_typo_length = settings['min_typo_length']
+        self._lock = threading.RLock()
+        self._docs = range(image.count)
+        self._keys = _Keys(image.strings('keys'))
+        self._lengths = image.array('search.lengths')
+        self._total_length = settings['total_length']
+        self._postings = _Postings(image)
+        self._deletes = _Deletes(image.table('search.deletes'), self._postings.terms)
+        self._vocabulary = _Vocabulary(self._postings.terms)
+        self._pending = set()
+        self._dead = 0
+        self._average = None
+        self._base = self.k1 * (1 - self.b)
+        self._scale = 0.0
+        # Impact orders are still made on demand, and cached, per process
+        self._impacts = {}
+        self._impact_entries = 0
+
+    def _sorted_vocabulary(self):
+        return self._vocabulary
+
+    def _document_frequency(self, term):
+        return self._postings.count(term)
+
+
+class MappedRankings:
+    """Rankings.top() over an image's rankings"""
+
+    def __init__(self, image, store):
+        self.names = tuple(image._directory['rankings'])
+        self._table = image.table('rankings')
+        self._products = store._products
+
+    def top(self, name, k, category=None):
+        """The ``k`` best products by ranking ``name``, in the whole catalog or one ``category``"""
+        if name not in self.names:
+            raise ValueError(f"unknown ranking {name!r}; expected one of {', '.join(self.names)}")
+        recnos = self._table.get(encode_value([name] if category is None else [name, category]))
+        if recnos is None or k <= 0:
+            return []
+        return [self._products[recno] for recno in recnos[:k]]
@@ -0,0 +1,156 @@
+"""Brand/category classification and ASIN extraction for the ingest path
+
+The brand dictionary and category rules come from a JSON config file
+(backend/config/classifier.json by default) instead of being hardcoded, and the
+brand matcher is pluggable: ``aho-corasick`` scans a name once whatever the
+dictionary size, ``substring`` is the original one-``in``-test-per-brand loop
+(faster for a handful of brands), and ``auto`` picks between them by size.
+"""
+import json
+import os
+import re
+from collections import deque
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'config', 'classifier.json')
+
+# One pass over the URL instead of three separate searches
+ASIN_PATTERN = re.compile(r'(?:/dp/|/product/|ASIN=)([A-Z0-9]{10})', re.IGNORECASE)
+UNKNOWN_ASIN = 'UNKNOWN-ASIN'
+
+
+def extract_asin(url, default=UNKNOWN_ASIN):
+    """Extract ASIN from Amazon URL"""
+    match = ASIN_PATTERN.search(url)
+    return match.group(1) if match else default
+
+
+class SubstringMatcher:
+    """Test each brand in turn; cost grows with the dictionary size"""
+
+    def __init__(self, brands):
+        self.brands = list(brands)
+        self._needles = [(brand, brand.lower()) for brand in self.brands]
+
+    def match(self, text):
+        text = text.lower()
+        for brand, needle in self._needles:
+            if needle in text:
+                return brand
+        return None
+
+
+class AhoCorasickMatcher:
+    """Match every brand in a single pass over the text
+
+    The automaton is compiled to full transition tables (failure links folded
+    in), so each character costs one dict lookup. When several brands occur the
+    one listed first in the dictionary wins, as with SubstringMatcher.
+    """
+
+    def __init__(self, brands):
+        self.brands = list(brands)
+        goto = [{}]
+        best = [None]
+        for priority, brand in enumerate(self.brands):
+            state = 0
+            for ch in brand.lower():
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    best.append(None)
+                state = nxt
+            if best[state] is None or priority < best[state]:
+                best[state] = priority
+
+        # Breadth-first: fold failure transitions into each state's table and
+        # inherit the best brand ending at the failure state
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            table = dict(delta[fail[state]])
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                table[ch] = nxt
+                queue.append(nxt)
+            inherited = best[fail[state]]
+            if inherited is not None and (best[state] is None or inherited < best[state]):
+                best[state] = inherited
+            delta[state] = table
+        self._step = [table.get for table in delta]
+        # "No brand" sorts after every real priority so the scan needs a single comparison
+        self._none = len(self.brands)
+        self._best = [self._none if b is None else b for b in best]
+
+    def match(self, text):
+        step, best_at = self._step, self._best
+        state = 0
+        best = self._none
+        for ch in text.lower():
+            state = step[state](ch, 0)
+            if best_at[state] < best:
+                best = best_at[state]
+                if not best:
+                    break
+        return None if best == self._none else self.brands[best]
+
+
+def auto_matcher(brands, threshold=64):
+    """Substring tests run in C and win on short dictionaries; the automaton wins beyond"""
+    brands = list(brands)
+    return (SubstringMatcher if len(brands) <= threshold else AhoCorasickMatcher)(brands)
+
+
+BRAND_MATCHERS = {
+    'auto': auto_matcher,
+    'aho-corasick': AhoCorasickMatcher,
+    'substring': SubstringMatcher,
+}
+
+
+class Classifier:
+    """Derives brand and category for raw products from a dictionary config"""
+
+    def __init__(self, brands, category_rules=(), category_badges=None, default_brand='Unknown',
+                 default_category='General', brand_engine='auto'):
+        if brand_engine not in BRAND_MATCHERS:
+            raise ValueError(f"Unknown brand engine {brand_engine!r}; expected one of {', '.join(BRAND_MATCHERS)}")
+        self.matcher = BRAND_MATCHERS[brand_engine](brands)
+        self.default_brand = default_brand
+        self.default_category = default_category
+        self.category_rules = [tuple(rule) for rule in category_rules]
+        self._categories = dict(category_badges or {})
+        self._explicit = len(self._categories)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_CONFIG, **overrides):
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        config.update(overrides)
+        return cls(**config)
+
+    def brand(self, name):
+        return self.matcher.match(name) or self.default_brand
+
+    def category(self, badge):
+        """Category for a badge: explicit mapping first, then the rewrite rules (memoized)
+
+        Feeds may carry numbers (or anything JSON holds) as badges; they are read as their text.
+        """
+        if badge is None:
+            badge = self.default_category
+        elif not isinstance(badge, str):
+            badge = str(badge)
+        category = self._categories.get(badge)
+        if category is None:
+            category = badge
+            for old, new in self.category_rules:
+                category = category.replace(old, new)
+            # Badges are a small vocabulary; stop memoizing if a feed abuses the field
+            if len(self._categories) < self._explicit + 4096:
+                self._categories[badge] = category
+        return category
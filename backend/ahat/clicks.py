@@ -0,0 +1,326 @@
+"""Affiliate click tracking: a ring buffer on the request path, batched writes off it
+
+Recording a click appends ``(time, key)`` to a bounded in-memory ring buffer
+and counts it. It never waits for a flush, does no I/O and updates no per-key
+counter. A background writer calls flush() every second or so, which drains
+the buffer, appends the batch to a log with a single write and updates
+rolling per-key counters. When the
+writer falls so far behind that the buffer fills up, the oldest unflushed
+clicks are dropped (and counted) rather than slowing requests down.
+
+The log is plain text, one click per line: the Unix time in whole seconds,
+a tab and the key (an ASIN, usually). Batches are appended with O_APPEND, so
+several processes can share one log. Each process builds its counters from
+what the log holds rather than from its own clicks, reading back whatever
+was appended since it last looked, so every process counts every click.
+
+The log is rotated daily: a click goes to the file of its UTC day, named
+after the log with the date inserted (``clicks.log`` holds nothing;
+``clicks.2026-10-18.log`` that day's clicks). Files whose clicks have all
+expired are closed and deleted, so the log holds about a window's worth.
+
+Counts are kept for a rolling ``window`` split into ``buckets``: a click
+stops counting between ``window - window / buckets`` and ``window`` seconds
+after it was made, when its whole bucket expires. Opening a log replays only
+the lines of the last window: the files of the days it spans, from where the
+window starts in the first of them, found by bisection since a file is in
+(nearly) time order.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+
+DEFAULT_WINDOW = 24 * 3600
+DEFAULT_BUCKETS = 24
+DEFAULT_CAPACITY = 1 << 16
+# Longer keys, and keys with a tab or newline in them, are not tracked
+MAX_KEY_LENGTH = 1024
+# Lines of several processes interleave a little out of time order
+_REPLAY_SLACK = 300
+_READ_SIZE = 1 << 20
+# One log file per UTC day
+LOG_PERIOD = 24 * 3600
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def log_file(path, day):
+    """The file of the log ``path`` for day number ``day`` (UTC days since the epoch)"""
+    root, extension = os.path.splitext(path)
+    return f'{root}.{time.strftime("%Y-%m-%d", time.gmtime(day * LOG_PERIOD))}{extension}'
+
+
+class _LogFile:
+    """One day's file of the log: where its next line starts, and a partly written line before that"""
+
+    __slots__ = ('fd', 'offset', 'partial')
+
+    def __init__(self, fd, offset=0):
+        self.fd = fd
+        self.offset = offset
+        self.partial = b''
+
+
+def click_score(clicks, half=50):
+    """Clicks as a 0-100 popularity score: ``half`` clicks score 50, more approach 100"""
+    return 100 * clicks / (clicks + half) if clicks > 0 else 0
+
+
+class ClickTracker:
+    """Clicks per key over a rolling window, optionally logged (see open())"""
+
+    def __init__(self, window=DEFAULT_WINDOW, buckets=DEFAULT_BUCKETS, capacity=DEFAULT_CAPACITY,
+                 clock=time.time):
+        if window <= 0 or buckets < 1:
+            raise ValueError('window and buckets must be positive')
+        self.window = window
+        self.width = window / buckets
+        self.buckets = buckets
+        self.capacity = capacity
+        self.clock = clock
+        # A full deque drops its oldest entry on append; both are atomic, so the buffer needs no lock
+        self._buffer = deque(maxlen=capacity)
+        # Clicks recorded, under a lock of their own: _lock is held through a flush's I/O
+        self._recorded = 0
+        self._recorded_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # bucket number -> {key: clicks}, and the totals over every bucket
+        self._bucket_counts = {}
+        self._counts = {}
+        # Buckets up to this number have expired
+        self._oldest_expired = -1
+        # Keys whose count changed since take_changed()
+        self._changed = set()
+        # The log given to open(), and its files still read: day -> _LogFile
+        self._path = None
+        self._files = {}
+        # Files of days before this one have been deleted
+        self._first_day = None
+        self.flushed = 0
+        self.skipped = 0
+        self.version = 0
+
+    @property
+    def recorded(self):
+        """Clicks recorded since the start"""
+        return self._recorded
+
+    @property
+    def buffered(self):
+        """Clicks waiting for the next flush"""
+        return len(self._buffer)
+
+    @property
+    def dropped(self):
+        """Clicks lost because the buffer was full"""
+        return max(0, self.recorded - self.flushed - self.skipped - len(self._buffer))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def record(self, key):
+        """Count a click on ``key``; it is logged and counted at the next flush()"""
+        with self._recorded_lock:
+            self._recorded += 1
+        self._buffer.append((self.clock(), key))
+
+    def clicks(self, key):
+        """Clicks on ``key`` within the window, as of the last flush()"""
+        return self._counts.get(key, 0)
+
+    def counts(self):
+        """``{key: clicks}`` of every key clicked within the window"""
+        with self._lock:
+            return dict(self._counts)
+
+    def take_changed(self):
+        """Keys whose count has changed since the last call"""
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            return changed
+
+    def open(self, path):
+        """Count the clicks of the last window in the log ``path`` (see log_file()) and append to it
+
+        Returns the number of clicks replayed. Other processes may append to
+        the same log; flush() picks their clicks up too.
+        """
+        with self._lock:
+            if self._path is not None:
+                raise ValueError('click tracker is already attached to a log')
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            now = self.clock()
+            self._expire(now)
+            since = now - self.window - _REPLAY_SLACK
+            replayed = 0
+            try:
+                for day in range(int(since // LOG_PERIOD), int(now // LOG_PERIOD) + 1):
+                    try:
+                        fd = os.open(log_file(path, day), os.O_RDWR | os.O_APPEND)
+                    except FileNotFoundError:
+                        continue
+                    log = self._files[day] = _LogFile(fd, self._window_start(fd, since))
+                    replayed += self._read(log)
+                self._path = path
+                self._rotate(now)
+            except BaseException:
+                self._close()
+                raise
+            return replayed
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        for log in self._files.values():
+            os.close(log.fd)
+        self._files = {}
+        self._path = self._first_day = None
+
+    def flush(self):
+        """Log and count the buffered clicks, and expire old buckets; returns the clicks flushed
+
+        Raises OSError when the log cannot be appended to; the clicks are
+        still counted then, but are not in the log.
+        """
+        buffer = self._buffer
+        batch = []
+        # Clicks recorded meanwhile stay in the buffer for the next flush
+        for _ in range(len(buffer)):
+            at, key = buffer.popleft()
+            if key is None or len(key) > MAX_KEY_LENGTH or '\t' in key or '\n' in key:
+                self.skipped += 1
+                continue
+            batch.append((int(at), key))
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            self.flushed += len(batch)
+            if self._path is None:
+                for at, key in batch:
+                    self._count(at, key)
+                return len(batch)
+            self._rotate(now)
+            days = {}
+            for at, key in batch:
+                # A click from a day already rotated out would only be replayed, never counted
+                days.setdefault(max(at // LOG_PERIOD, self._first_day), []).append((at, key))
+            for day, clicks in days.items():
+                lines = ''.join(f'{at}\t{key}\n' for at, key in clicks).encode('utf-8')
+                try:
+                    os.write(self._file(day).fd, lines)
+                except OSError:
+                    for at, key in clicks:
+                        self._count(at, key)
+                    raise
+            # Ours and whatever other processes appended
+            for log in list(self._files.values()):
+                self._read(log)
+            return len(batch)
+
+    def _file(self, day):
+        """The open _LogFile of ``day``, created if need be"""
+        log = self._files.get(day)
+        if log is None:
+            fd = os.open(log_file(self._path, day), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            log = self._files[day] = _LogFile(fd)
+        return log
+
+    def _rotate(self, now):
+        """Open today's file, and close and delete the files whose clicks no longer count"""
+        # Other processes start appending to today's file without telling us
+        self._file(int(now // LOG_PERIOD))
+        first = int((now - self.window - _REPLAY_SLACK) // LOG_PERIOD)
+        for day in [day for day in self._files if day < first]:
+            os.close(self._files.pop(day).fd)
+        if self._first_day == first:
+            return
+        self._first_day = first
+        directory, name = os.path.split(os.path.abspath(self._path))
+        root, extension = os.path.splitext(name)
+        oldest = log_file(name, first)
+        for other in os.listdir(directory):
+            # Dates sort like the days they name
+            if (other.startswith(root + '.') and other.endswith(extension) and other < oldest
+                    and _DATE.fullmatch(other[len(root) + 1:len(other) - len(extension)])):
+                try:
+                    os.unlink(os.path.join(directory, other))
+                except FileNotFoundError:
+                    # Another process deleted it first
+                    pass
+
+    def _count(self, at, key):
+        """Count one click; False when it is too old to count"""
+        bucket = int(at // self.width)
+        if bucket <= self._oldest_expired:
+            return False
+        counts = self._bucket_counts.get(bucket)
+        if counts is None:
+            counts = self._bucket_counts[bucket] = {}
+        counts[key] = counts.get(key, 0) + 1
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._changed.add(key)
+        self.version += 1
+        return True
+
+    def _expire(self, now):
+        oldest_expired = int(now // self.width) - self.buckets
+        if oldest_expired <= self._oldest_expired:
+            return
+        self._oldest_expired = oldest_expired
+        totals = self._counts
+        for bucket in [bucket for bucket in self._bucket_counts if bucket <= oldest_expired]:
+            for key, clicks in self._bucket_counts.pop(bucket).items():
+                left = totals[key] - clicks
+                if left:
+                    totals[key] = left
+                else:
+                    del totals[key]
+                self._changed.add(key)
+            self.version += 1
+
+    def _read(self, log):
+        """Count the complete lines appended to a _LogFile since it was last read; returns how many"""
+        counted = 0
+        while True:
+            data = os.pread(log.fd, _READ_SIZE, log.offset)
+            if not data:
+                return counted
+            log.offset += len(data)
+            data = log.partial + data
+            end = data.rfind(b'\n') + 1
+            log.partial = data[end:]
+            if not end:
+                continue
+            for line in data[:end - 1].split(b'\n'):
+                at, _, key = line.partition(b'\t')
+                try:
+                    at = int(at)
+                except ValueError:
+                    continue
+                if key and self._count(at, key.decode('utf-8', 'replace')):
+                    counted += 1
+
+    @staticmethod
+    def _window_start(fd, since):
+        """An offset in the log at or before its first line made at ``since`` or later"""
+        low, high = 0, os.fstat(fd).st_size
+        while high - low > _READ_SIZE:
+            middle = (low + high) // 2
+            data = os.pread(fd, 4096, middle)
+            start = data.find(b'\n') + 1
+            end = data.find(b'\n', start)
+            try:
+                at = int(data[start:end].partition(b'\t')[0]) if start and end > 0 else None
+            except ValueError:
+                at = None
+            if at is None:
+                # No whole line to go by: read from further back
+                high = middle
+            elif at < since:
+                low = middle + start
+            else:
+                high = middle
+        return low
@@ -0,0 +1,160 @@
+"""Cached, stale-while-revalidate wrapper around an upstream product feed"""
+import threading
+import time
+
+
+class FeedCache:
+    """Keeps the last good result of ``fetch`` and refreshes it at most once at a time.
+
+    * Fresh (younger than ``ttl``): served straight from memory.
+    * Stale (younger than ``ttl + stale_ttl``): served immediately while a
+      single background refresh runs.
+    * Expired or empty: the caller waits for a refresh, but concurrent callers
+      share that one fetch instead of each starting their own.
+
+    A failed fetch (exception or empty result) is cached too: no new attempt is
+    made until the backoff window passes, and the window doubles on every
+    consecutive failure up to ``max_backoff``.
+    """
+
+    def __init__(self, fetch, ttl=300, stale_ttl=3600, failure_backoff=5, max_backoff=300, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.failure_backoff = failure_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._value = None
+        self._fetched_at = None
+        self._generation = 0
+        self._inflight = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.last_error = None
+
+    @property
+    def generation(self):
+        """Incremented every time a new value is stored"""
+        return self._generation
+
+    def get(self):
+        """Return ``(value, state)`` where state is fresh, stale, miss or failed"""
+        value, state, _ = self.get_versioned()
+        return value, state
+
+    def get_versioned(self):
+        """Like get(), plus the generation that produced the returned value"""
+        with self._lock:
+            now = self.clock()
+            age = None if self._fetched_at is None else now - self._fetched_at
+            if age is not None and age < self.ttl:
+                return self._value, 'fresh', self._generation
+
+            backing_off = now < self._retry_at
+            if age is not None and age < self.ttl + self.stale_ttl:
+                if not backing_off:
+                    self._start_refresh(background=True)
+                return self._value, 'stale', self._generation
+
+            if backing_off:
+                return self._value, 'failed', self._generation
+            inflight, owner = self._start_refresh(background=False)
+
+        if owner:
+            self._run(inflight)
+        inflight.wait()
+        with self._lock:
+            if self._fetched_at is not None and inflight.ok:
+                return self._value, 'miss', self._generation
+            return self._value, 'failed', self._generation
+
+    def refresh(self):
+        """Fetch now (joining a refresh already in progress) and return success"""
+        with self._lock:
+            inflight, owner = self._start_refresh(background=False)
+        if owner:
+            self._run(inflight)
+        inflight.wait()
+        return inflight.ok
+
+    def prime(self, value, age=0.0):
+        """Store a value obtained elsewhere ``age`` seconds ago (restored from disk, say)
+
+        It is served like a fetched value, fresh or stale by its age, but never
+        as expired: however old, the first request gets it at once while a
+        background refresh runs (unless ``stale_ttl`` is 0).
+        """
+        with self._lock:
+            self._value = value
+            self._fetched_at = self.clock() - min(max(age, 0.0), self.ttl)
+            self._generation += 1
+
+    def replace(self, old, new):
+        """Swap a cached ``old`` value for ``new``, an equivalent one, keeping its age; returns whether it did
+
+        For a value made faster to serve or writable without being fetched
+        again: nothing is done when ``old`` has been replaced meanwhile.
+        """
+        with self._lock:
+            if self._value is not old:
+                return False
+            self._value = new
+            self._generation += 1
+            return True
+
+    def invalidate(self):
+        """Forget the cached value and any failure backoff"""
+        with self._lock:
+            self._fetched_at = None
+            self._failures = 0
+            self._retry_at = 0.0
+
+    def _start_refresh(self, background):
+        # Must be called with the lock held. Joins the in-flight refresh if there
+        # is one; otherwise the caller becomes its owner and runs the fetch once
+        # the lock is released (or a daemon thread does, for background refreshes).
+        if self._inflight is not None:
+            return self._inflight, False
+        self._inflight = _Inflight()
+        if background:
+            threading.Thread(target=self._run, args=(self._inflight,), daemon=True).start()
+            return self._inflight, False
+        return self._inflight, True
+
+    def _run(self, inflight):
+        try:
+            value = self.fetch()
+            error = None if value else ValueError('upstream returned no products')
+        except Exception as e:
+            value, error = None, e
+
+        with self._lock:
+            now = self.clock()
+            if error is None:
+                self._value = value
+                self._fetched_at = now
+                self._generation += 1
+                self._failures = 0
+                self._retry_at = 0.0
+                self.last_error = None
+            else:
+                self._failures += 1
+                backoff = min(self.max_backoff, self.failure_backoff * 2 ** (self._failures - 1))
+                self._retry_at = now + backoff
+                self.last_error = error
+            inflight.ok = error is None
+            self._inflight = None
+        inflight.done.set()
+
+
+class _Inflight:
+    __slots__ = ('done', 'ok')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+
+    def wait(self):
+        self.done.wait()
@@ -0,0 +1,240 @@
+"""Streaming bulk import of merchant product feeds
+
+Feeds are parsed record by record (JSON array, NDJSON or CSV), normalized in
+batches and handed to a sink (usually ``ProductStore.load``), so neither the
+raw file nor the full list of parsed records is ever held in memory at once.
+"""
+import csv
+import gc
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+FORMATS = ('json', 'ndjson', 'csv')
+DEFAULT_BATCH_SIZE = 5000
+CHUNK_SIZE = 64 * 1024
+# A JSON record that still doesn't parse at this size is treated as malformed
+MAX_RECORD_CHARS = 16 * 1024 * 1024
+
+EXTENSIONS = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv'}
+CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+ImportReport = namedtuple('ImportReport', [
+    'format',
+    'rows',
+    'batches',
+    'seconds',
+    'rows_per_second',
+    'peak_rss_bytes',  # high-water mark of the whole process, None where unsupported
+])
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Yield the objects of a top-level JSON array without reading the whole array"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill(buf, pos, size):
+        chunk = stream.read(size)
+        return buf[pos:] + chunk, 0, not chunk
+
+    def skip_space(buf, pos, eof):
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf, pos, eof
+            buf, pos, eof = fill(buf, pos, chunk_size)
+
+    buf, pos, eof = skip_space(buf, pos, eof)
+    if buf[pos:pos + 1] != '[':
+        raise ValueError('JSON feed must be an array of products')
+    pos += 1
+    count = 0
+    while True:
+        buf, pos, eof = skip_space(buf, pos, eof)
+        if buf[pos:pos + 1] == ']' and count == 0:
+            return
+        while True:
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError as e:
+                if eof or len(buf) - pos > MAX_RECORD_CHARS:
+                    raise ValueError(f'invalid JSON in record {count + 1}: {e.msg}') from None
+                # Read at least as much again as is buffered, so a huge record costs linear time
+                buf, pos, eof = fill(buf, pos, max(chunk_size, len(buf) - pos))
+        if not isinstance(record, dict):
+            raise ValueError(f'record {count + 1} is not a JSON object')
+        count += 1
+        yield record
+        buf, pos, eof = skip_space(buf, end, eof)
+        separator = buf[pos:pos + 1]
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f"expected ',' or ']' after record {count}")
+        pos += 1
+
+
+def iter_ndjson(stream):
+    """Yield one object per non-blank line"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'invalid JSON on line {number}: {e.msg}') from None
+        if not isinstance(record, dict):
+            raise ValueError(f'line {number} is not a JSON object')
+        yield record
+
+
+def iter_csv(stream):
+    """Yield one dict per row, keyed by the header row"""
+    yield from csv.DictReader(stream)
+
+
+PARSERS = {'json': iter_json_array, 'ndjson': iter_ndjson, 'csv': iter_csv}
+
+
+def detect_format(path=None, content_type=None):
+    """Feed format from a file extension (``.gz`` ignored) or a Content-Type, or None"""
+    if path:
+        root, ext = os.path.splitext(path.lower())
+        if ext == '.gz':
+            ext = os.path.splitext(root)[1]
+        return EXTENSIONS.get(ext)
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+    return None
+
+
+def open_feed(path, fmt=None):
+    """Open a feed file as text (transparently gunzipping ``.gz``); returns ``(stream, format)``"""
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f"cannot tell the format of {path}; pass one of {', '.join(FORMATS)}")
+    opener = gzip.open if path.lower().endswith('.gz') else open
+    # newline='' lets the csv module handle quoted line breaks itself
+    return opener(path, 'rt', encoding='utf-8-sig', newline=''), fmt
+
+
+def text_stream(binary, encoding='utf-8-sig'):
+    """Decode a binary file-like object (e.g. a request body) incrementally"""
+    if not isinstance(binary, io.BufferedIOBase):
+        binary = io.BufferedReader(binary)
+    return io.TextIOWrapper(binary, encoding=encoding, newline='')
+
+
+class LimitedReader(io.RawIOBase):
+    """Read at most ``length`` bytes from a stream (a request body with Content-Length)"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        data = self.stream.read(min(len(buffer), self.remaining))
+        if not data:
+            raise ValueError('request body ended early')
+        self.remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def batched(records, size):
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+_gc_lock = threading.Lock()
+_gc_pauses = 0
+_gc_was_enabled = False
+
+
+@contextmanager
+def gc_paused():
+    """Pause the cyclic garbage collector for a bulk load at startup or from the command line
+
+    An import allocates millions of long-lived containers (products, index
+    entries) and the collector would rescan all of them every few thousand
+    allocations; for the whole process this makes loading several times slower.
+    The collector is off for every thread meanwhile, so this is not for loads
+    made while requests are served. Overlapping pauses share one: the
+    collector comes back on when the last of them ends.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if not _gc_pauses:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if not _gc_pauses and _gc_was_enabled:
+                gc.enable()
+
+
+def import_feed(stream, fmt, normalize, sink, batch_size=DEFAULT_BATCH_SIZE, clock=time.perf_counter,
+                pause_gc=False):
+    """Parse ``stream``, normalize each batch and pass it to ``sink``; returns an ImportReport
+
+    ``normalize(records, start)`` receives the raw records of a batch and the
+    number of rows before it, and returns the products to give to ``sink``.
+    ``pause_gc`` runs the import under gc_paused(), for imports with nothing
+    else running.
+    """
+    if fmt not in PARSERS:
+        raise ValueError(f"unknown feed format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if batch_size < 1:
+        raise ValueError('batch size must be at least 1')
+    started = clock()
+    rows = batches = 0
+    with gc_paused() if pause_gc else nullcontext():
+        for batch in batched(PARSERS[fmt](stream), batch_size):
+            sink(normalize(batch, rows))
+            rows += len(batch)
+            batches += 1
+    seconds = clock() - started
+    return ImportReport(fmt, rows, batches, round(seconds, 3),
+                        round(rows / seconds) if seconds > 0 else None, peak_rss_bytes())
@@ -0,0 +1,67 @@
+"""Sparse fieldsets: ``fields=`` projections of product records
+
+A projection is parsed once per request from a comma-separated list of field
+names and preset names (``fields=card,description``) and applied only to the
+records actually returned. Nested objects can be narrowed one level deep with
+dotted names (``price.discounted``).
+"""
+from collections.abc import Mapping
+
+
+def parse_fields(value, fields, presets):
+    """Compile a ``fields=`` value into a projection for project(), or None for whole records
+
+    ``value`` is a string or the list parse_qs gives for repeated parameters.
+    ``fields`` lists every selectable field in the order records should keep;
+    ``presets`` maps names to field lists, or to None for "everything".
+    Raises ValueError for unknown names.
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    selected = set()
+    for name in (part.strip() for item in value for part in item.split(',')):
+        if not name:
+            continue
+        if name in presets:
+            expansion = presets[name]
+            if expansion is None:
+                return None
+            selected.update(expansion)
+        elif name in fields:
+            selected.add(name)
+        else:
+            raise ValueError(f"unknown field {name!r}; expected one of {', '.join(list(presets) + list(fields))}")
+    if not selected:
+        return None
+
+    projection = {}
+    for path in fields:
+        if path not in selected:
+            continue
+        head, _, rest = path.partition('.')
+        if not rest:
+            projection[head] = None
+        elif projection.get(head, ()) is not None:
+            projection.setdefault(head, []).append(rest)
+    return projection
+
+
+def project(records, projection):
+    """The requested fields of each record (records as they are when ``projection`` is None)"""
+    if projection is None:
+        return records
+    return [project_one(record, projection) for record in records]
+
+
+def project_one(record, projection):
+    projected = {}
+    for key, subfields in projection.items():
+        if key not in record:
+            continue
+        value = record[key]
+        if subfields is not None and isinstance(value, Mapping):
+            value = {name: value[name] for name in subfields if name in value}
+        projected[key] = value
+    return projected
@@ -0,0 +1,86 @@
+"""Pooled HTTP client for upstream fetches, with conditional GETs"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+
+
+class UpstreamClient:
+    """One keep-alive connection pool shared by every upstream fetch
+
+    ``get(url, parse)`` remembers the validators (ETag / Last-Modified) of the
+    last response it parsed for that URL and parser, and sends them back. A 304
+    returns the earlier parse result as is: the page is neither downloaded nor
+    parsed again, and whatever was built from it (a whole catalog) is reused.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, headers=None):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self._lock = threading.Lock()
+        self._validated = {}
+        self.requests = 0
+        self.not_modified = 0
+
+    def get(self, url, parse, timeout=None):
+        """Return ``(parse(body), changed)``; ``changed`` is False when upstream answered 304"""
+        key = (url, parse)
+        cached = self._validated.get(key)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.session.get(url, headers=headers, timeout=timeout or self.timeout)
+        with self._lock:
+            self.requests += 1
+        if response.status_code == 304 and cached is not None:
+            with self._lock:
+                self.not_modified += 1
+            return cached[2], False
+        response.raise_for_status()
+
+        value = parse(response.content)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._lock:
+            # Nothing worth reusing (or no validators): fetch in full next time
+            if value and (etag or last_modified):
+                self._validated[key] = (etag, last_modified, value)
+            else:
+                self._validated.pop(key, None)
+        return value, True
+
+    def fetch(self, url, max_bytes, timeout=None):
+        """``(body, content_type)`` of ``url``, without validators; ValueError if the body is over ``max_bytes``
+
+        For one-off downloads (an image, say) whose bytes the caller caches itself.
+        """
+        with self.session.get(url, timeout=timeout or self.timeout, stream=True) as response:
+            with self._lock:
+                self.requests += 1
+            response.raise_for_status()
+            body = response.raw.read(max_bytes + 1, decode_content=True)
+            if len(body) > max_bytes:
+                raise ValueError(f'{url} is larger than {max_bytes} bytes')
+            return body, response.headers.get('Content-Type')
+
+    def forget(self):
+        """Drop all validators so the next fetch of every URL is unconditional"""
+        with self._lock:
+            self._validated.clear()
+
+    def close(self):
+        self.session.close()
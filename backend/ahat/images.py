@@ -0,0 +1,384 @@
+"""Product image thumbnails: fetched once, resized off the request path, cached on disk and in memory
+
+Product cards show upstream images (Amazon's, mostly) at a fraction of their
+size. ``ImageProxy.get(url, width)`` returns a Thumbnail of the image no wider
+than ``width``, rounded up to one of a few WIDTHS so a handful of sizes are
+cached per image:
+
+* With Pillow installed, the original is downloaded once through the pooled
+  upstream client (and kept on disk), and every width is decoded, scaled
+  down and re-encoded in a process pool, off the request threads.
+* Without it, Amazon-style file names that carry a size modifier
+  (``61E3AcWQg1L._AC_SX425_.jpg``) are rewritten to ask the image CDN for
+  the width wanted; other images are served as they are.
+
+Thumbnails live in an ``ImageCache``: an in-memory LRU bounded in bytes in
+front of a directory bounded the same way. Concurrent requests for the same
+thumbnail share one download and resize, and an image that could not be
+fetched is not tried again for ``failure_ttl`` seconds.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are then what the image CDN can resize (see cdn_variant)
+    Image = None
+
+# Widths served; a requested width is rounded up to the next one
+WIDTHS = (80, 160, 240, 320, 480, 640, 960)
+DEFAULT_WIDTH = 320
+MAX_SOURCE_BYTES = 10 * 2**20
+JPEG_QUALITY = 82
+FAILURE_TTL = 60
+DEFAULT_MEMORY_BYTES = 64 * 2**20
+DEFAULT_DISK_BYTES = 512 * 2**20
+DEFAULT_WORKERS = 2
+
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp', '.gif': 'image/gif'}
+EXTENSIONS = {content_type: extension for extension, content_type in CONTENT_TYPES.items()}
+
+Thumbnail = namedtuple('Thumbnail', ['body', 'content_type', 'etag'])
+
+# name._MODIFIERS_.ext, as in https://m.media-amazon.com/images/I/61E3AcWQg1L._AC_SX425_.jpg
+_SIZED_NAME = re.compile(r'^(?P<base>[^?#]*/[^/.]+)\._[^/?#]*_\.(?P<ext>jpe?g|png|gif|webp)$', re.IGNORECASE)
+
+
+class ImageError(Exception):
+    """An image could not be fetched or decoded"""
+
+
+def thumbnail_width(requested):
+    """The width served for ``requested``: the next of WIDTHS up (the largest for anything wider)"""
+    if requested < 1:
+        raise ValueError('w must be at least 1')
+    for width in WIDTHS:
+        if width >= requested:
+            return width
+    return WIDTHS[-1]
+
+
+def cdn_variant(url, width):
+    """The URL of the image CDN's own ``width`` pixel wide version of ``url``; None when it has none"""
+    match = _SIZED_NAME.match(url)
+    if match is None:
+        return None
+    return f"{match['base']}._AC_SX{width}_.{match['ext']}"
+
+
+def make_thumbnail(body, content_type):
+    return Thumbnail(body, content_type, '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest())
+
+
+def resize(data, width, quality=JPEG_QUALITY):
+    """``(body, content_type)``: ``data`` scaled down (never up) to ``width`` pixels wide and re-encoded
+
+    Runs in the proxy's worker processes. Images with transparency stay PNG,
+    everything else becomes a progressive JPEG.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            # JPEGs decode straight to a nearby smaller scale, far faster than in full
+            image.draft('RGB', (width, height))
+            image = image.resize((width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image.save(out, 'PNG', optimize=True)
+            return out.getvalue(), 'image/png'
+        image.convert('RGB').save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return out.getvalue(), 'image/jpeg'
+
+
+class ImageCache:
+    """Thumbnails by key: an LRU of at most ``memory_bytes`` in front of ``directory`` (at most ``disk_bytes``)
+
+    Without a directory only the memory LRU is kept. Files are named after a
+    hash of the key, with the extension of their content type; a directory
+    left by an earlier run is reused, least recently written first out.
+    """
+
+    def __init__(self, directory=None, memory_bytes=DEFAULT_MEMORY_BYTES, disk_bytes=DEFAULT_DISK_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        # key -> Thumbnail, and file name -> size, least recently used first
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._files = OrderedDict()
+        self._disk_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            found = []
+            for entry in os.scandir(directory):
+                if entry.is_file() and os.path.splitext(entry.name)[1] in CONTENT_TYPES:
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+            for _, name, size in sorted(found):
+                self._files[name] = size
+                self._disk_size += size
+            self._evict_files()
+
+    @property
+    def memory_size(self):
+        return self._memory_size
+
+    @property
+    def disk_size(self):
+        return self._disk_size
+
+    def __len__(self):
+        return len(self._memory)
+
+    def get(self, key, memory=True):
+        """The Thumbnail cached for ``key``, or None; ``memory=False`` leaves one read from disk out of memory"""
+        with self._lock:
+            thumbnail = self._memory.get(key)
+            if thumbnail is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return thumbnail
+            name = self._file_name(key)
+            if name is None:
+                self.misses += 1
+                return None
+            self._files.move_to_end(name)
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            # Removed by another process sharing the directory
+            with self._lock:
+                self._forget_file(name)
+                self.misses += 1
+            return None
+        thumbnail = make_thumbnail(body, CONTENT_TYPES[os.path.splitext(name)[1]])
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+            if memory:
+                self._remember(key, thumbnail)
+        return thumbnail
+
+    def put(self, key, thumbnail, memory=True):
+        """Cache ``thumbnail``; ``memory=False`` keeps it on disk only (a large original, say)"""
+        if self.directory:
+            name = self._hash(key) + EXTENSIONS.get(thumbnail.content_type, '.jpg')
+            # A full or read-only disk leaves the memory LRU working
+            if self._write_file(name, thumbnail.body):
+                with self._lock:
+                    self._forget_file(name)
+                    self._files[name] = len(thumbnail.body)
+                    self._disk_size += len(thumbnail.body)
+                    self._evict_files()
+        if memory:
+            with self._lock:
+                self._remember(key, thumbnail)
+
+    def _write_file(self, name, body):
+        try:
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(temporary, os.path.join(self.directory, name))
+        except OSError:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _remember(self, key, thumbnail):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old.body)
+        if len(thumbnail.body) > self.memory_bytes:
+            return
+        self._memory[key] = thumbnail
+        self._memory_size += len(thumbnail.body)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.body)
+
+    def _file_name(self, key):
+        if not self.directory:
+            return None
+        prefix = self._hash(key)
+        for extension in CONTENT_TYPES:
+            if prefix + extension in self._files:
+                return prefix + extension
+        # Written by another process sharing the directory?
+        for extension in CONTENT_TYPES:
+            try:
+                size = os.stat(os.path.join(self.directory, prefix + extension)).st_size
+            except OSError:
+                continue
+            self._files[prefix + extension] = size
+            self._disk_size += size
+            return prefix + extension
+        return None
+
+    def _forget_file(self, name):
+        size = self._files.pop(name, None)
+        if size is not None:
+            self._disk_size -= size
+
+    def _evict_files(self):
+        while self._disk_size > self.disk_bytes and self._files:
+            name, size = self._files.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ImageProxy:
+    """Thumbnails of upstream images by URL and width, through ``client`` (an UpstreamClient) and ``cache``"""
+
+    def __init__(self, client, cache, workers=DEFAULT_WORKERS, max_source_bytes=MAX_SOURCE_BYTES,
+                 quality=JPEG_QUALITY, failure_ttl=FAILURE_TTL, clock=time.monotonic):
+        self.client = client
+        self.cache = cache
+        self.workers = workers
+        self.max_source_bytes = max_source_bytes
+        self.quality = quality
+        self.failure_ttl = failure_ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> Future of the thumbnail being made, shared by every request waiting for it
+        self._pending = {}
+        # key -> (retry after, error)
+        self._failures = {}
+        self._pool = None
+        self.fetches = 0
+        self.resizes = 0
+
+    @property
+    def resizing(self):
+        """Whether thumbnails are resized here (Pillow is installed) rather than by the image CDN"""
+        return Image is not None
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def get(self, url, width):
+        """The Thumbnail of ``url`` for a card ``width`` pixels wide; raises ImageError"""
+        width = thumbnail_width(width)
+        if Image is None and cdn_variant(url, width) is None:
+            # Served as it is, whatever the width
+            width = 0
+        key = f'{width} {url}'
+        thumbnail = self.cache.get(key)
+        if thumbnail is not None:
+            return thumbnail
+        with self._lock:
+            failed = self._failures.get(key)
+            if failed is not None:
+                if failed[0] > self.clock():
+                    raise failed[1]
+                del self._failures[key]
+            future = self._pending.get(key)
+            making = future is None
+            if making:
+                future = self._pending[key] = Future()
+        if not making:
+            return future.result()
+        try:
+            # Made by another request between the cache miss and now?
+            thumbnail = self.cache.get(key) or self._make(url, width)
+        except ImageError as e:
+            with self._lock:
+                self._failures[key] = (self.clock() + self.failure_ttl, e)
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        self.cache.put(key, thumbnail)
+        with self._lock:
+            del self._pending[key]
+        future.set_result(thumbnail)
+        return thumbnail
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _make(self, url, width):
+        if Image is None:
+            body, content_type = self._fetch(cdn_variant(url, width) if width else url)
+            return make_thumbnail(body, content_type)
+        source = self.cache.get(f'source {url}', memory=False)
+        if source is None:
+            source = make_thumbnail(*self._fetch(url))
+            # Kept for the other widths, but not in memory: originals are large
+            self.cache.put(f'source {url}', source, memory=False)
+        pool = self._resizer()
+        try:
+            body, content_type = pool.submit(resize, source.body, width, self.quality).result()
+        except BrokenProcessPool as e:
+            # A resizing process died (killed, or out of memory on some image): the
+            # pool takes no more work, so the next resize starts a new one
+            self._drop_resizer(pool)
+            raise ImageError(f'{url} could not be resized: the resizing process died') from e
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageError(f'{url} could not be resized: {e}') from e
+        self.resizes += 1
+        return make_thumbnail(body, content_type)
+
+    def _fetch(self, url):
+        try:
+            body, content_type = self.client.fetch(url, self.max_source_bytes)
+        except (OSError, ValueError) as e:
+            raise ImageError(f'{url} could not be fetched: {e}') from e
+        self.fetches += 1
+        content_type = (content_type or '').split(';')[0].strip().lower()
+        if content_type not in EXTENSIONS:
+            raise ImageError(f'{url} is not an image ({content_type or "no content type"})')
+        return body, content_type
+
+    def _resizer(self):
+        with self._lock:
+            if self._pool is None:
+                # Forked from a clean server process, not from this one and its request threads
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+            return self._pool
+
+    def _drop_resizer(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,162 @@
+"""Pull a JavaScript array literal (``const products = [...]``) out of a raw page
+
+The page is never parsed as HTML: the declaration is found with one bytes
+regex, and only the rest of its script element is decoded and parsed.
+Literals that are valid JSON go through the C JSON decoder; anything else
+falls back to a small tolerant parser that accepts what hand-written JS
+usually contains (single or backtick quotes, unquoted keys, trailing commas,
+comments, ``undefined``). ``NaN`` and ``Infinity``, which JSON cannot hold,
+read as None.
+"""
+import json
+import re
+
+# json also takes NaN and [-]Infinity, which the API could not encode again
+_DECODER = json.JSONDecoder(parse_constant=lambda constant: None)
+
+_SPACE = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.DOTALL)
+_NUMBER = re.compile(r'[+-]?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+_IDENTIFIER = re.compile(r'[A-Za-z_$][\w$]*')
+_KEYWORD = re.compile(r'[+-]?[A-Za-z_$][\w$]*')
+_STRINGS = {
+    '"': re.compile(r'"((?:[^"\\]|\\.)*)"', re.DOTALL),
+    "'": re.compile(r"'((?:[^'\\]|\\.)*)'", re.DOTALL),
+    '`': re.compile(r'`((?:[^`\\$]|\\.|\$(?!\{))*)`', re.DOTALL),
+}
+_ESCAPE = re.compile(r'\\(u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2}'
+                     r'|u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)', re.DOTALL)
+_SIMPLE_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0',
+                   '\n': '', '\r\n': '', '\u2028': '', '\u2029': ''}
+_KEYWORDS = {'true': True, 'false': False, 'null': None, 'undefined': None,
+             'NaN': None, 'Infinity': None, '+Infinity': None, '-Infinity': None}
+# Where a script element ends: its text cannot hold this, so neither can the literal
+_SCRIPT_END = re.compile(rb'</script', re.IGNORECASE)
+
+
+class JSLiteralError(ValueError):
+    def __init__(self, message, pos):
+        super().__init__(f'{message} at offset {pos}')
+        self.pos = pos
+
+
+def declaration_pattern(name):
+    """Bytes regex matching ``const|let|var <name> = [`` up to the bracket"""
+    return re.compile(rb'\b(?:const|let|var)\s+' + re.escape(name.encode()) + rb'\s*=\s*(?=\[)')
+
+
+PRODUCTS_DECLARATION = declaration_pattern('products')
+
+
+def extract_array(page, declaration=PRODUCTS_DECLARATION, encoding='utf-8'):
+    """Return the array assigned by ``declaration`` in ``page`` (bytes), or None if absent"""
+    match = declaration.search(page)
+    if match is None:
+        return None
+    # Only the script holding the literal is decoded, not the rest of the page (a
+    # script file has no end tag). Both decoders stop at the array's closing bracket
+    end = _SCRIPT_END.search(page, match.end())
+    text = page[match.end():end.start() if end else None].decode(encoding, 'replace')
+    try:
+        value, _ = _DECODER.raw_decode(text)
+    except ValueError:
+        value, _ = parse_literal(text)
+    return value
+
+
+def parse_literal(text, pos=0):
+    """Parse one JS literal starting at ``pos``; returns ``(value, end)``"""
+    return _Parser(text).value(pos)
+
+
+def _unescape(match):
+    escape = match.group(1)
+    if len(escape) == 11:
+        # A UTF-16 surrogate pair, as JSON.stringify writes characters outside the BMP
+        high, low = int(escape[1:5], 16), int(escape[7:], 16)
+        return chr(0x10000 + ((high - 0xD800) << 10) + (low - 0xDC00))
+    if escape[0] == 'u':
+        return chr(int(escape[2:-1] if escape[1] == '{' else escape[1:], 16))
+    if escape[0] == 'x' and len(escape) == 3:
+        return chr(int(escape[1:], 16))
+    return _SIMPLE_ESCAPES.get(escape, escape)
+
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+
+    def skip(self, pos):
+        return _SPACE.match(self.text, pos).end()
+
+    def value(self, pos):
+        pos = self.skip(pos)
+        ch = self.text[pos:pos + 1]
+        if ch == '[':
+            return self.array(pos + 1)
+        if ch == '{':
+            return self.object(pos + 1)
+        if ch in _STRINGS:
+            return self.string(pos)
+        match = _NUMBER.match(self.text, pos)
+        if match:
+            number = match.group()
+            if 'x' in number or 'X' in number:
+                return int(number, 16), match.end()
+            if any(c in number for c in '.eE'):
+                return float(number), match.end()
+            return int(number), match.end()
+        match = _KEYWORD.match(self.text, pos)
+        if match and match.group() in _KEYWORDS:
+            return _KEYWORDS[match.group()], match.end()
+        raise JSLiteralError('unexpected ' + (repr(ch) if ch else 'end of input'), pos)
+
+    def string(self, pos):
+        match = _STRINGS[self.text[pos]].match(self.text, pos)
+        if match is None:
+            raise JSLiteralError('unterminated string', pos)
+        raw = match.group(1)
+        return (_ESCAPE.sub(_unescape, raw) if '\\' in raw else raw), match.end()
+
+    def array(self, pos):
+        items = []
+        while True:
+            pos = self.skip(pos)
+            if self.text[pos:pos + 1] == ']':
+                return items, pos + 1
+            item, pos = self.value(pos)
+            items.append(item)
+            pos, closed = self.separator(pos, ']')
+            if closed:
+                return items, pos
+
+    def object(self, pos):
+        obj = {}
+        while True:
+            pos = self.skip(pos)
+            ch = self.text[pos:pos + 1]
+            if ch == '}':
+                return obj, pos + 1
+            if ch in _STRINGS:
+                key, pos = self.string(pos)
+            else:
+                match = _IDENTIFIER.match(self.text, pos) or _NUMBER.match(self.text, pos)
+                if match is None:
+                    raise JSLiteralError('expected a property name', pos)
+                key, pos = match.group(), match.end()
+            pos = self.skip(pos)
+            if self.text[pos:pos + 1] != ':':
+                raise JSLiteralError("expected ':'", pos)
+            obj[key], pos = self.value(pos + 1)
+            pos, closed = self.separator(pos, '}')
+            if closed:
+                return obj, pos
+
+    def separator(self, pos, close):
+        """Consume ``,`` (a trailing one is fine) or the closing bracket; returns ``(pos, closed)``"""
+        pos = self.skip(pos)
+        ch = self.text[pos:pos + 1]
+        if ch == close:
+            return pos + 1, True
+        if ch == ',':
+            return pos + 1, False
+        raise JSLiteralError(f"expected ',' or {close!r}", pos)
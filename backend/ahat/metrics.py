@@ -0,0 +1,373 @@
+"""In-process metrics in the Prometheus text format, plus sampled request profiling
+
+Counters, gauges and histograms live in a ``Registry`` whose ``render()``
+output is served at ``/metrics``. Recording costs a dict lookup, a short lock
+and a few additions; formatting and cumulative bucket sums are left to scrape
+time. Figures that are already counted elsewhere (response cache hits,
+upstream 304s) are read through ``Registry.callback`` when scraped rather than
+being counted twice on the hot path.
+"""
+import bisect
+import cProfile
+import io
+import math
+import pstats
+import random
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; request latencies on a warm cache are well under a millisecond
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Seconds for a whole upstream refresh
+SCRAPE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Value:
+    """One counter or gauge series"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _Buckets:
+    """One histogram series: a count per bucket (not yet cumulative) and a running sum"""
+
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # Buckets are "less than or equal"; the last slot is +Inf
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class Metric:
+    """A metric family; ``labels(*values)`` returns the series for those label values"""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} takes labels {self.labelnames}, got {values}')
+            with self._lock:
+                series = self._series.setdefault(tuple(str(v) for v in values), self._new_series())
+                self._series.setdefault(values, series)
+        return series
+
+    def _new_series(self):
+        return _Value()
+
+    def samples(self):
+        """Yield ``(suffix, labels, value)`` for every series"""
+        seen = set()
+        for values, series in list(self._series.items()):
+            if id(series) in seen:
+                continue
+            seen.add(id(series))
+            yield '', dict(zip(self.labelnames, values)), series.value
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        seen = set()
+        for values, series in list(self._series.items()):
+            if id(series) in seen:
+                continue
+            seen.add(id(series))
+            labels = dict(zip(self.labelnames, values))
+            with series._lock:
+                counts = list(series.counts)
+                total = series.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', dict(labels, le=_format_value(bound)), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+
+class _Callback(Metric):
+    """A metric whose values are read from ``collect()`` at scrape time"""
+
+    def __init__(self, name, help, kind, collect, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        value = self.collect()
+        if not self.labelnames:
+            yield '', {}, value
+            return
+        for values, number in value.items():
+            yield '', dict(zip(self.labelnames, values)), number
+
+
+class Registry:
+    """The metrics of one process, rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, collect, kind='gauge', labelnames=()):
+        """Register a metric computed by ``collect()`` when scraped
+
+        ``collect`` returns a number, or with ``labelnames`` a dict mapping
+        label value tuples to numbers.
+        """
+        return self._register(_Callback(name, help, kind, collect, labelnames))
+
+    def render(self):
+        """The whole registry in the Prometheus text exposition format, as bytes"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f'# HELP {metric.name} {_escape_help(metric.help)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    pairs = ','.join(f'{name}="{_escape_label(text)}"' for name, text in labels.items())
+                    lines.append(f'{metric.name}{suffix}{{{pairs}}} {_format_value(value)}')
+                else:
+                    lines.append(f'{metric.name}{suffix} {_format_value(value)}')
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class SamplingProfiler:
+    """cProfile one request in ``every`` (0 disables); results accumulate per route
+
+    Requests are picked at random rather than by a counter, so a client that
+    alternates between endpoints can't hide one of them. ``every`` can be
+    changed at any time. Only one request is profiled at a
+    time, and a sample is skipped if another profiler (a debugger, say) is
+    active. On an event loop a sampled request also records whatever other
+    coroutines ran while it was in flight.
+    """
+
+    def __init__(self, every=0):
+        self.every = every
+        self.samples = 0
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def start(self):
+        """Return an enabled cProfile.Profile when this request is sampled, else None"""
+        every = self.every
+        if not every or random.random() * every >= 1:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, route):
+        profile.disable()
+        self._busy.release()
+        with self._lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                self._stats[route] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self.samples += 1
+
+    def configure(self, every, reset=False):
+        if every < 0:
+            raise ValueError('sample rate must be 0 (off) or a positive N for 1 in N requests')
+        self.every = every
+        if reset:
+            self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self.samples = 0
+
+    def report(self, route=None, limit=30, sort='cumulative'):
+        """pstats text for one route (or all of them merged), ``limit`` functions long"""
+        with self._lock:
+            if route is not None:
+                selected = [self._stats[route]] if route in self._stats else []
+            else:
+                selected = list(self._stats.values())
+            if not selected:
+                return f'no profiled requests (sampling 1 in {self.every})\n' if self.every else 'profiling is off\n'
+            out = io.StringIO()
+            merged = pstats.Stats(stream=out)
+            merged.add(*selected)
+            rate = f'1 in {self.every}' if self.every else 'sampling now off'
+            out.write(f'{self.samples} sampled requests ({rate}); routes: {", ".join(sorted(self._stats))}\n')
+            merged.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+class RequestMetrics:
+    """Latency, response size and in-flight figures for the HTTP requests of one server
+
+    ``track(method, route)`` returns a context manager; set ``status`` and
+    ``size`` on it before it exits. The route label must come from a fixed set
+    (route templates, not raw paths) to keep the number of series bounded.
+    """
+
+    def __init__(self, registry, profiler=None, clock=time.perf_counter):
+        self.in_flight = registry.gauge('ahat_http_requests_in_flight', 'Requests currently being handled')
+        self.duration = registry.histogram('ahat_http_request_duration_seconds', 'Time spent handling a request',
+                                           ('method', 'route', 'status'), LATENCY_BUCKETS)
+        self.size = registry.histogram('ahat_http_response_size_bytes', 'Size of response bodies as sent',
+                                       ('method', 'route'), SIZE_BUCKETS)
+        self.profiler = profiler
+        self.clock = clock
+        self._in_flight = self.in_flight.labels()
+
+    def track(self, method, route):
+        return _TrackedRequest(self, method, route)
+
+
+class _TrackedRequest:
+    __slots__ = ('metrics', 'method', 'route', 'status', 'size', '_started', '_profile')
+
+    def __init__(self, metrics, method, route):
+        self.metrics = metrics
+        self.method = method
+        self.route = route
+        self.status = None
+        self.size = None
+
+    def __enter__(self):
+        metrics = self.metrics
+        metrics._in_flight.inc()
+        self._profile = metrics.profiler.start() if metrics.profiler is not None else None
+        self._started = metrics.clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics = self.metrics
+        elapsed = metrics.clock() - self._started
+        if self._profile is not None:
+            metrics.profiler.stop(self._profile, self.route)
+        status = self.status or (500 if exc_type is not None else 200)
+        metrics.duration.labels(self.method, self.route, status).observe(elapsed)
+        if self.size is not None:
+            metrics.size.labels(self.method, self.route).observe(self.size)
+        metrics._in_flight.dec()
+        return False
+
+
+def register_cache(registry, cache, name, help):
+    """Expose an object's ``hits`` / ``misses`` counters, read when scraped"""
+    registry.callback(f'ahat_{name}_hits_total', f'{help} hits', lambda: cache.hits, kind='counter')
+    registry.callback(f'ahat_{name}_misses_total', f'{help} misses', lambda: cache.misses, kind='counter')
+
+    def ratio():
+        lookups = cache.hits + cache.misses
+        return cache.hits / lookups if lookups else 0.0
+    registry.callback(f'ahat_{name}_hit_ratio', f'{help} hits per lookup since start', ratio)
@@ -0,0 +1,90 @@
+"""Pre-fork process supervision: one listening socket, several serving processes
+
+The parent binds the listening socket and loads whatever every process should
+start with, then forks one child per target (a refresher and N workers, say)
+and from then on only supervises them. A child that dies is forked again,
+and SIGTERM or SIGINT is passed on to every child before the parent waits
+for them to drain and exit. The parent starts no threads of its own, so a
+fork never copies a lock some other thread holds.
+
+What the parent loaded is shared with the children only until a child
+replaces it. A worker that builds its own catalog from a shared one (see
+shared_catalog) holds a private copy from then on.
+"""
+import gc
+import os
+import signal
+import sys
+import time
+import traceback
+
+# A child that dies sooner than this after its start is restarted only after the same delay
+RESTART_DELAY = 1.0
+
+
+def run_children(targets, on_exit=None, restart_delay=RESTART_DELAY):
+    """Run each ``(name, target)`` in a forked child until SIGTERM or SIGINT; returns once all have exited
+
+    ``target()`` runs in the child, which exits when it returns (with status 1
+    if it raised). ``on_exit(name, pid, code)`` is called in the parent when a
+    child exits unexpectedly, before it is restarted.
+    """
+    children = {}
+    stopping = False
+
+    def spawn(name, target):
+        # Output still buffered would be written once more by the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                target()
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = (name, target, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+    # Everything loaded so far is shared with the children copy-on-write; keep the
+    # cyclic collector from writing to (and so copying) those pages in every child
+    gc.freeze()
+    try:
+        for name, target in targets:
+            spawn(name, target)
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            name, target, started = children.pop(pid, (None, None, None))
+            if name is None or stopping:
+                continue
+            if on_exit is not None:
+                on_exit(name, pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < restart_delay:
+                # Don't spin on a child that fails as soon as it starts
+                time.sleep(restart_delay)
+            if not stopping:
+                spawn(name, target)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
@@ -0,0 +1,330 @@
+"""Append-only price history per product, kept compact for months of hourly refreshes
+
+A point is stored only when a product's price differs from its last known
+price. In memory each product has two parallel arrays (times in whole seconds,
+prices in cents): 8 bytes per change. On disk the history is a log of
+records appended once per refresh:
+
+* ``K`` + length + UTF-8 key: defines the next key id (an ASIN, usually)
+* ``B`` + time + count + ``count`` pairs of (key id, cents): the changes of one refresh
+
+A crash can only leave a partly written last record, which is dropped (and
+cut off) on the next open. Other processes can follow a log one process
+writes: a read-only history picks up the records appended since it last
+looked with catch_up().
+
+Price drops are answered from the products that changed most recently: keys
+are kept ordered by their last change, so "the biggest drops in the last N
+hours" only visits the products that changed in those hours and looks up
+their price at the start of the window by bisection.
+"""
+import heapq
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+MAGIC = b'AHATPH1\n'
+# Longer keys (some odd link, say) are not tracked
+MAX_KEY_LENGTH = 1024
+_KEY = struct.Struct('<H')
+_BATCH = struct.Struct('<II')
+
+PricePoint = namedtuple('PricePoint', ['at', 'price'])
+PriceDrop = namedtuple('PriceDrop', [
+    'key',
+    'previous',     # price at the start of the window
+    'current',
+    'amount',       # previous - current
+    'percent',      # amount as a percentage of previous
+    'changed_at',   # time of the latest change
+])
+
+
+def _cents(price):
+    return int(round(price * 100))
+
+
+class PriceHistory:
+    """Price changes per key, optionally persisted to an append-only log (see open())"""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (times, cents), both arrays in time order
+        self._series = {}
+        # key -> id in the log, and the key and series of every id
+        self._ids = {}
+        self._keys = []
+        self._by_id = []
+        # key -> time of its last change; re-inserted on every change, so oldest first
+        self._changed = {}
+        self._file = None
+        self._readonly = False
+        # where the next record of the log starts
+        self._offset = 0
+        self.points = 0
+        self.version = 0
+
+    def __len__(self):
+        return len(self._series)
+
+    def __contains__(self, key):
+        return key in self._series
+
+    def open(self, path, readonly=False):
+        """Load the log at ``path`` (created if missing) and append every later change to it
+
+        A ``readonly`` history never writes to the log (record() raises) and
+        leaves a partly written last record for its writer to finish; see catch_up().
+        """
+        with self._lock:
+            if self._file is not None:
+                raise ValueError('price history is already attached to a file')
+            if readonly:
+                f = open(path, 'rb')
+                data = f.read()
+            else:
+                directory = os.path.dirname(os.path.abspath(path))
+                os.makedirs(directory, exist_ok=True)
+                f = open(path, 'a+b')
+                f.seek(0)
+                data = f.read()
+            if not data:
+                # A reader waits for the writer to start the log
+                if not readonly:
+                    f.write(MAGIC)
+                    f.flush()
+                    self._offset = len(MAGIC)
+            elif not (data.startswith(MAGIC) or readonly and MAGIC.startswith(data)):
+                f.close()
+                raise ValueError(f'{path} is not a price history log')
+            elif len(data) >= len(MAGIC):
+                self._offset = len(MAGIC) + self._replay(memoryview(data)[len(MAGIC):])
+                if self._offset < len(data) and not readonly:
+                    # A partly written record from an interrupted append
+                    f.truncate(self._offset)
+            self._file = f
+            self._readonly = readonly
+            self.version += 1
+            return self.points
+
+    def follow(self):
+        """Stop writing to the log and follow it read-only (see catch_up()) from where it is
+
+        For a forked child process: the parent, or another child, keeps appending.
+        """
+        with self._lock:
+            if self._file is None or self._readonly:
+                return
+            path = self._file.name
+            self._file.close()
+            self._file = open(path, 'rb')
+            self._readonly = True
+
+    def catch_up(self):
+        """Apply the records another process appended to a ``readonly`` log; returns the new points"""
+        with self._lock:
+            if self._file is None or not self._readonly:
+                return 0
+            points = self.points
+            f = self._file
+            if self._offset < len(MAGIC):
+                f.seek(0)
+                header = f.read(len(MAGIC))
+                if len(header) < len(MAGIC):
+                    return 0
+                if header != MAGIC:
+                    raise ValueError(f'{f.name} is not a price history log')
+                self._offset = len(MAGIC)
+            f.seek(self._offset)
+            data = f.read()
+            if data:
+                self._offset += self._replay(memoryview(data))
+            if self.points != points:
+                self.version += 1
+            return self.points - points
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _replay(self, data):
+        """Apply the records at the start of ``data``; returns the length of the complete ones"""
+        keys = self._keys
+        # series by key id, so replaying a point is a list index rather than a dict lookup
+        by_id = self._by_id
+        all_series = self._series
+        offset, size = 0, len(data)
+        while offset < size:
+            kind = data[offset:offset + 1]
+            if kind == b'K':
+                if offset + 1 + _KEY.size > size:
+                    break
+                length, = _KEY.unpack_from(data, offset + 1)
+                start = offset + 1 + _KEY.size
+                if start + length > size:
+                    break
+                key = sys.intern(bytes(data[start:start + length]).decode('utf-8'))
+                self._ids[key] = len(keys)
+                keys.append(key)
+                series = all_series.get(key)
+                if series is None:
+                    series = all_series[key] = (array('I'), array('i'))
+                by_id.append(series)
+                offset = start + length
+            elif kind == b'B':
+                if offset + 1 + _BATCH.size > size:
+                    break
+                at, count = _BATCH.unpack_from(data, offset + 1)
+                start = offset + 1 + _BATCH.size
+                if start + 8 * count > size:
+                    break
+                pairs = array('i')
+                pairs.frombytes(data[start:start + 8 * count])
+                if sys.byteorder != 'little':
+                    pairs.byteswap()
+                if count and not 0 <= min(pairs[0::2]) <= max(pairs[0::2]) < len(keys):
+                    break
+                for key_id, cents in zip(pairs[0::2], pairs[1::2]):
+                    times, prices = by_id[key_id]
+                    times.append(at)
+                    prices.append(cents)
+                self.points += count
+                offset = start + 8 * count
+            else:
+                break
+        # Keys defined just before a torn batch have no points yet; their ids stay
+        # valid, and a later batch (or catch_up) fills their series in
+        for key in [key for key, series in all_series.items() if not series[0]]:
+            del all_series[key]
+        for key, series in zip(keys, by_id):
+            if series[0] and key not in all_series:
+                all_series[key] = series
+        # Order by last change once, rather than on every replayed point
+        latest = sorted((series[0][-1], key) for key, series in all_series.items())
+        self._changed = {key: at for at, key in latest}
+        return offset
+
+    def _append(self, key, at, cents):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = (array('I'), array('i'))
+        series[0].append(at)
+        series[1].append(cents)
+        self._changed.pop(key, None)
+        self._changed[key] = at
+        self.points += 1
+
+    def record(self, prices, at=None):
+        """Store the prices of one refresh, ``(key, price)`` pairs; returns the number that changed
+
+        Keys that are None or too long and prices that are not positive are skipped. When a
+        key appears more than once, its last price wins. Raises OSError when
+        the log cannot be appended to; nothing is recorded then.
+        """
+        at = int(self.clock() if at is None else at)
+        latest = {}
+        for key, price in prices:
+            if key is not None and len(key) <= MAX_KEY_LENGTH and price and price > 0:
+                latest[key] = _cents(price)
+        with self._lock:
+            changes = []
+            for key, cents in latest.items():
+                series = self._series.get(key)
+                if series is None or series[1][-1] != cents:
+                    changes.append((key, cents))
+            if not changes:
+                return 0
+            if self._readonly:
+                raise ValueError('price history is read-only')
+            if self._file is not None:
+                self._write(at, changes)
+            for key, cents in changes:
+                self._append(sys.intern(key), at, cents)
+            self.version += 1
+            return len(changes)
+
+    def _write(self, at, changes):
+        chunks = []
+        pairs = array('i')
+        new_ids = {}
+        for key, cents in changes:
+            key_id = self._ids.get(key)
+            if key_id is None:
+                encoded = key.encode('utf-8')
+                chunks.append(b'K' + _KEY.pack(len(encoded)) + encoded)
+                key_id = new_ids[key] = len(self._ids) + len(new_ids)
+            pairs.append(key_id)
+            pairs.append(cents)
+        if sys.byteorder != 'little':
+            pairs.byteswap()
+        chunks.append(b'B' + _BATCH.pack(at, len(changes)) + pairs.tobytes())
+        f = self._file
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        records = b''.join(chunks)
+        try:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+        except OSError:
+            # Leave no partial record behind for the next append to follow
+            try:
+                f.truncate(end)
+            except OSError:
+                pass
+            raise
+        self._offset = end + len(records)
+        self._ids.update(new_ids)
+        for key in new_ids:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = (array('I'), array('i'))
+            self._keys.append(key)
+            self._by_id.append(series)
+
+    def history(self, key, since=None):
+        """PricePoints of ``key`` in time order (from the one in effect at ``since``); None if unknown"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return None
+            times, cents = series
+            start = 0 if since is None else max(0, bisect_right(times, since) - 1)
+            return [PricePoint(times[i], cents[i] / 100) for i in range(start, len(times))]
+
+    def drops(self, hours, limit=20, by='percent', include=None, now=None):
+        """The largest price drops between ``hours`` ago and now, largest first
+
+        A product counts when its current price is below the price it had at
+        the start of the window; products first seen inside the window have no
+        earlier price and are left out, as are keys for which ``include(key)``
+        is false.
+        """
+        if by not in ('percent', 'amount'):
+            raise ValueError("by must be 'percent' or 'amount'")
+        cutoff = (self.clock() if now is None else now) - hours * 3600
+        found = []
+        with self._lock:
+            for key, changed_at in reversed(self._changed.items()):
+                if changed_at <= cutoff:
+                    break
+                if include is not None and not include(key):
+                    continue
+                times, cents = self._series[key]
+                i = bisect_right(times, cutoff) - 1
+                if i < 0 or cents[i] <= cents[-1]:
+                    continue
+                amount = cents[i] - cents[-1]
+                found.append((amount / cents[i] if by == 'percent' else amount, key, cents[i], cents[-1], changed_at))
+        best = heapq.nlargest(limit, found, key=lambda entry: entry[0])
+        return [PriceDrop(key, previous / 100, current / 100, (previous - current) / 100,
+                          round((previous - current) / previous * 100, 1), changed_at)
+                for _, key, previous, current, changed_at in best]
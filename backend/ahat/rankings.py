@@ -0,0 +1,140 @@
+"""Best-first product rankings (trending, deals, ...) kept in sync with product changes
+
+Each server names its rankings and gives a ``score`` function for each; a
+product's scores are computed once, when it is added or replaced, and the
+product is filed in a sorted list for the whole catalog and one for its
+category. Reading the top K then walks the first K entries of one list
+instead of scoring and sorting the catalog.
+
+Changes are buffered and settled by the next read: a few are inserted one by
+one, a bulk load is merged with a single sort. Replaced and removed entries
+are skipped on read and dropped once they outnumber the live ones.
+"""
+import threading
+from bisect import insort
+from operator import itemgetter
+
+# A read inserts pending entries one by one while they are fewer than
+# 1/MERGE_RATIO of the list; above that one sort of the whole list is cheaper
+MERGE_RATIO = 64
+# Entries order by (-score, seq); a replaced entry may tie its replacement there
+_RANK = itemgetter(0, 1)
+
+
+class _Ranked:
+    """Entries of one ranking for one group of products, best first once settled"""
+
+    __slots__ = ('entries', 'pending', 'count')
+
+    def __init__(self):
+        self.entries = []
+        self.pending = []
+        self.count = 0      # live entries
+
+    def settle(self, current):
+        pending = self.pending
+        if pending:
+            entries = self.entries
+            if len(pending) * MERGE_RATIO < len(entries):
+                for entry in pending:
+                    insort(entries, entry, key=_RANK)
+            else:
+                entries.extend(pending)
+                entries.sort(key=_RANK)
+            self.pending = []
+        # Lazy deletion must not let the list grow without bound under churn
+        if len(self.entries) > 2 * self.count + 64:
+            self.entries = [entry for entry in self.entries if current.get(entry[2]) is entry]
+        return self.entries
+
+
+class Rankings:
+    """Products ranked by each of ``scores`` (name -> score function), overall and per category
+
+    Higher scores rank first; ties keep the catalog order. A product whose
+    score is None is left out of that ranking.
+    """
+
+    def __init__(self, key, category, scores, products=()):
+        self.key = key
+        self.category = category
+        self.scores = dict(scores)
+        self._lock = threading.Lock()
+        # key -> (seq, category) of every product added
+        self._members = {}
+        self._seq = 0
+        # name -> key -> the product's live entry, (-score, seq, key, product)
+        self._current = {name: {} for name in self.scores}
+        # name -> category (None for the whole catalog) -> _Ranked
+        self._groups = {name: {None: _Ranked()} for name in self.scores}
+        for product in products:
+            self.add(product)
+
+    @property
+    def names(self):
+        return tuple(self.scores)
+
+    def add(self, product):
+        """Add a product, or replace the product with the same key"""
+        key, category = self.key(product), self.category(product)
+        scores = [(name, score(product)) for name, score in self.scores.items()]
+        with self._lock:
+            member = self._members.get(key)
+            if member is not None:
+                seq = member[0]
+                self._remove(key, member[1])
+            else:
+                seq = self._seq
+                self._seq += 1
+            self._members[key] = (seq, category)
+            for name, value in scores:
+                if value is None:
+                    continue
+                # One entry object in both lists, so a single identity check tells it is live
+                entry = (-value, seq, key, product)
+                current = self._current[name]
+                current[key] = entry
+                groups = self._groups[name]
+                in_category = groups.get(category)
+                if in_category is None:
+                    in_category = groups[category] = _Ranked()
+                for ranked in (groups[None], in_category):
+                    ranked.pending.append(entry)
+                    ranked.count += 1
+                    # Replacements with no reads in between must not pile up either
+                    if len(ranked.pending) > ranked.count + 64:
+                        ranked.settle(current)
+
+    update = add
+
+    def remove(self, product):
+        """Remove a product (matched by key); unknown products are ignored"""
+        key = self.key(product)
+        with self._lock:
+            member = self._members.pop(key, None)
+            if member is not None:
+                self._remove(key, member[1])
+
+    def _remove(self, key, category):
+        for name, current in self._current.items():
+            if current.pop(key, None) is not None:
+                groups = self._groups[name]
+                groups[None].count -= 1
+                groups[category].count -= 1
+
+    def top(self, name, k, category=None):
+        """The ``k`` best products by ranking ``name``, in the whole catalog or one ``category``"""
+        if name not in self.scores:
+            raise ValueError(f"unknown ranking {name!r}; expected one of {', '.join(self.scores)}")
+        with self._lock:
+            ranked = self._groups[name].get(category)
+            if ranked is None or k <= 0:
+                return []
+            current = self._current[name]
+            found = []
+            for entry in ranked.settle(current):
+                if current.get(entry[2]) is entry:
+                    found.append(entry[3])
+                    if len(found) == k:
+                        break
+            return found
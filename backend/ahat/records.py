@@ -0,0 +1,106 @@
+"""Compact product records that read like the dicts they replace
+
+A catalog of dicts pays for a hash table per product (and per nested
+``price``), an over-allocated list per ``features`` and a separate copy of
+every repeated string. ``record_type()`` builds a ``__slots__`` class instead:
+one fixed array of values per product, lists kept as tuples, and the strings of
+low-cardinality fields (category, brand...) interned so the whole catalog
+shares one copy of each.
+
+Records are read-only mappings (``product['price']['discounted']``,
+``product.get('features')``, ``dict(product)``), so the store, stats, search
+and field projections use them unchanged. They become plain JSON objects only
+when a response is encoded: pass ``default=to_json`` to ``json.dumps``.
+"""
+import sys
+from collections.abc import Mapping
+
+_UNSET = object()
+
+
+class Record(Mapping):
+    """Base of the classes made by record_type(); a product is replaced, never edited"""
+
+    __slots__ = ()
+    _fields = ()
+    _field_set = frozenset()
+    _shared = frozenset()
+    _nested = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """A record holding the items of ``data``, or ``data`` itself when it has keys this type lacks"""
+        if isinstance(data, cls) or not cls._field_set.issuperset(data):
+            return data
+        record = cls.__new__(cls)
+        shared, nested = cls._shared, cls._nested
+        for name, value in data.items():
+            if name in nested and isinstance(value, dict):
+                value = nested[name].from_dict(value)
+            elif isinstance(value, list):
+                value = tuple(value)
+            elif name in shared and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(record, name, value)
+        return record
+
+    def __getitem__(self, name):
+        if name in self._field_set:
+            try:
+                return getattr(self, name)
+            except AttributeError:
+                pass
+        raise KeyError(name)
+
+    def get(self, name, default=None):
+        if name in self._field_set:
+            return getattr(self, name, default)
+        return default
+
+    def __contains__(self, name):
+        return name in self._field_set and hasattr(self, name)
+
+    def __iter__(self):
+        # Fields left out of from_dict() stay unset, so the JSON shape is kept exactly
+        return (name for name in self._fields if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """The fields as a plain dict (nested records stay records)"""
+        data = {}
+        for name in self._fields:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                data[name] = value
+        return data
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+def record_type(name, fields, shared=(), nested=None):
+    """A Record class with one slot per field, in the order records are serialized
+
+    Strings in ``shared`` fields are interned; ``nested`` maps fields holding
+    dicts to the record type those dicts are converted to.
+    """
+    fields = tuple(fields)
+    clashes = [field for field in fields if hasattr(Record, field)]
+    if clashes:
+        raise ValueError(f'field names clash with Record attributes: {", ".join(clashes)}')
+    return type(name, (Record,), {
+        '__slots__': fields,
+        '_fields': fields,
+        '_field_set': frozenset(fields),
+        '_shared': frozenset(shared),
+        '_nested': dict(nested or {}),
+    })
+
+
+def to_json(value):
+    """``json.dumps(default=...)`` hook encoding records as objects"""
+    if isinstance(value, Record):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -0,0 +1,121 @@
+"""Cache of fully encoded API responses with strong ETags and gzip variants"""
+import gzip
+import hashlib
+import threading
+
+GZIP_LEVEL = 6
+# Smaller bodies fit in a packet or two anyway; gzip would save little and may even grow them
+GZIP_MIN_BYTES = 1024
+
+
+class Representation:
+    """The encoded bytes of one response, plain and (above ``gzip_min_bytes``) gzip-compressed"""
+
+    __slots__ = ('body', 'gzip_body', 'etag', 'gzip_etag', 'content_type')
+
+    def __init__(self, body, content_type='application/json', gzip_min_bytes=GZIP_MIN_BYTES):
+        self.body = body
+        self.content_type = content_type
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.etag = f'"{digest}"'
+        if len(body) >= gzip_min_bytes:
+            # mtime=0 keeps the compressed bytes (and so the ETag) identical across rebuilds
+            self.gzip_body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+            # Strong ETags are per byte sequence, so each encoding gets its own
+            self.gzip_etag = f'"{digest}-gz"'
+        else:
+            self.gzip_body = self.gzip_etag = None
+
+    def select(self, accept_encoding):
+        """Return ``(body, etag, content_encoding)`` for the client's Accept-Encoding"""
+        if self.gzip_body is not None and accepts_gzip(accept_encoding):
+            return self.gzip_body, self.gzip_etag, 'gzip'
+        return self.body, self.etag, None
+
+    def not_modified(self, if_none_match):
+        """True when If-None-Match names either encoding of this representation"""
+        return etag_matches(if_none_match, (self.etag, self.gzip_etag))
+
+
+class ResponseCache:
+    """Representations keyed by endpoint and query, each valid for one catalog version
+
+    Reads are a single dict lookup plus a version check. An entry built for an
+    older version is simply replaced on its next miss; ``max_entries`` bounds
+    memory for arbitrary query strings. Bodies shorter than ``gzip_min_bytes``
+    are always sent uncompressed.
+    """
+
+    def __init__(self, max_entries=1024, gzip_min_bytes=GZIP_MIN_BYTES):
+        self.max_entries = max_entries
+        self.gzip_min_bytes = gzip_min_bytes
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, endpoint, query, version, build, content_type='application/json'):
+        """Return the cached Representation, calling ``build()`` for its bytes on a miss"""
+        key = (endpoint, canonical_query(query))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        representation = Representation(build(), content_type, self.gzip_min_bytes)
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                # Oldest insertion first; cheap and good enough for a bounded query space
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (version, representation)
+        return representation
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+def canonical_query(query):
+    """Hashable, order-independent form of a parsed query (dict of str or list values)"""
+    if not query:
+        return ()
+    items = []
+    for name, value in query.items():
+        if isinstance(value, (list, tuple)):
+            value = tuple(value)
+        items.append((name, value))
+    return tuple(sorted(items))
+
+
+def accepts_gzip(accept_encoding):
+    """True when an Accept-Encoding header allows gzip (q > 0)"""
+    if not accept_encoding:
+        return False
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', 'x-gzip', '*'):
+            continue
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(if_none_match, etags):
+    """Weak comparison of an If-None-Match header against our ETags"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return True
+    return False
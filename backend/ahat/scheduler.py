@@ -0,0 +1,125 @@
+"""Periodic background refreshes, off the request path
+
+A ``RefreshScheduler`` runs a job (a scrape that builds and publishes a new
+catalog, say) on a daemon thread every ``interval`` seconds, give or take a
+random ``jitter`` fraction so that many processes started together do not hit
+the upstream in lockstep. A failed run is retried sooner, with the same
+doubling backoff as the feed cache, but never later than the next regular run.
+
+The job publishes its own result; readers never wait on the scheduler. The
+outcome of the last run is kept as a ``RefreshRun`` for status endpoints.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+
+RefreshRun = namedtuple('RefreshRun', [
+    'started_at',   # Unix time
+    'seconds',      # duration
+    'outcome',      # what the job returned ('changed', say), or 'failed'
+    'error',        # the exception or reason of a failed run, else None
+])
+
+
+class RefreshScheduler:
+    """Runs ``job`` now and then; a run fails when the job raises or returns a false value
+
+    ``on_schedule(scheduler)``, if given, is called on the scheduler thread
+    whenever the next run has been scheduled (after every run, that is).
+    """
+
+    def __init__(self, job, interval, jitter=0.1, failure_backoff=5, max_backoff=300,
+                 clock=time.time, rand=random.random, on_schedule=None):
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+        if not 0 <= jitter < 1:
+            raise ValueError('jitter must be a fraction between 0 and 1')
+        self.job = job
+        self.interval = interval
+        self.jitter = jitter
+        self.failure_backoff = failure_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.rand = rand
+        self.on_schedule = on_schedule
+        # One run at a time, whether scheduled or asked for with run()
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self.last = None
+        self.last_success = None
+        self.next_run_at = None
+        self.runs = 0
+
+    @property
+    def running(self):
+        """Whether the background thread has been started (and not stopped)"""
+        return self._thread is not None
+
+    def run(self):
+        """Run the job now (after a run in progress, if any); returns its result, None when it failed"""
+        with self._run_lock:
+            started_at = self.clock()
+            began = time.perf_counter()
+            try:
+                result = self.job()
+                error = None if result else ValueError('refresh produced nothing')
+            except Exception as e:
+                result, error = None, e
+            run = RefreshRun(started_at, time.perf_counter() - began,
+                             'failed' if error else str(result), error)
+            self.runs += 1
+            if error is None:
+                self._failures = 0
+                self.last_success = run
+            else:
+                self._failures += 1
+            # Single reference assignments: readers see the previous run or this one, never a mix
+            self.last = run
+            return None if error else result
+
+    def delay(self):
+        """Seconds until the next scheduled run, after the last one"""
+        if self._failures:
+            backoff = min(self.max_backoff, self.failure_backoff * 2 ** (self._failures - 1))
+            return min(backoff, self.interval)
+        return self.interval * (1 + self.jitter * (2 * self.rand() - 1))
+
+    def start(self, run_first=True):
+        """Start the background thread; the first run is immediate unless ``run_first`` is false"""
+        if self._thread is not None:
+            raise RuntimeError('scheduler already started')
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._loop, args=(run_first,), name='refresh-scheduler', daemon=True)
+        self._thread.start()
+
+    def trigger(self):
+        """Run as soon as possible instead of waiting out the current delay"""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        """Stop scheduling; a run in progress is waited for (up to ``timeout`` seconds)"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def _loop(self, run_first):
+        if not run_first:
+            self._sleep(self.delay())
+        while not self._stopping.is_set():
+            self.run()
+            self._sleep(self.delay())
+
+    def _sleep(self, seconds):
+        self.next_run_at = self.clock() + seconds
+        if self.on_schedule is not None:
+            self.on_schedule(self)
+        self._wake.wait(seconds)
+        self._wake.clear()
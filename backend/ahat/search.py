@@ -0,0 +1,446 @@
+"""Full-text product search: an inverted index with BM25 ranking and autocomplete
+
+``SearchIndex`` is a ProductStore listener, so it follows every add, update
+and remove of the catalog instead of being rebuilt. Servers describe what to
+index with ``fields``: a name -> ``(getter, weight)`` mapping where the getter
+returns a string, a list of strings or None, and the weight counts each of its
+tokens that many times (a title word outweighs a description word).
+
+* Ranking is Okapi BM25 over the weighted term frequencies. All query words
+  must match (rarest first, so candidate sets shrink fast); if that finds
+  nothing, any word may match.
+* Small candidate sets are scored outright. Large ones are ranked with the
+  threshold algorithm over per-term lists ordered by BM25 impact: the lists
+  are read in parallel and reading stops once no unseen product can beat the
+  current top k, so a word found in half the catalog costs about as much as
+  a rare one. The lists are built on first use and kept in step with product
+  changes; the average document length used for scoring is a snapshot that
+  is only refreshed (dropping the lists) when it drifts by more than 5%.
+* Query words missing from the vocabulary are matched against vocabulary
+  terms one edit away (insert, delete, substitute or swap), found through a
+  symmetric-delete table rather than by scanning the vocabulary.
+* ``suggest(prefix)`` completes the last word from the sorted vocabulary:
+  the bisected prefix range is the subtree a trie walk would visit, without
+  an object per node. Completions are ranked by how many products use them.
+"""
+import heapq
+import math
+import re
+import sys
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+TOKEN = re.compile(r'[^\W_]+')
+STOPWORDS = frozenset(['a', 'an', 'and', 'the', 'for', 'with', 'of', 'in', 'on', 'to', 'by', 'or', 'at', 's'])
+
+# A word that only matched after a typo correction counts this much
+TYPO_WEIGHT = 0.6
+
+# Up to this many candidates are scored one by one instead of in impact order
+DIRECT_SCORING_LIMIT = 2000
+# Impact-ordered lists are kept for terms in at least this many products...
+IMPACT_MIN_POSTINGS = 1000
+# ...up to this many list entries in all (8 bytes each)
+IMPACT_CACHE_ENTRIES = 4_000_000
+# A cached list takes in-place edits (each a memmove of the list) up to 1/128 of its
+# length, at least 64; after that it is dropped, as rebuilding on demand is cheaper
+IMPACT_EDIT_FRACTION = 128
+IMPACT_MIN_EDITS = 64
+AVERAGE_DRIFT = 0.05
+
+# total: number of matching products; hits: [(key, score)] for the requested page;
+# corrections: {query word: [vocabulary terms it was read as]}
+SearchResult = namedtuple('SearchResult', ['total', 'hits', 'corrections'])
+
+
+def tokenize(text):
+    """Lower-cased word tokens of ``text``, stopwords dropped"""
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    """True when a and b differ by at most one insert, delete, substitution or adjacent swap"""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    i = 0
+    while i < min(la, lb) and a[i] == b[i]:
+        i += 1
+    if la == lb:
+        return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2]
+                                          and a[i + 2:] == b[i + 2:])
+    if la > lb:
+        return a[i + 1:] == b[i:]
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+
+    def __init__(self, key, fields, k1=1.2, b=0.75, min_typo_length=4):
+        self.key = key
+        self.fields = dict(fields)
+        self.k1 = k1
+        self.b = b
+        self.min_typo_length = min_typo_length
+        self._lock = threading.RLock()
+        # Products are numbered internally; numbers of removed products are reused
+        self._docs = {}
+        self._keys = []
+        self._lengths = []
+        self._terms = []
+        self._free = []
+        self._total_length = 0
+        # term -> {doc: weighted term frequency}
+        self._postings = {}
+        # one-character deletion of a term -> {term: None}, for typo lookups
+        self._deletes = {}
+        # Sorted vocabulary for prefix lookups; may hold terms that have since died out.
+        # New terms wait in _pending until the next suggest() merges them in.
+        self._vocabulary = []
+        self._pending = set()
+        self._dead = 0
+        # BM25 length normalization: tf / (tf + base + scale * length), from a snapshot of the average length
+        self._average = None
+        self._base = k1 * (1 - b)
+        self._scale = 0.0
+        # term -> [docs by descending impact, edits since built]
+        self._impacts = {}
+        self._impact_entries = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def analyze(self, product):
+        """``{term: weighted frequency}`` of a product, as the index counts its words"""
+        counts = {}
+        for getter, weight in self.fields.values():
+            value = getter(product)
+            if not value:
+                continue
+            for text in ([value] if isinstance(value, str) else value):
+                for token in tokenize(text):
+                    counts[token] = counts.get(token, 0) + weight
+        return counts
+
+    def add(self, product):
+        """Index a product, or re-index the product with the same key"""
+        key = self.key(product)
+        counts = self.analyze(product)
+        with self._lock:
+            doc = self._docs.get(key)
+            if doc is not None:
+                self._unindex(doc)
+            elif self._free:
+                doc = self._free.pop()
+            else:
+                doc = len(self._keys)
+                self._keys.append(None)
+                self._lengths.append(0)
+                self._terms.append(())
+            self._docs[key] = doc
+            self._keys[doc] = key
+            length = sum(counts.values())
+            self._lengths[doc] = length
+            self._total_length += length
+            terms = []
+            postings = self._postings
+            impacts = self._impacts
+            for term, count in counts.items():
+                posting = postings.get(term)
+                if posting is None:
+                    term = sys.intern(term)
+                    posting = postings[term] = {}
+                    self._add_term(term)
+                posting[doc] = count
+                terms.append(term)
+                if impacts and term in impacts:
+                    self._edit_impacts(term, doc, insert=True)
+            self._terms[doc] = tuple(terms)
+
+    update = add
+
+    def remove(self, product):
+        """Drop a product from the index (matched by key); unknown products are ignored"""
+        with self._lock:
+            doc = self._docs.pop(self.key(product), None)
+            if doc is not None:
+                self._unindex(doc)
+                self._keys[doc] = None
+                self._free.append(doc)
+
+    def _unindex(self, doc):
+        self._total_length -= self._lengths[doc]
+        impacts = self._impacts
+        for term in self._terms[doc]:
+            posting = self._postings[term]
+            if impacts and term in impacts:
+                self._edit_impacts(term, doc, insert=False)
+            del posting[doc]
+            if not posting:
+                del self._postings[term]
+                self._drop_term(term)
+        self._terms[doc] = ()
+
+    def _add_term(self, term):
+        if len(term) >= self.min_typo_length:
+            for deletion in _deletes(term):
+                self._deletes.setdefault(deletion, {})[term] = None
+        self._pending.add(term)
+
+    def _drop_term(self, term):
+        if len(term) >= self.min_typo_length:
+            for deletion in _deletes(term):
+                terms = self._deletes[deletion]
+                del terms[term]
+                if not terms:
+                    del self._deletes[deletion]
+        cached = self._impacts.pop(term, None)
+        if cached is not None:
+            self._impact_entries -= len(cached[0])
+        if term in self._pending:
+            self._pending.discard(term)
+        else:
+            self._dead += 1
+
+    def corrections(self, word):
+        """Vocabulary terms within one edit of ``word`` (for words not in the vocabulary)"""
+        if len(word) < self.min_typo_length:
+            return []
+        candidates = {}
+        for probe in _deletes(word) | {word}:
+            # word lost a character, or both lost one at the same or different places
+            if probe in self._postings:
+                candidates[probe] = None
+            candidates.update(self._deletes.get(probe, ()))
+        return sorted(term for term in candidates if term in self._postings and _within_one_edit(word, term))
+
+    def search(self, query, offset=0, limit=10):
+        """Rank products for ``query``; returns a SearchResult for one page of hits"""
+        words = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            postings = self._postings
+            groups = []
+            corrections = {}
+            for word in words:
+                if word in postings:
+                    groups.append([(word, 1.0)])
+                    continue
+                fixed = self.corrections(word)
+                if fixed:
+                    corrections[word] = fixed
+                groups.append([(term, TYPO_WEIGHT) for term in fixed])
+            weighted = self._weighted_terms(groups)
+            if not weighted:
+                return SearchResult(0, [], corrections)
+
+            # With one word every product that has it matches; no need to intersect
+            required, candidates = self._match_all(groups) if len(groups) > 1 else (None, None)
+            if candidates:
+                total = len(candidates)
+            else:
+                # Any word may match
+                candidates = None
+                if len(weighted) == 1:
+                    total = len(weighted[0][1])
+                else:
+                    total = len(set().union(*(posting for _, posting, _ in weighted)))
+
+            need = offset + limit
+            if total <= DIRECT_SCORING_LIMIT:
+                scores = self._score(weighted, candidates)
+                best = heapq.nlargest(need, ((score, -doc) for doc, score in scores.items()))
+            else:
+                best = self._top_by_impact(weighted, required if candidates else None, need)
+            hits = [(self._keys[-doc], score) for score, doc in best[offset:need]]
+        return SearchResult(total, hits, corrections)
+
+    def _weighted_terms(self, groups):
+        """``[(term, posting, factor)]`` for every term of the query; factor includes idf"""
+        count = len(self._docs)
+        if not count:
+            return []
+        average = self._total_length / count
+        if self._average is None or abs(average - self._average) > AVERAGE_DRIFT * self._average:
+            self._average = average
+            self._scale = self.k1 * self.b / average
+            self._impacts.clear()
+            self._impact_entries = 0
+        weighted = []
+        for group in groups:
+            for term, weight in group:
+                posting = self._postings[term]
+                frequency = len(posting)
+                idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                weighted.append((term, posting, idf * weight * (self.k1 + 1)))
+        return weighted
+
+    def _match_all(self, groups):
+        """``(containers, docs)``: one doc container per group, and the docs found in all of them"""
+        if not all(groups):
+            return None, []
+        containers = []
+        for group in groups:
+            if len(group) == 1:
+                containers.append(self._postings[group[0][0]])
+            else:
+                union = set()
+                for term, _ in group:
+                    union.update(self._postings[term])
+                containers.append(union)
+        containers.sort(key=len)
+        # Walk the smallest group and probe the others; filter() keeps the loop in C
+        docs = iter(containers[0])
+        for container in containers[1:]:
+            docs = filter(container.__contains__, docs)
+        return containers, list(docs)
+
+    def _score(self, weighted, candidates):
+        """Score every candidate (every product with a query term when ``candidates`` is None)"""
+        base, scale, lengths = self._base, self._scale, self._lengths
+        scores = {}
+        get = scores.get
+        for _, posting, factor in weighted:
+            if candidates is None:
+                items = posting.items()
+            else:
+                items = [(doc, posting[doc]) for doc in candidates if doc in posting]
+            for doc, tf in items:
+                scores[doc] = get(doc, 0.0) + factor * tf / (tf + base + scale * lengths[doc])
+        return scores
+
+    def _top_by_impact(self, weighted, required, need):
+        """The ``need`` best ``(score, -doc)`` pairs, by the threshold algorithm over impact-ordered lists
+
+        With ``required``, only docs found in every one of those containers count.
+        """
+        base, scale, lengths = self._base, self._scale, self._lengths
+        lists = [(self._impact_order(term, posting), posting, factor) for term, posting, factor in weighted]
+        best = []
+        seen = set()
+        depth = 0
+        while True:
+            # No product below this depth in any list can score more than the sum of the impacts here
+            threshold = 0.0
+            active = False
+            for ranked, posting, factor in lists:
+                if depth >= len(ranked):
+                    continue
+                active = True
+                doc = ranked[depth]
+                tf = posting[doc]
+                threshold += factor * tf / (tf + base + scale * lengths[doc])
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                if required is not None and not all(doc in container for container in required):
+                    continue
+                length = lengths[doc]
+                score = 0.0
+                for _, other, other_factor in weighted:
+                    other_tf = other.get(doc)
+                    if other_tf:
+                        score += other_factor * other_tf / (other_tf + base + scale * length)
+                entry = (score, -doc)
+                if len(best) < need:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+            if not active or (len(best) >= need and best[0][0] >= threshold):
+                break
+            depth += 1
+        return sorted(best, reverse=True)
+
+    def _impact_key(self, posting):
+        base, scale, lengths = self._base, self._scale, self._lengths
+
+        def key(doc):
+            tf = posting[doc]
+            return -tf / (tf + base + scale * lengths[doc]), doc
+        return key
+
+    def _impact_order(self, term, posting):
+        """Docs with ``term``, highest impact first; cached for frequent terms"""
+        cached = self._impacts.get(term)
+        if cached is not None:
+            return cached[0]
+        ranked = sorted(posting, key=self._impact_key(posting))
+        if len(ranked) >= IMPACT_MIN_POSTINGS:
+            if self._impact_entries + len(ranked) > IMPACT_CACHE_ENTRIES:
+                # Full: forget everything and start over with the terms queried from now on
+                self._impacts.clear()
+                self._impact_entries = 0
+            self._impacts[term] = [ranked, 0]
+            self._impact_entries += len(ranked)
+        return ranked
+
+    def _edit_impacts(self, term, doc, insert):
+        # Must run while the doc's tf and length are the ones its list entry was (or will be) sorted by
+        cached = self._impacts[term]
+        if cached[1] >= max(IMPACT_MIN_EDITS, len(cached[0]) // IMPACT_EDIT_FRACTION):
+            del self._impacts[term]
+            self._impact_entries -= len(cached[0])
+            return
+        cached[1] += 1
+        ranked = cached[0]
+        key = self._impact_key(self._postings[term])
+        if insert:
+            insort(ranked, doc, key=key)
+            self._impact_entries += 1
+        else:
+            i = bisect_left(ranked, key(doc), key=key)
+            if i < len(ranked) and ranked[i] == doc:
+                del ranked[i]
+                self._impact_entries -= 1
+
+    def suggest(self, prefix, limit=10):
+        """Completions of the last word of ``prefix``: ``[(completion, product_count)]``
+
+        Earlier words are kept as typed, so "sony wire" suggests "sony wireless".
+        """
+        words = TOKEN.findall(prefix.lower())
+        if not words:
+            return []
+        # A trailing space means the last word is finished: nothing to complete
+        if not prefix[-1:].isalnum():
+            return []
+        lead, stem = ' '.join(words[:-1]), words[-1]
+        with self._lock:
+            vocabulary = self._sorted_vocabulary()
+            postings = self._postings
+            frequency = self._document_frequency
+            start = bisect_left(vocabulary, stem)
+            end = bisect_left(vocabulary, stem + '\U0010ffff', start)
+            # Most used first, then alphabetical
+            ranked = heapq.nsmallest(limit, ((-frequency(term), term) for term in vocabulary[start:end]
+                                             if term in postings))
+        return [((lead + ' ' + term) if lead else term, -count) for count, term in ranked]
+
+    def _document_frequency(self, term):
+        return len(self._postings[term])
+
+    def _sorted_vocabulary(self):
+        vocabulary = self._vocabulary
+        if self._dead > len(vocabulary) // 4:
+            vocabulary = self._vocabulary = [term for term in vocabulary if term in self._postings]
+            self._dead = 0
+        pending = self._pending
+        if not pending:
+            return vocabulary
+        if len(pending) * 16 < len(vocabulary):
+            # A few new terms: insert them in place
+            for term in sorted(pending):
+                i = bisect_left(vocabulary, term)
+                if i == len(vocabulary) or vocabulary[i] != term:
+                    vocabulary.insert(i, term)
+        else:
+            # A term that died out and came back may still be listed
+            vocabulary = self._vocabulary = sorted(pending.union(vocabulary))
+        self._pending = set()
+        return vocabulary
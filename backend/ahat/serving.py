@@ -0,0 +1,442 @@
+"""Concurrent HTTP/1.1 serving engines for BaseHTTPRequestHandler subclasses
+
+Both engines expose the same small surface as ``socketserver`` servers:
+``serve_forever()``, ``shutdown()`` (callable from another thread),
+``server_close()`` (drains in-flight requests) and ``server_address``.
+
+* ``threaded``: a TCP server whose requests are handled by a bounded thread
+  pool instead of one unbounded thread per connection; connections wait for
+  their next request in a selector, not on a thread.
+* ``asyncio``: an event loop owns every socket, so idle keep-alive connections
+  cost no thread; complete requests are handed to a bounded thread pool.
+
+Handlers should mix in ``KeepAliveHandlerMixin`` so they speak HTTP/1.1 and
+cooperate with draining.
+
+Request bodies must come with a Content-Length of at most ``max_body_bytes``
+(the asyncio engine reads a body into memory whole before its handler runs);
+larger ones get a 413, chunked and otherwise transfer-coded ones a 411. Either
+way the body is left unread and the connection closed.
+"""
+import asyncio
+import http.server
+import io
+import json
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+ENGINES = ('threaded', 'asyncio')
+DEFAULT_WORKERS = 16
+KEEPALIVE_TIMEOUT = 5.0
+# How long a worker with nothing else to do waits for a connection's next request
+# before parking it: a client sending requests back to back skips the poller
+KEEPALIVE_LINGER = 0.002
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 64 * 2**20
+
+
+class KeepAliveHandlerMixin:
+    """Persistent-connection behaviour shared by the engines' request handlers"""
+
+    # Persistent connections: every response must carry Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are dropped after this many seconds
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body are written separately; don't let Nagle delay the body
+    disable_nagle_algorithm = True
+    # Set when the connection goes back to the server to wait for its next request
+    parked = False
+
+    def handle(self):
+        # Serve the requests already sent, then hand an idle connection back to
+        # the server (if it takes them) rather than wait for more on this thread
+        linger = getattr(self.server, 'linger', None)
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if linger is not None and not self._request_waiting(linger()):
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def _request_waiting(self, timeout):
+        """Whether the next request (or EOF) arrives within ``timeout`` seconds"""
+        self.connection.settimeout(timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except TimeoutError:
+            return False
+        except OSError:
+            # Reset by the client: handle_one_request sees it too
+            return True
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        error = _body_error(self.headers.get_all('Transfer-Encoding'), self.headers.get_all('Content-Length'),
+                            getattr(self.server, 'max_body_bytes', MAX_BODY_BYTES))
+        if error is None:
+            return True
+        # The body stays unread, so nothing more can be read from this connection
+        status, message = error
+        body = json.dumps({'error': message}).encode()
+        self.close_connection = True
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Connection', 'close')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return False
+
+    def end_headers(self):
+        # Tell keep-alive clients to reconnect elsewhere while the server drains
+        if getattr(self.server, 'draining', False):
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        super().end_headers()
+
+
+class ThreadPoolHTTPServer(http.server.HTTPServer):
+    """HTTPServer whose requests run on a fixed-size worker pool
+
+    A worker only gets a connection with a request to read. Between requests,
+    and before the first one, connections wait in a selector on one poller
+    thread, where an idle keep-alive connection costs no worker. Those idle
+    for ``keepalive_timeout`` seconds are closed. While workers are to spare,
+    one lingers ``keepalive_linger`` seconds for the next request before
+    handing its connection back.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass, workers=DEFAULT_WORKERS,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, keepalive_linger=KEEPALIVE_LINGER,
+                 max_body_bytes=MAX_BODY_BYTES):
+        self.workers = workers
+        self.max_body_bytes = max_body_bytes
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_linger = keepalive_linger
+        self.draining = False
+        # Connections being served, and waiting for a worker
+        self._busy = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ahat-worker')
+        self._lock = threading.Lock()
+        # Connections to add to the selector, and those in it: socket -> (client address, idle since)
+        self._incoming = []
+        self._waiting = {}
+        # Started by the first connection, with its selector and wakeup socket pair,
+        # so in the process that serves: forked children must not share them (see prefork)
+        self._poller = None
+        self._selector = None
+        self._wakeup = self._wake_poller = None
+        super().__init__(server_address, RequestHandlerClass)
+
+    def linger(self):
+        """Seconds a worker may wait for its connection's next request: none once the pool is busy"""
+        return self.keepalive_linger if self._busy < self.workers else 0
+
+    def process_request(self, request, client_address):
+        # A new connection waits for its first request like an idle one
+        self.park(request, client_address)
+
+    def park(self, request, client_address):
+        """Have ``request`` wait in the selector until its next request arrives"""
+        with self._lock:
+            if self.draining:
+                self.shutdown_request(request)
+                return
+            self._incoming.append((request, client_address))
+            if self._poller is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup, self._wake_poller = socket.socketpair()
+                self._wakeup.setblocking(False)
+                self._selector.register(self._wakeup, selectors.EVENT_READ)
+                self._poller = threading.Thread(target=self._poll, name='ahat-poller', daemon=True)
+                self._poller.start()
+        self._wake()
+
+    def _wake(self):
+        if self._wake_poller is None:
+            return
+        try:
+            self._wake_poller.send(b'\0')
+        except OSError:
+            # The wakeup buffer is full: the poller is awake anyway
+            pass
+
+    def _poll(self):
+        waiting = self._waiting
+        while True:
+            timeout = None
+            if waiting:
+                oldest = next(iter(waiting.values()))[1]
+                timeout = max(0.0, oldest + self.keepalive_timeout - time.monotonic())
+            events = self._selector.select(timeout)
+            with self._lock:
+                incoming, self._incoming = self._incoming, []
+                draining = self.draining
+            now = time.monotonic()
+            for request, client_address in incoming:
+                waiting[request] = (client_address, now)
+                self._selector.register(request, selectors.EVENT_READ)
+            if draining:
+                for request in list(waiting):
+                    self._close_waiting(request)
+                return
+            for key, _ in events:
+                if key.fileobj is self._wakeup:
+                    try:
+                        while self._wakeup.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                request = key.fileobj
+                client_address, _ = waiting.pop(request)
+                self._selector.unregister(request)
+                with self._lock:
+                    self._busy += 1
+                try:
+                    self._executor.submit(self._process_request_thread, request, client_address)
+                except RuntimeError:
+                    # The pool has shut down
+                    with self._lock:
+                        self._busy -= 1
+                    self.shutdown_request(request)
+            # Idle the longest first: close those past the keep-alive timeout
+            for request, (_, since) in list(waiting.items()):
+                if now - since < self.keepalive_timeout:
+                    break
+                self._close_waiting(request)
+
+    def _close_waiting(self, request):
+        del self._waiting[request]
+        self._selector.unregister(request)
+        self.shutdown_request(request)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        finally:
+            with self._lock:
+                self._busy -= 1
+        if handler.parked:
+            self.park(request, client_address)
+        else:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        """Stop accepting, close idle connections, then wait for in-flight requests to finish"""
+        with self._lock:
+            self.draining = True
+            poller = self._poller
+        self._wake()
+        if poller is not None:
+            poller.join()
+        super().server_close()
+        self._executor.shutdown(wait=True)
+        if poller is not None:
+            self._selector.close()
+            self._wakeup.close()
+            self._wake_poller.close()
+
+
+class AsyncioHTTPServer:
+    """asyncio front end that keeps connections on the event loop"""
+
+    def __init__(self, server_address, RequestHandlerClass, workers=DEFAULT_WORKERS,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, max_body_bytes=MAX_BODY_BYTES):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.workers = workers
+        self.max_body_bytes = max_body_bytes
+        self.keepalive_timeout = keepalive_timeout
+        self.draining = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ahat-worker')
+        self._loop = None
+        self._stop = None
+        self._connections = {}
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+
+        # Bind eagerly so callers can read the real port (port 0) and so bind errors surface here
+        self.socket = socket.create_server(server_address, reuse_port=False)
+        self.server_address = self.socket.getsockname()[:2]
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    def shutdown(self):
+        """Ask serve_forever to stop and wait until it has drained"""
+        self._ready.wait()
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._stopped.wait()
+
+    def server_close(self):
+        self.draining = True
+        self.socket.close()
+        self._executor.shutdown(wait=True)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle_connection, sock=self.socket,
+                                            limit=MAX_HEADER_BYTES)
+        self._ready.set()
+        try:
+            await self._stop.wait()
+        finally:
+            self.draining = True
+            server.close()
+            # Idle keep-alive connections are closed right away; busy ones finish their request
+            for task, busy in list(self._connections.items()):
+                if not busy:
+                    task.cancel()
+            if self._connections:
+                await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = False
+        client_address = writer.get_extra_info('peername')
+        try:
+            while not self.draining:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+                    # EOF, oversized headers, keep-alive timeout or drain of an idle connection
+                    break
+
+                self._connections[task] = True
+                length, error = _request_body(head, self.max_body_bytes)
+                if error is not None:
+                    writer.write(_error_response(*error))
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length) if length else b''
+                response = await self._loop.run_in_executor(
+                    self._executor, self._run_handler, head + body, client_address)
+                writer.write(response)
+                await writer.drain()
+                self._connections[task] = False
+
+                if not _keep_alive(head, response):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    def _run_handler(self, request_bytes, client_address):
+        connection = _BufferedConnection(request_bytes)
+        self.RequestHandlerClass(connection, client_address, self)
+        return bytes(connection.output)
+
+
+class _BufferedConnection:
+    """Socket stand-in that feeds one buffered request to a handler and collects its reply"""
+
+    def __init__(self, request_bytes):
+        self.request_bytes = request_bytes
+        self.output = bytearray()
+
+    def makefile(self, mode, buffering=None):
+        return io.BytesIO(self.request_bytes)
+
+    def sendall(self, data):
+        self.output += data
+
+    def settimeout(self, timeout):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+
+def _header_lines(head):
+    return head.decode('latin-1').split('\r\n')
+
+
+def _request_body(head, max_body_bytes):
+    """``(length, None)`` for the body a request announces (0 without one), or ``(None, (status, message))``"""
+    lengths, codings = [], []
+    for line in _header_lines(head)[1:]:
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            lengths.append(value)
+        elif name == 'transfer-encoding':
+            codings.append(value)
+    error = _body_error(codings or None, lengths or None, max_body_bytes)
+    if error is not None:
+        return None, error
+    return (int(lengths[0]) if lengths else 0), None
+
+
+def _body_error(transfer_encodings, content_lengths, max_body_bytes):
+    """``(status, message)`` refusing a request body that will not be read; None for an acceptable one"""
+    if transfer_encodings:
+        # Neither engine decodes chunked bodies, and the length must be known before reading
+        return 411, 'Transfer-Encoding is not supported; send the body with a Content-Length'
+    if not content_lengths:
+        return None
+    value = content_lengths[0].strip()
+    # int() would also take '+5', '-5' and '1_000'; several headers could be read differently downstream
+    if len(content_lengths) > 1 or not (value.isdigit() and value.isascii()):
+        return 400, 'Invalid Content-Length'
+    if int(value) > max_body_bytes:
+        return 413, f'Request body larger than {max_body_bytes} bytes'
+    return None
+
+
+def _error_response(status, message):
+    """A complete response refusing a request the handler never sees; JSON like its own errors"""
+    body = json.dumps({'error': message}).encode()
+    return (b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nConnection: close\r\n'
+            b'Content-Length: %d\r\n\r\n%s' % (status, HTTPStatus(status).phrase.encode(), len(body), body))
+
+
+def _keep_alive(head, response):
+    """Mirror BaseHTTPRequestHandler's keep-alive decision for one exchange"""
+    lines = _header_lines(head)
+    keep_alive = lines[0].endswith('HTTP/1.1')
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'connection':
+            value = value.strip().lower()
+            if value == 'close':
+                keep_alive = False
+            elif value == 'keep-alive':
+                keep_alive = True
+    response_head = response.split(b'\r\n\r\n', 1)[0].lower()
+    if b'\r\nconnection: close' in response_head or not response_head.startswith(b'http/1.1'):
+        keep_alive = False
+    return keep_alive
+
+
+def make_server(engine, server_address, RequestHandlerClass, workers=DEFAULT_WORKERS,
+                max_body_bytes=MAX_BODY_BYTES):
+    """Build a server for ``engine`` (one of ENGINES)"""
+    if engine == 'threaded':
+        return ThreadPoolHTTPServer(server_address, RequestHandlerClass, workers=workers,
+                                    max_body_bytes=max_body_bytes)
+    if engine == 'asyncio':
+        return AsyncioHTTPServer(server_address, RequestHandlerClass, workers=workers,
+                                 max_body_bytes=max_body_bytes)
+    raise ValueError(f"Unknown serving engine {engine!r}; expected one of {', '.join(ENGINES)}")
@@ -0,0 +1,222 @@
+"""Incrementally maintained catalog statistics
+
+Each server describes its product shape with a ``figures`` function returning a
+``ProductFigures`` tuple; the aggregator keeps running totals and leaders up to
+date on every add, update or remove, so reading the stats never scans the
+catalog.
+
+``freeze()`` captures the figures as JSON-able state, which a catalog image
+stores; ``FrozenStats`` serves that state back, read-only.
+"""
+import heapq
+import threading
+from collections import namedtuple
+
+ProductFigures = namedtuple('ProductFigures', [
+    'key',             # unique product id
+    'title',
+    'category',
+    'price',           # current (discounted) price
+    'original_price',
+    'rating',
+    'review_count',
+    'discount_percentage',
+])
+
+
+def _cents(value):
+    # Sums are kept as integers in hundredths so add/remove never drift
+    return int(round(value * 100))
+
+
+class Totals:
+    """Running sums and leaders for one group of products (the catalog or a category)"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.count = 0
+        self._price = 0
+        self._original = 0
+        self._savings = 0
+        self._rating = 0
+        self._discount = 0
+        self.total_reviews = 0
+        self._members = {}
+        # Max-heaps with lazy deletion; stale entries are dropped when they reach the top
+        self._by_discount = []
+        self._by_rating = []
+
+    def add(self, f, seq):
+        self.count += 1
+        self._price += _cents(f.price)
+        self._original += _cents(f.original_price)
+        self._savings += _cents(f.original_price) - _cents(f.price)
+        self._rating += _cents(f.rating)
+        self._discount += _cents(f.discount_percentage)
+        self.total_reviews += f.review_count
+        self._members[f.key] = (f, seq)
+        # Ties go to the earliest product, matching max() over the catalog order
+        heapq.heappush(self._by_discount, (-discount_fraction(f), seq, f.key, f))
+        heapq.heappush(self._by_rating, (-f.rating, seq, f.key, f))
+
+    def remove(self, f):
+        self.count -= 1
+        self._price -= _cents(f.price)
+        self._original -= _cents(f.original_price)
+        self._savings -= _cents(f.original_price) - _cents(f.price)
+        self._rating -= _cents(f.rating)
+        self._discount -= _cents(f.discount_percentage)
+        self.total_reviews -= f.review_count
+        del self._members[f.key]
+        self._prune(self._by_discount)
+        self._prune(self._by_rating)
+
+    def _prune(self, heap):
+        while heap and self._members.get(heap[0][2], (None,))[0] is not heap[0][3]:
+            heapq.heappop(heap)
+        # Lazy deletion must not let the heap grow without bound under churn
+        if len(heap) > 2 * self.count + 64:
+            heap[:] = [entry for entry in heap if self._members.get(entry[2], (None,))[0] is entry[3]]
+            heapq.heapify(heap)
+
+    def state(self):
+        """The sums and leaders as JSON-able state (see from_state)"""
+        leaders = [self.best_discount, self.best_rating]
+        return {
+            'name': self.name, 'count': self.count, 'price': self._price, 'original': self._original,
+            'savings': self._savings, 'rating': self._rating, 'discount': self._discount,
+            'total_reviews': self.total_reviews,
+            'leaders': [None if f is None else list(f) for f in leaders],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Totals with the figures of ``state``; they can be read but not added to or removed from"""
+        totals = cls(state['name'])
+        totals.count = state['count']
+        totals._price, totals._original, totals._savings = state['price'], state['original'], state['savings']
+        totals._rating, totals._discount = state['rating'], state['discount']
+        totals.total_reviews = state['total_reviews']
+        best_discount, best_rating = (None if f is None else ProductFigures(*f) for f in state['leaders'])
+        if best_discount is not None:
+            totals._by_discount = [(0, 0, best_discount.key, best_discount)]
+            totals._by_rating = [(0, 0, best_rating.key, best_rating)]
+        return totals
+
+    @property
+    def total_price(self):
+        return self._price / 100
+
+    @property
+    def total_original(self):
+        return self._original / 100
+
+    @property
+    def total_savings(self):
+        return self._savings / 100
+
+    @property
+    def average_price(self):
+        return self._price / 100 / self.count if self.count else 0
+
+    @property
+    def average_rating(self):
+        return self._rating / 100 / self.count if self.count else 0
+
+    @property
+    def average_discount_percentage(self):
+        """Mean of the per-product discount percentages"""
+        return self._discount / 100 / self.count if self.count else 0
+
+    @property
+    def weighted_discount_percentage(self):
+        """Total savings as a percentage of the total original price"""
+        return self._savings / self._original * 100 if self._original > 0 else 0
+
+    @property
+    def best_discount(self):
+        """ProductFigures with the largest fractional discount, or None"""
+        return self._by_discount[0][3] if self.count else None
+
+    @property
+    def best_rating(self):
+        """ProductFigures with the highest rating, or None"""
+        return self._by_rating[0][3] if self.count else None
+
+
+class StatsAggregator:
+    """Catalog-wide and per-category Totals kept in sync with product changes"""
+
+    def __init__(self, figures, products=()):
+        self.figures = figures
+        self.totals = Totals()
+        self.categories = {}
+        self._current = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        for product in products:
+            self.add(product)
+
+    def add(self, product):
+        """Add a product, or replace the product with the same key"""
+        f = self.figures(product)
+        with self._lock:
+            old = self._current.get(f.key)
+            if old is not None:
+                seq = old[1]
+                self._remove(old[0])
+            else:
+                seq = self._seq
+                self._seq += 1
+            self._current[f.key] = (f, seq)
+            self.totals.add(f, seq)
+            category = self.categories.get(f.category)
+            if category is None:
+                category = self.categories[f.category] = Totals(f.category)
+            category.add(f, seq)
+
+    update = add
+
+    def remove(self, product):
+        """Remove a product (matched by key); unknown products are ignored"""
+        key = self.figures(product).key
+        with self._lock:
+            current = self._current.pop(key, None)
+            if current is not None:
+                self._remove(current[0])
+
+    def _remove(self, f):
+        self.totals.remove(f)
+        category = self.categories[f.category]
+        category.remove(f)
+        if not category.count:
+            del self.categories[f.category]
+
+    def top_categories(self, n=None):
+        """Categories by product count (largest first, ties in first-seen order)"""
+        ranked = sorted(self.categories.values(), key=lambda t: -t.count)
+        return ranked if n is None else ranked[:n]
+
+    def freeze(self):
+        """The catalog and category totals as JSON-able state, for FrozenStats"""
+        with self._lock:
+            return {'totals': self.totals.state(), 'categories': [t.state() for t in self.categories.values()]}
+
+
+class FrozenStats:
+    """The totals of a StatsAggregator as they were when frozen, read-only"""
+
+    def __init__(self, state):
+        self.totals = Totals.from_state(state['totals'])
+        self.categories = {}
+        for category in state['categories']:
+            totals = Totals.from_state(category)
+            self.categories[totals.name] = totals
+
+    top_categories = StatsAggregator.top_categories
+
+
+def discount_fraction(f):
+    if f.original_price <= 0:
+        return 0.0
+    return (f.original_price - f.price) / f.original_price
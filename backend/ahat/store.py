@@ -0,0 +1,546 @@
+"""In-memory product store with hash and sorted secondary indexes
+
+Products are kept as the servers' own dicts; the store only needs getter
+functions for the fields it indexes:
+
+* ``hash_fields``: exact-match lookups (ASIN, category, brand...)
+* ``sort_fields``: numeric fields kept in sorted lists, used for range filters
+  (bisection) and for sorted pages (walking the list in order)
+
+Catalog (insertion) order is kept as one more sorted index, so unsorted pages
+and keyset cursors go through the same code as sorted ones.
+
+Listeners (for example a StatsAggregator) are told about every change through
+their ``add(product)`` and ``remove(product)`` methods.
+"""
+import base64
+import heapq
+import json
+import math
+import threading
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+
+# Sort fields accepted by the /api/products ``sort=`` parameter
+SORTS = ('price', 'rating', 'discount', 'trending')
+# Fields that sort best-first (descending) unless the caller asks otherwise
+DESCENDING_BY_DEFAULT = ('rating', 'discount', 'trending')
+
+# Ids and ASINs together that one /api/products/batch request may ask for
+MAX_BATCH = 100
+
+# The sort "field" for catalog order; its index holds (seq, seq, key)
+CATALOG_ORDER = None
+
+_LOWEST = float('-inf')
+_HIGHEST = float('inf')
+
+
+class ProductStore:
+
+    # False for a store served from a catalog image (see catalog_image.MappedStore)
+    writable = True
+
+    def __init__(self, key, hash_fields=None, sort_fields=None, products=()):
+        self.key = key
+        self.hash_fields = dict(hash_fields or {})
+        self.sort_fields = dict(sort_fields or {})
+        self._lock = threading.RLock()
+        self._products = {}
+        self._seq = {}
+        self._next_seq = 0
+        # field -> value -> {key: None} (a dict keeps lookups in catalog order)
+        self._hash = {field: {} for field in self.hash_fields}
+        # field -> sorted list of (value, seq, key); seq breaks ties in catalog order
+        self._sorted = {field: [] for field in self.sort_fields}
+        self._sorted[CATALOG_ORDER] = []
+        # field -> sorted runs of entries loaded but not merged into _sorted yet (see _settle)
+        self._unmerged = {field: [] for field in self.sort_fields}
+        self._listeners = []
+        self.version = 0
+        if products:
+            self.load(products)
+
+    def __len__(self):
+        return len(self._products)
+
+    def __contains__(self, key):
+        return key in self._products
+
+    def subscribe(self, listener):
+        """Send every later change to ``listener.add`` / ``listener.remove``"""
+        self._listeners.append(listener)
+
+    def get(self, key):
+        return self._products.get(key)
+
+    def lookup(self, field, value):
+        """Products whose hash-indexed ``field`` equals ``value``"""
+        with self._lock:
+            keys = self._hash[field].get(value, ())
+            return [self._products[k] for k in keys]
+
+    def all(self):
+        with self._lock:
+            return list(self._products.values())
+
+    def hold(self):
+        """``with store.hold():`` keeps the store, and so its listeners, unchanged while the caller reads
+
+        For responses made of several reads (a page, the stats...) that have to
+        agree with each other. Listeners are updated under the same lock.
+        """
+        return self._lock
+
+    def batch(self, keys=(), **values):
+        """Products by key and by hash-indexed field value, in the order asked for, without duplicates
+
+        ``values`` maps hash fields to the values wanted (``asin=[...]``, say).
+        Returns ``(products, missing)``: ``missing['keys']`` and ``missing[field]``
+        list what matched no product.
+        """
+        # Internal keys of the products found, in the order asked for
+        found = {}
+        missing = {'keys': []}
+        with self._lock:
+            for key in keys:
+                internal = self._internal_key(key)
+                if internal is None:
+                    missing['keys'].append(key)
+                else:
+                    found[internal] = None
+            for field, wanted in values.items():
+                index = self._hash[field]
+                missing[field] = []
+                for value in wanted:
+                    matches = index.get(value)
+                    if not matches:
+                        missing[field].append(value)
+                    else:
+                        found.update(dict.fromkeys(matches))
+            return self._fetch(found), missing
+
+    def load(self, products):
+        """Upsert many products, sorting each sorted index once instead of per insert
+
+        A batch much smaller than the catalog (one of a streamed import) is
+        kept aside and merged in with later ones: an index is merged into
+        only once what waits is an eighth of its size, or before it is next
+        read, so a streamed import copies each index a bounded number of
+        times rather than once per batch.
+        """
+        # Later duplicates replace earlier ones but keep their position, like repeated upserts
+        batch = {}
+        for product in products:
+            batch[self.key(product)] = product
+        with self._lock:
+            pending = {field: [] for field in self.sort_fields}
+            order = self._sorted[CATALOG_ORDER]
+            for key, product in batch.items():
+                if key in self._products:
+                    self.upsert(product)
+                    continue
+                seq = self._seq[key] = self._next_seq
+                self._next_seq += 1
+                self._products[key] = product
+                order.append((seq, seq, key))
+                for field, getter in self.hash_fields.items():
+                    value = getter(product)
+                    if value is not None:
+                        self._hash[field].setdefault(value, {})[key] = None
+                for field, getter in self.sort_fields.items():
+                    value = getter(product)
+                    if value is not None:
+                        pending[field].append((value, seq, key))
+                for listener in self._listeners:
+                    listener.add(product)
+            for field, entries in pending.items():
+                if entries:
+                    entries.sort()
+                    unmerged = self._unmerged[field]
+                    unmerged += entries
+                    if len(unmerged) * 8 > len(self._sorted[field]):
+                        self._merge(field)
+            self.version += 1
+
+    def upsert(self, product):
+        """Add a product, or replace the product with the same key"""
+        key = self.key(product)
+        with self._lock:
+            self._settle()
+            old = self._products.get(key)
+            if old is not None:
+                seq = self._seq[key]
+                self._unindex(key, old, product)
+                self._index(key, product, seq, old)
+            else:
+                seq = self._seq[key] = self._next_seq
+                self._next_seq += 1
+                # New products always sort last in catalog order
+                self._sorted[CATALOG_ORDER].append((seq, seq, key))
+                self._index(key, product, seq)
+            self._products[key] = product
+            self.version += 1
+            for listener in self._listeners:
+                listener.add(product)
+        return old
+
+    def remove(self, key):
+        """Remove a product by key; returns it, or None if it was not stored"""
+        with self._lock:
+            self._settle()
+            product = self._products.pop(key, None)
+            if product is None:
+                return None
+            self._unindex(key, product)
+            seq = self._seq.pop(key)
+            order = self._sorted[CATALOG_ORDER]
+            del order[bisect_left(order, (seq,))]
+            self.version += 1
+            for listener in self._listeners:
+                listener.remove(product)
+        return product
+
+    def _settle(self):
+        # Merge what load() kept aside before the indexes are read or edited
+        for field, unmerged in self._unmerged.items():
+            if unmerged:
+                self._merge(field)
+
+    def _merge(self, field):
+        # The index and the runs after it are sorted already, and Timsort merges runs in close to linear time
+        index = self._sorted[field]
+        index += self._unmerged[field]
+        index.sort()
+        self._unmerged[field] = []
+
+    def _index(self, key, product, seq, old=None):
+        # Fields whose value did not change keep their index entries (see _unindex)
+        for field, getter in self.hash_fields.items():
+            value = getter(product)
+            if value is None or (old is not None and getter(old) == value):
+                continue
+            bucket = self._hash[field].setdefault(value, {})
+            if bucket and self._seq[next(reversed(bucket))] > seq:
+                # An older product moved into this bucket; keep buckets in catalog order
+                bucket[key] = None
+                self._hash[field][value] = dict.fromkeys(sorted(bucket, key=self._seq.__getitem__))
+            else:
+                bucket[key] = None
+        for field, getter in self.sort_fields.items():
+            value = getter(product)
+            if value is None or (old is not None and getter(old) == value):
+                continue
+            insort(self._sorted[field], (value, seq, key))
+
+    def _unindex(self, key, product, new=None):
+        seq = self._seq[key]
+        for field, getter in self.hash_fields.items():
+            value = getter(product)
+            if new is not None and getter(new) == value:
+                continue
+            bucket = self._hash[field].get(value)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._hash[field][value]
+        for field, getter in self.sort_fields.items():
+            value = getter(product)
+            if value is None or (new is not None and getter(new) == value):
+                continue
+            index = self._sorted[field]
+            i = bisect_left(index, (value, seq))
+            if i < len(index) and index[i][2] == key:
+                del index[i]
+
+    def position(self, product, sort=CATALOG_ORDER):
+        """The ``(value, seq)`` keyset position of a stored product in ``sort`` order"""
+        key = self.key(product)
+        return self._value_of(sort)(key), self._seq[key]
+
+    def query(self, equals=None, ranges=None, sort=CATALOG_ORDER, descending=None, offset=0, limit=None,
+              after=None):
+        """Filter, sort and page the catalog using the indexes
+
+        ``equals`` maps hash fields to a value, ``ranges`` maps sort fields to
+        ``(low, high)`` inclusive bounds (either may be None). ``sort=None``
+        means catalog order. ``after`` is a keyset position from ``position()``:
+        the page starts right after it, so it stays stable while products are
+        added or removed elsewhere. Returns ``(total_matches, products)``.
+        """
+        equals = {f: v for f, v in (equals or {}).items() if v is not None}
+        ranges = {f: r for f, r in (ranges or {}).items() if r is not None and r != (None, None)}
+        if sort not in self._sorted:
+            raise ValueError(f'cannot sort by {sort!r}')
+        if descending is None:
+            descending = sort in DESCENDING_BY_DEFAULT
+        stop = None if limit is None else offset + limit
+
+        with self._lock:
+            self._settle()
+            # Each filter can produce its candidates straight from an index
+            sources = []
+            for field, value in equals.items():
+                if field not in self._hash:
+                    raise ValueError(f'cannot filter by {field!r}')
+                bucket = self._hash[field].get(value, {})
+                sources.append((len(bucket), 'hash', field, bucket))
+            for field, (low, high) in ranges.items():
+                if field not in self.sort_fields:
+                    raise ValueError(f'cannot filter by {field!r}')
+                lo, hi = self._range_bounds(field, low, high)
+                sources.append((hi - lo, 'range', field, (lo, hi)))
+
+            if not sources:
+                bounds = self._after_bounds(sort, descending, None, after)
+                return len(self._products), self._fetch(self._walk(sort, descending, bounds, offset, stop))
+
+            sources.sort(key=lambda s: s[0])
+            smallest = sources[0]
+            # Hash buckets are already in catalog order
+            in_order = sort is CATALOG_ORDER and smallest[1] == 'hash' and after is None
+
+            if len(sources) == 1:
+                # A single filter: its index already knows how many products match
+                total = smallest[0]
+                if smallest[1] == 'range' and smallest[2] == sort:
+                    bounds = self._after_bounds(sort, descending, smallest[3], after)
+                    keys = self._walk(sort, descending, bounds, offset, stop)
+                elif in_order and not descending:
+                    keys = islice(self._source_keys(smallest), offset, stop)
+                elif stop is not None and stop * len(self._sorted[sort]) < total * total:
+                    # Expected walk length (stop * n / total) beats sorting `total` candidates
+                    check = self._membership(smallest)
+                    bounds = self._after_bounds(sort, descending, None, after)
+                    keys = islice(filter(check, self._walk_keys(sort, descending, bounds)), offset, stop)
+                else:
+                    keys = self._sorted_page(self._source_keys(smallest), sort, descending, offset, stop, after)
+                return total, self._fetch(keys)
+
+            # Several filters: intersect starting from the most selective index
+            checks = [self._membership(s) for s in sources[1:]]
+            matched = [k for k in self._source_keys(smallest) if all(check(k) for check in checks)]
+            if in_order and not descending:
+                keys = matched[offset:stop]
+            else:
+                keys = self._sorted_page(matched, sort, descending, offset, stop, after)
+            return len(matched), self._fetch(keys)
+
+    def _fetch(self, keys):
+        return [self._products[k] for k in keys]
+
+    def _internal_key(self, key):
+        # What the indexes hold for a product: its key here (a MappedStore uses record numbers)
+        return key if key in self._products else None
+
+    def _value_of(self, field):
+        if field is CATALOG_ORDER:
+            return self._seq.__getitem__
+        getter, products = self.sort_fields[field], self._products
+        return lambda key: getter(products[key])
+
+    def _range_bounds(self, field, low, high):
+        index = self._sorted[field]
+        lo = 0 if low is None else bisect_left(index, (low, -1))
+        hi = len(index) if high is None else bisect_right(index, (high, _HIGHEST))
+        return lo, max(lo, hi)
+
+    def _after_bounds(self, field, descending, bounds, after):
+        # Narrow (lo, hi) of a sorted index to the entries that come after a keyset position
+        index = self._sorted[field]
+        lo, hi = bounds or (0, len(index))
+        if after is not None:
+            value, seq = after
+            if descending:
+                hi = min(hi, bisect_left(index, (value, seq)))
+            else:
+                lo = max(lo, bisect_left(index, (value, seq + 1)))
+        return lo, max(lo, hi)
+
+    def _source_keys(self, source):
+        _, kind, field, data = source
+        if kind == 'hash':
+            return iter(data)
+        lo, hi = data
+        return (entry[2] for entry in islice(self._sorted[field], lo, hi))
+
+    def _membership(self, source):
+        _, kind, field, data = source
+        if kind == 'hash':
+            return data.__contains__
+        index = self._sorted[field]
+        value_of = self._value_of(field)
+        lo, hi = data
+        low = index[lo][0] if lo < hi else _HIGHEST
+        high = index[hi - 1][0] if lo < hi else _LOWEST
+
+        def check(key):
+            value = value_of(key)
+            return value is not None and low <= value <= high
+        return check
+
+    def _walk_keys(self, field, descending, bounds):
+        index = self._sorted[field]
+        lo, hi = bounds
+        if descending:
+            return (index[i][2] for i in range(hi - 1, lo - 1, -1))
+        return (index[i][2] for i in range(lo, hi))
+
+    def _walk(self, field, descending, bounds, offset, stop):
+        # Direct positional slice of the sorted index: O(log n + limit)
+        index = self._sorted[field]
+        lo, hi = bounds
+        if descending:
+            start = hi - offset
+            end = lo if stop is None else max(lo, hi - stop)
+            return [index[i][2] for i in range(start - 1, end - 1, -1)]
+        start = lo + offset
+        end = hi if stop is None else min(hi, lo + stop)
+        return [index[i][2] for i in range(start, end)]
+
+    def _sorted_page(self, keys, field, descending, offset, stop, after=None):
+        value_of, seq = self._value_of(field), self._seq
+        decorated = []
+        for k in keys:
+            value = value_of(k)
+            if value is not None:
+                decorated.append((value, seq[k], k))
+        if after is not None:
+            if descending:
+                decorated = [entry for entry in decorated if entry[:2] < after]
+            else:
+                decorated = [entry for entry in decorated if entry[:2] > after]
+        if stop is None:
+            decorated.sort(reverse=descending)
+        elif descending:
+            decorated = heapq.nlargest(stop, decorated)
+        else:
+            decorated = heapq.nsmallest(stop, decorated)
+        return [entry[2] for entry in decorated[offset:stop]]
+
+
+def parse_product_query(params):
+    """Read the /api/products filter parameters from a parse_qs-style dict
+
+    Returns keyword arguments for ``ProductStore.query`` (without paging).
+    Raises ValueError for malformed numbers or an unknown sort.
+    """
+    def first(name):
+        values = params.get(name)
+        if not values:
+            return None
+        value = values[0] if isinstance(values, (list, tuple)) else values
+        return value if value != '' else None
+
+    def number(name):
+        value = first(name)
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f'{name} must be a number') from None
+
+    sort = first('sort')
+    descending = None
+    if sort is not None and sort.startswith('-'):
+        sort, descending = sort[1:], True
+    if sort is not None and sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    order = first('order')
+    if order is not None:
+        if order not in ('asc', 'desc'):
+            raise ValueError('order must be asc or desc')
+        descending = order == 'desc'
+
+    ranges = {}
+    price = (number('min_price'), number('max_price'))
+    if price != (None, None):
+        ranges['price'] = price
+    for name, field in (('min_rating', 'rating'), ('min_discount', 'discount')):
+        low = number(name)
+        if low is not None:
+            ranges[field] = (low, None)
+
+    return {
+        'equals': {'category': first('category'), 'brand': first('brand')},
+        'ranges': ranges,
+        'sort': sort,
+        'descending': descending,
+    }
+
+
+def int_param(params, name, default, low=1, high=None):
+    """Integer parameter ``name`` from a parse_qs-style dict, ``default`` when absent
+
+    Raises ValueError naming the parameter unless it is an integer from
+    ``low`` to ``high`` (unbounded above when None).
+    """
+    values = params.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        raise ValueError(f'{name} must be an integer') from None
+    if high is not None and not low <= value <= high:
+        raise ValueError(f'{name} must be between {low} and {high}')
+    if value < low:
+        raise ValueError(f'{name} must be at least {low}')
+    return value
+
+
+def positive_param(params, name, default=None):
+    """Positive number parameter ``name`` from a parse_qs-style dict, ``default`` when absent
+
+    Raises ValueError naming the parameter otherwise; float() alone would
+    also take 'nan' and 'inf', which do not even encode as JSON.
+    """
+    values = params.get(name)
+    if not values:
+        return default
+    try:
+        value = float(values[0])
+    except ValueError:
+        value = math.nan
+    if not (math.isfinite(value) and value > 0):
+        raise ValueError(f'{name} must be a positive number')
+    return value
+
+
+def parse_batch_query(params):
+    """The ids and ASINs an /api/products/batch request asks for, from a parse_qs-style dict
+
+    Both parameters take comma-separated values and may be repeated; blanks
+    and duplicates are dropped. Raises ValueError when there are none, or
+    more than MAX_BATCH together.
+    """
+    def values(name):
+        return list(dict.fromkeys(value.strip() for values in params.get(name) or ()
+                                  for value in values.split(',') if value.strip()))
+
+    ids, asins = values('ids'), values('asins')
+    if not ids and not asins:
+        raise ValueError('ids or asins required')
+    if len(ids) + len(asins) > MAX_BATCH:
+        raise ValueError(f'at most {MAX_BATCH} ids and asins together')
+    return ids, asins
+
+
+def encode_cursor(sort, descending, position):
+    """Opaque keyset cursor for the product after ``position`` in this sort order"""
+    raw = json.dumps([sort, bool(descending), position[0], position[1]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor: ``(sort, descending, (value, seq))``; ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, descending, value, seq = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor') from None
+    if (sort is not None and sort not in SORTS) or not isinstance(seq, int) \
+            or not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError('invalid cursor')
+    return sort, bool(descending), (value, seq)
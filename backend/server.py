@@ -1,359 +1,1721 @@
+import argparse
+import hashlib
+import hmac
 import http.server
-import socketserver
+import itertools
 import json
+import os
 import random
-from datetime import datetime
-from urllib.parse import urlparse, parse_qs
-import requests
-from bs4 import BeautifulSoup
+import signal
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs, unquote
+
+from ahat.aggregator import FeedAggregator, Source, load_sources
+from ahat.clicks import ClickTracker, click_score
+from ahat.classifier import DEFAULT_CONFIG as DEFAULT_CLASSIFIER_CONFIG, UNKNOWN_ASIN, Classifier, extract_asin
+from ahat.catalog_image import CatalogImage, write_image
+from ahat.feed_cache import FeedCache
+from ahat.fields import parse_fields, project
+from ahat.feed_import import (DEFAULT_BATCH_SIZE as IMPORT_BATCH_SIZE, FORMATS as IMPORT_FORMATS,
+                              LimitedReader, detect_format, import_feed, open_feed, text_stream)
+from ahat.http_client import UpstreamClient
+from ahat.images import (DEFAULT_DISK_BYTES as IMAGE_DISK_BYTES, DEFAULT_MEMORY_BYTES as IMAGE_MEMORY_BYTES,
+                         DEFAULT_WIDTH as IMAGE_DEFAULT_WIDTH, DEFAULT_WORKERS as IMAGE_DEFAULT_WORKERS,
+                         ImageCache, ImageError, ImageProxy)
+from ahat.js_literal import PRODUCTS_DECLARATION, extract_array
+from ahat.price_history import PriceHistory
+from ahat.rankings import Rankings
+from ahat.metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, SCRAPE_BUCKETS, Registry, RequestMetrics,
+                          SamplingProfiler, register_cache)
+from ahat.records import record_type, to_json
+from ahat.response_cache import GZIP_MIN_BYTES, ResponseCache
+from ahat.prefork import run_children
+from ahat.scheduler import RefreshRun, RefreshScheduler
+from ahat.shared_catalog import SharedCatalog
+from ahat.search import SearchIndex
+from ahat.snapshot import load_snapshot, save_snapshot
+from ahat.stats import ProductFigures, StatsAggregator
+from ahat.store import (DESCENDING_BY_DEFAULT, ProductStore, decode_cursor, encode_cursor, int_param,
+                        parse_batch_query, parse_product_query, positive_param)
+from ahat.serving import DEFAULT_WORKERS, ENGINES, MAX_BODY_BYTES, KeepAliveHandlerMixin, make_server
 
 PORT = 8000
+ENGINE = os.environ.get('AHAT_ENGINE', 'threaded')
+WORKERS = int(os.environ.get('AHAT_WORKERS', DEFAULT_WORKERS))
+# Larger request bodies (feed uploads) are refused with a 413
+MAX_BODY_MB = float(os.environ.get('AHAT_MAX_BODY_MB', MAX_BODY_BYTES / 2**20))
+
+# Upstream feed settings (override with environment variables, e.g. to point at a local stand-in server).
+# Sources are listed in backend/config/sources.json (or AHAT_SOURCES_CONFIG);
+# setting AHAT_SOURCE_URL serves that single page instead.
+SOURCE_URL = os.environ.get('AHAT_SOURCE_URL', 'https://sixsevendeals.com/')
+SOURCES_CONFIG = os.environ.get('AHAT_SOURCES_CONFIG', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'config', 'sources.json'))
+FEED_TTL = float(os.environ.get('AHAT_FEED_TTL', 300))
+FEED_STALE_TTL = float(os.environ.get('AHAT_FEED_STALE_TTL', 3600))
+FEED_FAILURE_BACKOFF = float(os.environ.get('AHAT_FEED_FAILURE_BACKOFF', 5))
+FEED_MAX_BACKOFF = float(os.environ.get('AHAT_FEED_MAX_BACKOFF', 300))
+# Scrape in the background every REFRESH_INTERVAL seconds (+/- a REFRESH_JITTER fraction);
+# 0 scrapes on demand instead, when a request finds the cached scrape stale
+REFRESH_INTERVAL = float(os.environ.get('AHAT_REFRESH_INTERVAL', FEED_TTL))
+REFRESH_JITTER = float(os.environ.get('AHAT_REFRESH_JITTER', 0.1))
+# Serving processes; with more than one, a separate refresher process scrapes and
+# shares each new catalog, which the workers check for every SHARED_POLL seconds.
+# The workers serve it from one shared catalog image (see ahat.shared_catalog)
+PROCESSES = int(os.environ.get('AHAT_PROCESSES', 1))
+SHARED_POLL = float(os.environ.get('AHAT_SHARED_POLL', 1.0))
+# A worker with nothing to serve waits this long for the refresher's first scrape
+FIRST_SCRAPE_WAIT = 60
+UPSTREAM_POOL_SIZE = int(os.environ.get('AHAT_UPSTREAM_POOL_SIZE', 10))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('AHAT_UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('AHAT_UPSTREAM_READ_TIMEOUT', 10))
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# The live and imported catalogs are saved here after every change and restored at
+# boot, so a restart serves the last good catalog without waiting for a scrape ('' = off)
+SNAPSHOT_DIR = os.environ.get('AHAT_SNAPSHOT_DIR', DATA_DIR)
+# Append-only log of every price change seen by a scrape or import ('' = kept in memory only)
+PRICE_HISTORY_FILE = os.environ.get('AHAT_PRICE_HISTORY_FILE', os.path.join(DATA_DIR, 'price_history.log'))
+# Append-only log of the affiliate clicks made through /go/<id> ('' = counted in memory only).
+# Buffered clicks are logged and counted every CLICK_FLUSH_INTERVAL seconds, and
+# trending scores catch up with the counts every CLICK_SCORE_INTERVAL seconds.
+CLICK_LOG_FILE = os.environ.get('AHAT_CLICK_LOG', os.path.join(DATA_DIR, 'clicks.log'))
+CLICK_FLUSH_INTERVAL = float(os.environ.get('AHAT_CLICK_FLUSH_INTERVAL', 1.0))
+CLICK_SCORE_INTERVAL = float(os.environ.get('AHAT_CLICK_SCORE_INTERVAL', 60))
+# Thumbnails served by /img/<id> are kept here, least recently used out past
+# IMAGE_CACHE_MB ('' = memory only), and the last IMAGE_MEMORY_MB of them in memory
+IMAGE_CACHE_DIR = os.environ.get('AHAT_IMAGE_CACHE_DIR', os.path.join(DATA_DIR, 'images'))
+IMAGE_CACHE_MB = float(os.environ.get('AHAT_IMAGE_CACHE_MB', IMAGE_DISK_BYTES / 2**20))
+IMAGE_MEMORY_MB = float(os.environ.get('AHAT_IMAGE_MEMORY_MB', IMAGE_MEMORY_BYTES / 2**20))
+# Processes resizing images, and how long clients may keep a thumbnail. Resizing needs
+# Pillow (pip install Pillow); without it /img/ serves the sizes the image CDN offers
+# (see ahat.images), and main() says so at startup
+IMAGE_WORKERS = int(os.environ.get('AHAT_IMAGE_WORKERS', IMAGE_DEFAULT_WORKERS))
+IMAGE_MAX_AGE = int(os.environ.get('AHAT_IMAGE_MAX_AGE', 7 * 24 * 3600))
+
+# Responses smaller than this are never gzipped
+RESPONSE_GZIP_MIN_BYTES = int(os.environ.get('AHAT_GZIP_MIN_BYTES', GZIP_MIN_BYTES))
+
+# Admin endpoints (bulk import, profiling) are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('AHAT_ADMIN_TOKEN')
+# cProfile 1 in N requests from the start (0 = off); change it at runtime with POST /api/admin/profile
+PROFILE_SAMPLE = int(os.environ.get('AHAT_PROFILE_SAMPLE', 0))
+
+# Brand dictionary and badge -> category rules used when normalizing scraped products
+CLASSIFIER = Classifier.from_file(os.environ.get('AHAT_CLASSIFIER_CONFIG', DEFAULT_CLASSIFIER_CONFIG))
+
+
+# Every upstream fetch shares one connection pool (no DNS/TCP/TLS setup per
+# scrape) and revalidates with If-None-Match / If-Modified-Since
+UPSTREAM = UpstreamClient(
+    pool_size=UPSTREAM_POOL_SIZE,
+    timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT),
+    headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'},
+)
+
+# Timing and cache figures, served in the Prometheus text format at /metrics
+METRICS = Registry()
+PROFILER = SamplingProfiler(PROFILE_SAMPLE)
+HTTP_METRICS = RequestMetrics(METRICS, PROFILER)
+# Anything else is labelled "other" so stray paths can't grow the number of series
+ROUTES = {'/api', '/api/dashboard', '/api/products', '/api/products/categories', '/api/products/stats',
+          '/api/products/batch', '/api/products/search', '/api/products/suggest', '/api/products/price-history',
+          '/api/products/price-drops', '/api/products/top',
+          '/api/admin/import', '/api/admin/profile', '/metrics', '/go/{id}', '/img/{id}'}
+SCRAPE_SECONDS = METRICS.histogram('ahat_scrape_duration_seconds', 'Time to refresh the live catalog from every source',
+                                   ('outcome',), SCRAPE_BUCKETS)
+SOURCE_SECONDS = METRICS.histogram('ahat_source_fetch_duration_seconds', 'Time to fetch one source',
+                                   ('source', 'status'), SCRAPE_BUCKETS)
+CATALOG_REQUESTS = METRICS.counter('ahat_catalog_requests_total',
+                                   'Catalog lookups by the catalog served and the state of the live feed cache',
+                                   ('source', 'feed_state'))
+
+
+def extract_products(page):
+    """Find the JavaScript products array in the raw page and parse just that literal"""
+    # No HTML parsing, and apostrophes in descriptions are fine
+    return extract_array(page, PRODUCTS_DECLARATION)
+
+
+def scrape_your_website(url=None):
+    """Scrape your actual SixSevenDeals.com website"""
+    # Your actual website URL
+    products, _ = UPSTREAM.get(url or SOURCE_URL, extract_products)
+    return products
+
+
+def fetch_source(source):
+    """Fetch one configured source; returns ``(raw_products, changed)``"""
+    return UPSTREAM.get(source.url, extract_products, timeout=(UPSTREAM_CONNECT_TIMEOUT, source.timeout))
+
+
+def product_identity(raw_product):
+    """Products listed by several sources are merged by ASIN (or by identical link)"""
+    link = raw_product.get('link') or ''
+    asin = extract_asin(link)
+    if asin != UNKNOWN_ASIN:
+        return asin
+    return link or None
+
+
+if 'AHAT_SOURCE_URL' in os.environ:
+    SOURCES, SOURCE_OPTIONS = [Source('sixsevendeals', SOURCE_URL, UPSTREAM_READ_TIMEOUT)], {}
+else:
+    SOURCES, SOURCE_OPTIONS = load_sources(SOURCES_CONFIG)
+
+# All sources are fetched concurrently (bounded by max_concurrency), each with
+# its own timeout and circuit breaker
+AGGREGATOR = FeedAggregator(SOURCES, fetch_source, product_identity, **SOURCE_OPTIONS)
+
+
+# Normalized products are kept as compact read-only records (see ahat.records),
+# in the field order of the JSON responses
+Price = record_type('Price', ('original', 'discounted', 'currency', 'discount_percentage', 'savings'),
+                    shared=('currency',))
+Product = record_type('Product', ('id', 'asin', 'title', 'description', 'price', 'category', 'brand', 'rating',
+                                  'review_count', 'image', 'affiliate_link', 'trending_score', 'deal_score',
+                                  'status'),
+                      shared=('category', 'brand', 'status'), nested={'price': Price})
+
+# A normalized catalog with its indexes and stats; every build gets a new version
+Catalog = namedtuple('Catalog', ['version', 'store', 'stats', 'search', 'rankings'])
+_catalog_versions = itertools.count(1)
+
+# Your 7 real products, served when the website cannot be scraped
+HARDCODED_PRODUCTS = [
+    {
+        "name": "Canon EOS 3000D DSLR Camera with 18-55mm Lens - AU Version",
+        "description": "✅ 4.6★ from 1,200+ Aussie reviews | Official AU warranty | Ships Sydney. Perfect for Australian photography enthusiasts. Capture crisp 18MP detail with beautiful background blur.",
+        "price": "$633.49",
+        "originalPrice": "$685.00",
+        "discount": "8% OFF",
+        "image": "https://m.media-amazon.com/images/I/81fsA6RI10L._AC_SX425_.jpg",
+        "link": "https://amzn.to/3WYqCEC",
+        "badge": "Editor's Pick",
+        "rating": "4.6",
+        "reviewCount": "1,200+"
+    },
+    {
+        "name": "TOCOL iPhone 16 Privacy Screen Protector [2 Pack]",
+        "description": "✅ 4.7★ from 2,800+ Aussie reviews | Local warranty | Ships AU. 9H+ hardness with 25° privacy. Blocks prying eyes on trains & in offices. Perfect for Aussie commuters.",
+        "price": "$19.99",
+        "originalPrice": "$19.99",
+        "discount": "Limited Time",
+        "image": "https://m.media-amazon.com/images/I/71SfEaQzdaL._AC_SX569_.jpg",
+        "link": "https://amzn.to/4i2gR1E",
+        "badge": "Value Pick",
+        "rating": "4.7",
+        "reviewCount": "2,800+"
+    },
+    {
+        "name": "SAMSUNG T7 1TB Portable External SSD - Grey",
+        "description": "✅ 4.8★ from 4,500+ Aussie reviews | 3-year AU warranty | Ships Melbourne. Lightning-fast storage (1,050MB/s). Perfect for gamers, students, pros.",
+        "price": "$147.95",
+        "originalPrice": "$177.54",
+        "discount": "20% OFF",
+        "image": "https://m.media-amazon.com/images/I/A1sHjPpz6fL._AC_SX522_.jpg",
+        "link": "https://amzn.to/3LJ6ZxY",
+        "badge": "Performance",
+        "rating": "4.8",
+        "reviewCount": "4,500+"
+    },
+    {
+        "name": "ZZU Bluetooth Earphones - 48 Hours Playtime",
+        "description": "✅ 4.5★ from 3,200+ Aussie reviews | IPX7 waterproof | Ships Brisbane. 48hr battery, deep bass, perfect for beach runs & bush walks.",
+        "price": "$26.99",
+        "originalPrice": "$39.99",
+        "discount": "33% OFF",
+        "image": "https://m.media-amazon.com/images/I/61hAJU-6B-L._AC_SY355_.jpg",
+        "link": "https://amzn.to/49q10I5",
+        "badge": "Value Pick",
+        "rating": "4.5",
+        "reviewCount": "3,200+"
+    },
+    {
+        "name": "Xiaomi Redmi Watch 5 Active Smartwatch - Black",
+        "description": "✅ 4.6★ from 1,800+ Aussie reviews | 5ATM waterproof | Ships AU. 18-day battery, 140+ sports modes. Built for Aussie fitness enthusiasts.",
+        "price": "$53.00",
+        "originalPrice": "$59.50",
+        "discount": "11% OFF",
+        "image": "https://m.media-amazon.com/images/I/61BG7aYMZEL._AC_SY450_.jpg",
+        "link": "https://amzn.to/4r6YgG0",
+        "badge": "Trending",
+        "rating": "4.6",
+        "reviewCount": "1,800+"
+    },
+    {
+        "name": "Soundcore by Anker Q20i Noise Cancelling Headphones",
+        "description": "✅ 4.8★ from 6,300+ Aussie reviews | 40-hour battery | Ships AU. Hybrid ANC, Hi-Res audio. Block out noise on Aussie commutes.",
+        "price": "$85.99",
+        "originalPrice": "$119.95",
+        "discount": "28% OFF",
+        "image": "https://m.media-amazon.com/images/I/61E3AcWQg1L._AC_SY355_.jpg",
+        "link": "https://amzn.to/3X34ZTx",
+        "badge": "Performance",
+        "rating": "4.8",
+        "reviewCount": "6,300+"
+    },
+    {
+        "name": "Mini Drone for Kids – HS190 Pocket Quadcopter",
+        "description": "✅ 4.5★ from 1,500+ Aussie reviews | AU safety compliant | Ships Perth. Altitude hold, 3D flips. Perfect for Aussie backyards & parks.",
+        "price": "$49.99",
+        "originalPrice": "$59.99",
+        "discount": "17% OFF",
+        "image": "https://m.media-amazon.com/images/I/614A0UN52RL._AC_SX522_.jpg",
+        "link": "https://amzn.to/4rgXLZY",
+        "badge": "Value Pick",
+        "rating": "4.5",
+        "reviewCount": "1,500+"
+    }
+]
+
+
+def price_key(product):
+    """Price history is kept per ASIN; short links without one are tracked by the link itself"""
+    if product['asin'] != UNKNOWN_ASIN:
+        return product['asin']
+    return product['affiliate_link'] or None
+
+
+# Clicks on affiliate links per price_key over the last 24 hours; /go/<id> records them
+CLICKS = ClickTracker()
+# Points a heavily clicked product gains on top of its rating and reviews' score (at most 100)
+CLICK_BOOST = 20
+
+
+def trending_score(rating, review_count, clicks=0):
+    """Popularity by rating and reviews, raised by up to CLICK_BOOST points by the clicks of the last 24 hours"""
+    return min(100, int(rating * 20 + review_count / 100 + click_score(clicks) * CLICK_BOOST / 100))
+
+
+def ahat_figures(product):
+    """The numbers the stats aggregator tracks for one formatted product"""
+    price = product['price']
+    return ProductFigures(
+        key=product['id'],
+        title=product['title'],
+        category=product['category'],
+        price=price['discounted'],
+        original_price=price['original'],
+        rating=product['rating'],
+        review_count=product['review_count'],
+        discount_percentage=price['discount_percentage'],
+    )
+
+
+# The orders /api/products/top ranks by, best first
+RANKINGS = {
+    'trending': lambda p: p['trending_score'],
+    'deal': lambda p: p['deal_score'],
+    'discount': lambda p: p['price']['discount_percentage'],
+    'rating': lambda p: p['rating'],
+}
+
 
-class AhatAPIHandler(http.server.BaseHTTPRequestHandler):
+def make_rankings():
+    return Rankings(key=lambda p: p['id'], category=lambda p: p['category'], scores=RANKINGS)
+
+
+def make_search_index():
+    return SearchIndex(
+        key=lambda p: p['id'],
+        fields={
+            'title': (lambda p: p['title'], 3),
+            'brand': (lambda p: p['brand'], 2),
+            'category': (lambda p: p['category'], 2),
+            'description': (lambda p: p['description'], 1),
+        },
+    )
+
+
+def build_catalog(products):
+    """Index formatted products (for filtering, top-K rankings and full-text search) and aggregate their stats"""
+    stats = StatsAggregator(ahat_figures)
+    store = ProductStore(
+        key=lambda p: p['id'],
+        hash_fields={
+            'asin': lambda p: p['asin'],
+            'category': lambda p: p['category'],
+            'brand': lambda p: p['brand'],
+            'price_key': price_key,
+        },
+        sort_fields={
+            'price': lambda p: p['price']['discounted'],
+            'rating': lambda p: p['rating'],
+            'discount': lambda p: p['price']['discount_percentage'],
+            'trending': lambda p: p['trending_score'],
+        },
+    )
+    search, rankings = make_search_index(), make_rankings()
+    store.subscribe(stats)
+    store.subscribe(search)
+    store.subscribe(rankings)
+    store.load(products)
+    return Catalog(next(_catalog_versions), store, stats, search, rankings)
+
+
+_live_catalog = None
+
+
+def refresh_live_catalog():
+    """Scrape every source and publish the merged products as the live catalog; returns the outcome
+
+    The products are normalized once, at ingest time, and the new catalog with
+    its indexes and stats is built off to the side, then published with a
+    single reference assignment: requests read the previous catalog until
+    then, without a lock, and never see a half-built one. When no source has
+    changed upstream (all 304s, same healthy sources) the previous catalog is
+    kept as is, with its version and so every cached response and ETag.
+    Raises ValueError when no source returned products. REFRESHER runs one
+    refresh at a time.
+    """
+    global _live_catalog
+    started = time.perf_counter()
+    result = AGGREGATOR.collect()
+    for report in result.reports:
+        SOURCE_SECONDS.labels(report.name, report.status).observe(report.seconds)
+        if report.status != 'ok':
+            print(f"⚠ Source {report.name} {report.status}: {report.error}")
+    if not result.products:
+        SCRAPE_SECONDS.labels('failed').observe(time.perf_counter() - started)
+        raise ValueError('no source returned products')
+    if result.changed or _live_catalog is None:
+        catalog = build_catalog(normalize_products(result.products))
+        with RESCORE_LOCK:
+            _live_catalog = catalog
+        outcome = 'changed'
+        write_snapshot('live', catalog)
+        record_prices(catalog)
+    else:
+        outcome = 'not_modified'
+    SCRAPE_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+    return outcome
+
+
+def fetch_live_catalog():
+    """FEED's fetch when scrapes are made on demand: refresh, then the live catalog"""
+    return _live_catalog if REFRESHER.run() else None
+
+
+def parse_live_catalog(page):
+    """Build a catalog from a single page"""
+    raw_products = extract_products(page)
+    if not raw_products:
+        return None
+    return build_catalog(normalize_products(raw_products))
+
+
+def stable_id(asin, link, name):
+    """The id of an imported product without one: from its ASIN, else a hash of its link (or its name)"""
+    if asin != UNKNOWN_ASIN:
+        return f'SIX7-{asin}'
+    key = link or name
+    if not key:
+        return None
+    return 'SIX7-' + hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def normalize_products(raw_products, start=0, stable_ids=False):
+    """Convert raw website (or feed) products into Ahat product records
+
+    Products without an id are numbered by position (SIX7-1, ...), ``start``
+    offsetting the numbers when products arrive in batches. ``stable_ids``
+    (for imported feeds) gives them stable_id() instead, so the same product
+    keeps its id from feed to feed and the products of two feeds don't
+    replace each other.
+    """
+    ahat_products = []
     
+    for i, product in enumerate(raw_products, start):
+        # Parse price values (feeds may carry plain numbers instead of "$1,234.00" strings)
+        price_str = str(product.get('price', '$0')).replace('$', '').replace(',', '')
+        original_price_str = str(product.get('originalPrice', '$0')).replace('$', '').replace(',', '')
+        
+        try:
+            price = float(price_str)
+            original_price = float(original_price_str)
+        except:
+            price = 0
+            original_price = 0
+        
+        # Calculate discount
+        discount_pct = 0
+        if original_price > 0 and price < original_price:
+            discount_pct = round(((original_price - price) / original_price) * 100, 0)
+        
+        # Parse rating
+        rating_str = product.get('rating', '0')
+        try:
+            rating = float(rating_str)
+        except:
+            rating = 4.5
+        
+        # Parse review count
+        review_str = str(product.get('reviewCount', '0')).replace('+', '').replace(',', '')
+        try:
+            review_count = int(review_str)
+        except:
+            review_count = 1000
+        
+        # Extract brand from name and category from badge
+        name = product.get('name', '')
+        brand = CLASSIFIER.brand(name)
+        category = CLASSIFIER.category(product.get('badge'))
+        link = product.get('link', '')
+        asin = extract_asin(link)
+        clicks = CLICKS.clicks(asin if asin != UNKNOWN_ASIN else link or None)
+        
+        ahat_products.append(Product.from_dict({
+            'id': str(product.get('id') or stable_ids and stable_id(asin, link, name) or f'SIX7-{i+1}'),
+            'asin': asin,
+            'title': name,
+            'description': product.get('description', ''),
+            'price': {
+                'original': original_price,
+                'discounted': price,
+                'currency': 'AUD',
+                'discount_percentage': discount_pct,
+                'savings': round(original_price - price, 2)
+            },
+            'category': category,
+            'brand': brand,
+            'rating': rating,
+            'review_count': review_count,
+            'image': product.get('image', ''),
+            'affiliate_link': link,
+            'trending_score': trending_score(rating, review_count, clicks),
+            'deal_score': min(100, int((discount_pct * 2) + (rating * 10))),
+            'status': 'active'
+        }))
+    
+    return ahat_products
+
+# Icons /api/products/categories shows next to the categories it knows
+CATEGORY_ICONS = {
+    'Value': '💰',
+    'Performance': '⚡',
+    "Editor's": '⭐',
+    'Trend': '📈',
+    'Hot Deal': '🔥',
+    'Best Seller': '🏆',
+}
+DEFAULT_CATEGORY_ICON = '🏷️'
+
+# Built once: only the fallback's trending scores change while the process runs
+HARDCODED_CATALOG = build_catalog(normalize_products(HARDCODED_PRODUCTS))
+
+# Runs every scrape, in the background every REFRESH_INTERVAL seconds once
+# started by main(), and remembers how the last one went
+REFRESHER = RefreshScheduler(
+    refresh_live_catalog,
+    interval=REFRESH_INTERVAL or FEED_TTL,
+    jitter=REFRESH_JITTER,
+    failure_backoff=FEED_FAILURE_BACKOFF,
+    max_backoff=FEED_MAX_BACKOFF,
+)
+
+# On-demand scrapes (REFRESH_INTERVAL 0): every request reads the last good scrape
+# (already normalized and indexed) and at most one scrape runs at a time, no
+# matter how many requests arrive together.
+FEED = FeedCache(
+    fetch_live_catalog,
+    ttl=FEED_TTL,
+    stale_ttl=FEED_STALE_TTL,
+    failure_backoff=FEED_FAILURE_BACKOFF,
+    max_backoff=FEED_MAX_BACKOFF,
+)
+
+# Price changes of every catalog scraped or imported, for price-history and price-drops
+PRICE_HISTORY = PriceHistory()
+
+# Product image thumbnails, fetched through the shared upstream pool; main() gives
+# the cache its directory
+IMAGES = ImageProxy(UPSTREAM, ImageCache(memory_bytes=int(IMAGE_MEMORY_MB * 2**20)), workers=IMAGE_WORKERS)
+
+# With --processes N: the catalog the refresher process publishes for the workers,
+# and in a worker, the scheduler that picks up every new generation of it
+SHARED = None
+FOLLOWER = None
+_shared_generation = 0
+
+RefreshStatus = namedtuple('RefreshStatus', ['runs', 'last', 'last_success', 'next_at'])
+
+
+def open_catalog(image):
+    """The catalog a CatalogImage holds, served from it in place: ready at once, read-only"""
+    store, stats, search, rankings = image.open(key=lambda p: p['id'], convert=Product.from_dict)
+    return Catalog(next(_catalog_versions), store, stats, search, rankings)
+
+
+# Held by whoever publishes the live catalog: scrapes and click rescores both do
+PUBLISH_LOCK = threading.Lock()
+# (catalog.version, catalog.store.version) of the live catalog last published
+_published = None
+
+
+def publish_catalog():
+    """Publish the live catalog to the workers as a catalog image, unless it is unchanged since last time"""
+    global _published
+    with PUBLISH_LOCK:
+        catalog = _live_catalog
+        # Read before the image is written: a rescore meanwhile is published again next time, not lost
+        version = None if catalog is None else (catalog.version, catalog.store.version)
+        # One restored from a snapshot is the workers' own until it is materialized
+        if version is None or version == _published or not catalog.store.writable:
+            return False
+        # The search index and rankings are rebuilt from the products; fresh ones carry the settings
+        SHARED.publish_image(lambda path: write_image(path, catalog.store, catalog.stats, make_search_index(),
+                                                      make_rankings()),
+                             **SHARED.read()[1])
+        _published = version
+        return True
+
+
+def publish_live_catalog():
+    """The refresher process's job: scrape, then hand a changed catalog to the workers"""
+    outcome = refresh_live_catalog()
+    publish_catalog()
+    return outcome
+
+
+def rescore_and_publish():
+    """The refresher process's CLICK_SCORER job: rescore by everyone's clicks and publish what changed"""
+    outcome = rescore_clicks()
+    publish_catalog()
+    return outcome
+
+
+def publish_refresh_status(scheduler):
+    """The refresher process's on_schedule: tell the workers how the last scrape went"""
+    SHARED.update(runs=scheduler.runs, last=scheduler.last, last_success=scheduler.last_success,
+                  next_at=scheduler.next_run_at)
+
+
+def follow_shared_catalog():
+    """A worker's job: pick up the catalog and price changes the refresher process published"""
+    global _live_catalog, _shared_generation
+    PRICE_HISTORY.catch_up()
+    if SHARED.generation == _shared_generation:
+        return 'not_modified'
+    generation, image = SHARED.open_image(CatalogImage)
+    # Served from the image the refresher wrote, and swapped in like a scrape in a single process
+    _live_catalog = open_catalog(image)
+    _shared_generation = generation
+    return 'changed'
+
+
+def refresh_status():
+    """Runs, last run, last successful run and next run time of the scrapes, wherever they run"""
+    if FOLLOWER is None:
+        return RefreshStatus(REFRESHER.runs, REFRESHER.last, REFRESHER.last_success,
+                             REFRESHER.next_run_at if REFRESHER.running else None)
+    _, meta = SHARED.read()
+    last, last_success = (None if run is None else RefreshRun(*run)
+                          for run in (meta.get('last'), meta.get('last_success')))
+    return RefreshStatus(meta.get('runs', 0), last, last_success, meta.get('next_at'))
+
+# Encoded responses per endpoint and query, rebuilt only when the catalog changes
+RESPONSES = ResponseCache(gzip_min_bytes=RESPONSE_GZIP_MIN_BYTES)
+
+# Fields /api/products?fields= can select, in response order, and the named presets
+PRODUCT_FIELDS = ('id', 'asin', 'title', 'description', 'price', 'price.original', 'price.discounted',
+                  'price.currency', 'price.discount_percentage', 'price.savings', 'category', 'brand',
+                  'rating', 'review_count', 'image', 'affiliate_link', 'trending_score', 'deal_score', 'status')
+FIELD_PRESETS = {
+    # What a product card shows: no description text
+    'card': ('id', 'asin', 'title', 'price', 'category', 'brand', 'rating', 'review_count', 'image',
+             'affiliate_link', 'trending_score', 'deal_score'),
+    'full': None,
+}
+
+# Merchant feeds loaded with --import or POST /api/admin/import; products are
+# upserted by id, and once there are any they are served instead of the scrape.
+# Each import replaces it with a new catalog (see import_products)
+IMPORTED_CATALOG = build_catalog([])
+IMPORT_LOCK = threading.Lock()
+
+# Figures kept elsewhere anyway, read only when /metrics is scraped
+register_cache(METRICS, RESPONSES, 'response_cache', 'Encoded response cache')
+register_cache(METRICS, IMAGES, 'image_cache', 'Thumbnail cache (memory or disk)')
+METRICS.callback('ahat_upstream_requests_total', 'HTTP requests made to product sources',
+                 lambda: UPSTREAM.requests, kind='counter')
+METRICS.callback('ahat_upstream_not_modified_total', 'Source requests answered with 304 Not Modified',
+                 lambda: UPSTREAM.not_modified, kind='counter')
+METRICS.callback('ahat_source_circuit_open', '1 while a source is skipped by its circuit breaker',
+                 lambda: {(name,): int(breaker.state != 'closed') for name, breaker in AGGREGATOR.breakers.items()},
+                 labelnames=('source',))
+METRICS.callback('ahat_catalog_products', 'Products in each catalog',
+                 lambda: {('imported',): len(IMPORTED_CATALOG.store),
+                          ('live',): len(_live_catalog.store) if _live_catalog is not None else 0,
+                          ('hardcoded',): len(HARDCODED_CATALOG.store)},
+                 labelnames=('catalog',))
+METRICS.callback('ahat_profile_sample_every', 'Requests per cProfile sample (0 = profiling off)',
+                 lambda: PROFILER.every)
+METRICS.callback('ahat_price_history_points', 'Price changes held in the price history',
+                 lambda: PRICE_HISTORY.points)
+METRICS.callback('ahat_price_history_products', 'Products with a price history', lambda: len(PRICE_HISTORY))
+METRICS.callback('ahat_clicks_total', 'Affiliate clicks redirected by /go/', lambda: CLICKS.recorded, kind='counter')
+METRICS.callback('ahat_clicks_dropped_total', 'Clicks lost because the click buffer was full',
+                 lambda: CLICKS.dropped, kind='counter')
+METRICS.callback('ahat_click_buffer', 'Clicks waiting to be logged and counted', lambda: CLICKS.buffered)
+METRICS.callback('ahat_clicked_products', 'Products clicked in the last 24 hours', lambda: len(CLICKS))
+METRICS.callback('ahat_image_cache_bytes', 'Bytes of thumbnails cached',
+                 lambda: {('memory',): IMAGES.cache.memory_size, ('disk',): IMAGES.cache.disk_size},
+                 labelnames=('tier',))
+METRICS.callback('ahat_image_fetches_total', 'Images downloaded from upstream', lambda: IMAGES.fetches, kind='counter')
+SNAPSHOTS = METRICS.counter('ahat_catalog_snapshots_total', 'Catalog snapshots saved, failed to save or restored',
+                            ('catalog', 'outcome'))
+
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, f'{name}.catalog')
+
+
+def legacy_snapshot_path(name):
+    # Products only (see ahat.snapshot), as earlier versions saved them; read when there is no image
+    return os.path.join(SNAPSHOT_DIR, f'{name}.sqlite3')
+
+
+def write_snapshot(name, catalog):
+    """Save a catalog as an image for the next start; a failed save is reported, not raised"""
+    if not SNAPSHOT_DIR:
+        return
+    started = time.perf_counter()
+    try:
+        count = write_image(snapshot_path(name), catalog.store, catalog.stats, make_search_index(), make_rankings(),
+                            meta={'catalog': name}, sync=True)
+    except OSError as e:
+        SNAPSHOTS.labels(name, 'failed').inc()
+        print(f"⚠ Could not save the {name} catalog snapshot: {e}")
+        return
+    try:
+        os.unlink(legacy_snapshot_path(name))
+    except OSError:
+        pass
+    SNAPSHOTS.labels(name, 'saved').inc()
+    print(f"💾 Saved {count:,} {name} products to {snapshot_path(name)} in {time.perf_counter() - started:.2f}s")
+
+
+def open_snapshot(name):
+    """``(catalog, saved_at)`` as the previous run saved it, or ``(None, None)``; raises OSError or ValueError
+
+    An image is served in place, ready at once; a snapshot of an earlier
+    version is decoded and indexed first.
+    """
+    try:
+        image = CatalogImage(snapshot_path(name))
+    except FileNotFoundError:
+        snapshot = load_snapshot(legacy_snapshot_path(name), convert=Product.from_dict)
+        if snapshot is None:
+            return None, None
+        return build_catalog(snapshot.products), snapshot.saved_at
+    return open_catalog(image), image.saved_at
+
+
+def restore_snapshots():
+    """Serve the catalogs saved by the previous run until the next scrape or import
+
+    They are served from their images, which takes milliseconds at any size,
+    and are read-only until materialize_catalogs() replaces them.
+    """
+    global _live_catalog, IMPORTED_CATALOG
+    if not SNAPSHOT_DIR:
+        return
+    for name in ('live', 'imported'):
+        started = time.perf_counter()
+        try:
+            catalog, saved_at = open_snapshot(name)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Ignoring the {name} catalog snapshot: {e}")
+            continue
+        if catalog is None or not len(catalog.store):
+            continue
+        if name == 'live':
+            _live_catalog = catalog
+            # Served as stale at worst: the first request triggers a background scrape
+            FEED.prime(_live_catalog, age=time.time() - saved_at)
+        else:
+            IMPORTED_CATALOG = catalog
+        SNAPSHOTS.labels(name, 'restored').inc()
+        saved = datetime.fromtimestamp(saved_at).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"💾 Restored {len(catalog.store):,} {name} products saved {saved} "
+              f"in {time.perf_counter() - started:.2f}s")
+
+
+def materialize_catalogs(names=('live', 'imported')):
+    """Replace the catalogs still served from a snapshot image by writable copies
+
+    Imports copy the imported catalog and clicks rescore both, neither of
+    which an image allows. Each copy is built off to the side while the image
+    keeps serving and swapped in like a scrape; one replaced meanwhile (by a
+    scrape or an import) is left alone.
+    """
+    global _live_catalog, IMPORTED_CATALOG
+    for name in names:
+        restored = _live_catalog if name == 'live' else IMPORTED_CATALOG
+        if restored is None or restored.store.writable:
+            continue
+        started = time.perf_counter()
+        catalog = build_catalog(restored.store.all())
+        with RESCORE_LOCK:
+            # Saved with the scores of the clicks of its day
+            rescore_catalog(catalog, CLICKS.counts(), {price_key(product) for product in catalog.store.all()})
+            if name == 'live' and _live_catalog is restored:
+                _live_catalog = catalog
+                FEED.replace(restored, catalog)
+            elif name == 'imported' and IMPORTED_CATALOG is restored:
+                IMPORTED_CATALOG = catalog
+            else:
+                continue
+        print(f"🔎 Indexed the {len(catalog.store):,} restored {name} products in {time.perf_counter() - started:.2f}s")
+
+
+def record_prices(catalog):
+    """Add the catalog's current prices to the price history (only changes are stored)"""
+    try:
+        changed = PRICE_HISTORY.record((price_key(p), p['price']['discounted']) for p in catalog.store.all())
+    except OSError as e:
+        print(f"⚠ Could not record prices: {e}")
+        return
+    if changed:
+        print(f"📈 Recorded {changed:,} price changes")
+
+
+def flush_clicks():
+    """CLICK_WRITER's job: log and count the clicks buffered since the last flush"""
+    CLICKS.flush()
+    return 'flushed'
+
+
+# Held by rescore_clicks, and by scrapes, imports and materialize_catalogs() while they
+# swap in their catalog, so that no rescore is lost on a catalog being replaced
+RESCORE_LOCK = threading.Lock()
+
+
+def rescore_clicks():
+    """CLICK_SCORER's job: update the trending scores the clicks have changed, in every catalog
+
+    Only products clicked recently are looked at. Those whose score changed
+    are upserted in place, so the store's indexes, stats, rankings and search
+    index follow through their listeners at the cost of the changed products
+    only, and the store's new version keeps earlier cached responses from
+    being served again.
+    """
+    with RESCORE_LOCK:
+        counts = CLICKS.counts()
+        # Products no longer clicked have to lose their click boost too; catalogs
+        # restored from a snapshot or imported before the clicks were read are brought up to date
+        keys = CLICKS.take_changed() | counts.keys()
+        outcome = 'not_modified'
+        for catalog in (IMPORTED_CATALOG, _live_catalog, HARDCODED_CATALOG):
+            if catalog is not None and rescore_catalog(catalog, counts, keys):
+                outcome = 'changed'
+    return outcome
+
+
+def rescore_catalog(catalog, counts, keys):
+    """Upsert the products with a price_key in ``keys`` whose trending score ``counts`` changes; returns how many
+
+    Catalogs served from an image are left as they are: the process that
+    wrote the image rescores its own catalog and publishes it again.
+    """
+    store = catalog.store
+    if not store.writable:
+        return 0
+    with store.hold():
+        changed = []
+        for key in keys:
+            for product in store.lookup('price_key', key):
+                score = trending_score(product['rating'], product['review_count'], counts.get(key, 0))
+                if score != product['trending_score']:
+                    changed.append(Product.from_dict(dict(product, trending_score=score)))
+        if changed:
+            store.load(changed)
+    return len(changed)
+
+
+# Started by main(): clicks are written in batches off the request path, and
+# trending scores follow them at a slower pace
+CLICK_WRITER = RefreshScheduler(flush_clicks, interval=CLICK_FLUSH_INTERVAL, jitter=0)
+CLICK_SCORER = RefreshScheduler(rescore_clicks, interval=CLICK_SCORE_INTERVAL, jitter=0)
+
+
+def normalize_feed(raw_products, start):
+    return normalize_products(raw_products, start, stable_ids=True)
+
+
+def import_products(stream, fmt, batch_size=IMPORT_BATCH_SIZE, pause_gc=False):
+    """Stream a feed into the imported catalog, normalizing and upserting in batches; callers hold IMPORT_LOCK
+
+    The batches go into a copy of the imported catalog built off to the side,
+    which is swapped in once the whole feed has loaded, like a scrape:
+    requests read the previous imported catalog until then, and a feed that
+    fails halfway imports nothing. ``pause_gc`` for imports at startup only:
+    the collector is off for every thread meanwhile.
+    """
+    global IMPORTED_CATALOG
+    catalog = build_catalog(IMPORTED_CATALOG.store.all())
+    report = import_feed(stream, fmt, normalize_feed, catalog.store.load, batch_size, pause_gc=pause_gc)
+    with RESCORE_LOCK:
+        # Copied products carry the scores they had when copied; clicks may have changed them since
+        rescore_catalog(catalog, CLICKS.counts(), {price_key(product) for product in catalog.store.all()})
+        IMPORTED_CATALOG = catalog
+    return report
+
+
+def describe_import(report, name):
+    peak = f", peak RSS {report.peak_rss_bytes / 2**20:.0f} MB" if report.peak_rss_bytes else ''
+    return (f"📥 Imported {report.rows:,} {report.format} rows from {name} in {report.seconds}s "
+            f"({report.rows_per_second or 0:,} rows/s{peak})")
+
+
+class NotFound(Exception):
+    """Raised by a response builder for a 404"""
+
+
+def iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def last_sync(status):
+    """When the last successful scrape finished, in local time; None before the first"""
+    run = status.last_success
+    if run is None:
+        return None
+    return datetime.fromtimestamp(run.started_at + run.seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def last_refresh(status):
+    """Time, duration and outcome of the last scrape, and when the next is due"""
+    run, next_at = status.last, status.next_at
+    return {
+        'started_at': None if run is None else iso_time(run.started_at),
+        'duration_seconds': None if run is None else round(run.seconds, 3),
+        'outcome': None if run is None else run.outcome,
+        'error': None if run is None or run.error is None else str(run.error),
+        'next_at': None if next_at is None else iso_time(next_at),
+    }
+
+
+class AhatAPIHandler(KeepAliveHandlerMixin, http.server.BaseHTTPRequestHandler):
+
+    # Latency / size record of the request being handled (None outside do_*)
+    tracked = None
+
+    def track(self, path):
+        if path.startswith('/go/'):
+            path = '/go/{id}'
+        elif path.startswith('/img/'):
+            path = '/img/{id}'
+        self.tracked = HTTP_METRICS.track(self.command, path if path in ROUTES else 'other')
+        return self.tracked
+
+    def send_response(self, code, message=None):
+        if self.tracked is not None:
+            self.tracked.status = code
+        super().send_response(code, message)
+
     def do_GET(self):
         parsed = urlparse(self.path)
+        try:
+            with self.track(parsed.path):
+                self.route_get(parsed)
+        finally:
+            self.tracked = None
+
+    def route_get(self, parsed):
         path = parsed.path
         query = parse_qs(parsed.query)
         
-        # Set CORS headers
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
-        
         # Route the request
+        if path.startswith('/go/'):
+            self.redirect_click(unquote(path[len('/go/'):]))
+            return
+        if path.startswith('/img/'):
+            self.send_image(unquote(path[len('/img/'):]), query)
+            return
         if path == '/api/products':
-            response = self.get_your_real_products()
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version)
+            build = lambda: self.get_your_real_products(catalog, source)
+        elif path == '/api/dashboard':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version, refresh_status().runs)
+            build = lambda: self.get_dashboard(catalog, source)
+        elif path == '/api/products/batch':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version)
+            build = lambda: self.batch_products(catalog, source, query)
         elif path == '/api/products/categories':
-            response = self.get_categories()
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version)
+            build = lambda: self.get_categories(catalog)
         elif path == '/api/products/stats':
-            response = self.get_stats()
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version, refresh_status().runs)
+            build = lambda: self.get_stats(catalog)
+        elif path == '/api/products/search':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version)
+            build = lambda: self.search_products(catalog, source, query)
+        elif path == '/api/products/suggest':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version)
+            build = lambda: self.suggest(catalog, query)
+        elif path == '/api/products/top':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version)
+            build = lambda: self.top_products(catalog, source, query)
+        elif path == '/api/products/price-history':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version, PRICE_HISTORY.version, int(time.time() // 60))
+            build = lambda: self.price_history(catalog, query)
+        elif path == '/api/products/price-drops':
+            catalog, source = self.current_catalog()
+            version = (catalog.version, catalog.store.version, PRICE_HISTORY.version, int(time.time() // 60))
+            build = lambda: self.price_drops(catalog, source, query)
         elif path == '/api':
-            response = {"message": "Ahat API Server", "version": "1.0", "status": "running"}
+            version, build = 0, lambda: {"message": "Ahat API Server", "version": "1.0", "status": "running"}
+        elif path == '/metrics':
+            self.send_body(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
+            return
+        elif path == '/api/admin/profile':
+            self.profile_report(query)
+            return
         else:
-            response = {"error": "Not found", "path": path}
-        
-        self.wfile.write(json.dumps(response).encode())
+            self.send_body(json.dumps({"error": "Not found", "path": path}).encode())
+            return
+
+        try:
+            representation = RESPONSES.get(path, query, version, lambda: json.dumps(build(), default=to_json).encode())
+        except ValueError as e:
+            self.send_body(json.dumps({"error": str(e)}).encode(), status=400)
+            return
+        except NotFound as e:
+            self.send_body(json.dumps({"error": str(e)}).encode(), status=404)
+            return
+        self.send_representation(representation)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        try:
+            with self.track(path):
+                if path == '/api/admin/import':
+                    self.import_feed()
+                elif path == '/api/admin/profile':
+                    self.configure_profiler()
+                else:
+                    self.send_error_body(404, "Not found")
+        finally:
+            self.tracked = None
     
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_cors_headers()
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_cors_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+
+    def send_representation(self, representation):
+        """Send a cached representation, or 304 when the client already has it"""
+        body, etag, encoding = representation.select(self.headers.get('Accept-Encoding'))
+        if representation.not_modified(self.headers.get('If-None-Match')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_cors_headers()
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', representation.content_type)
+        self.send_cors_headers()
+        self.send_header('ETag', etag)
+        # Clients may keep the body but must revalidate it; unchanged data costs a 304
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        if self.tracked is not None:
+            self.tracked.size = len(body)
+
+    def send_body(self, body, status=200, content_type='application/json', close=False):
+        """Send a complete response with CORS headers and an exact Content-Length"""
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_cors_headers()
+        if close:
+            self.send_header('Connection', 'close')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        if self.tracked is not None:
+            self.tracked.size = len(body)
     
-    def get_your_real_products(self):
-        """Get your 7 real SixSevenDeals products"""
+    def send_error_body(self, status, message):
+        """Reject a request whose body we may not have read, then drop the connection"""
+        self.send_body(json.dumps({"error": message}).encode(), status=status, close=True)
+
+    def redirect_click(self, product_id):
+        """Count a click on a product's affiliate link and send the browser on to it"""
+        catalog, _ = self.current_catalog()
+        product = catalog.store.get(product_id)
+        if product is None or not product['affiliate_link']:
+            self.send_body(json.dumps({"error": "Product not found", "id": product_id}).encode(), status=404)
+            return
+        # Just a buffer append: CLICK_WRITER logs and counts it
+        CLICKS.record(price_key(product))
+        self.send_response(302)
+        self.send_header('Location', product['affiliate_link'])
+        # Every click has to come back here to be counted
+        self.send_header('Cache-Control', 'no-store')
+        self.send_cors_headers()
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_image(self, product_id, query):
+        """A product's image scaled down for a card ``w`` pixels wide, with an ETag and a long max-age"""
         try:
-            # Option 1: Try to scrape from your website
-            print("🔍 Attempting to fetch products from SixSevenDeals.com...")
-            html_products = self.scrape_your_website()
-            if html_products:
-                print("✅ Successfully scraped products from website")
-                return self.format_products(html_products, "SixSevenDeals.com Live")
-        except Exception as e:
-            print(f"⚠ Could not scrape website: {e}")
-        
-        # Option 2: Fallback to hardcoded products
-        print("📦 Using hardcoded SixSevenDeals products")
-        return self.get_hardcoded_products()
-    
+            width = int(query.get('w', [IMAGE_DEFAULT_WIDTH])[0])
+        except ValueError:
+            return self.send_error_body(400, "w must be an integer")
+        catalog, _ = self.current_catalog()
+        product = catalog.store.get(product_id)
+        if product is None or not product['image']:
+            self.send_body(json.dumps({"error": "Product not found", "id": product_id}).encode(), status=404)
+            return
+        try:
+            thumbnail = IMAGES.get(product['image'], width)
+        except ValueError as e:
+            return self.send_error_body(400, str(e))
+        except ImageError as e:
+            self.send_body(json.dumps({"error": str(e)}).encode(), status=502)
+            return
+        not_modified = thumbnail.etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', thumbnail.etag)
+        self.send_header('Cache-Control', f'public, max-age={IMAGE_MAX_AGE}')
+        self.send_cors_headers()
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', thumbnail.content_type)
+        self.send_header('Content-Length', str(len(thumbnail.body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(thumbnail.body)
+        if self.tracked is not None:
+            self.tracked.size = len(thumbnail.body)
+
+    def check_admin(self):
+        """True for requests carrying the admin token; otherwise sends the 403 and returns False"""
+        if not ADMIN_TOKEN:
+            self.send_error_body(403, "Admin endpoints are disabled (set AHAT_ADMIN_TOKEN)")
+            return False
+        if not hmac.compare_digest(self.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            self.send_error_body(403, "Invalid admin token")
+            return False
+        return True
+
+    def profile_report(self, query):
+        """Accumulated cProfile statistics of the sampled requests, as text"""
+        if not self.check_admin():
+            return
+        try:
+            limit = int(query.get('limit', [30])[0])
+        except ValueError:
+            return self.send_error_body(400, "limit must be an integer")
+        route = query.get('route', [None])[0]
+        sort = query.get('sort', ['cumulative'])[0]
+        try:
+            report = PROFILER.report(route, limit, sort)
+        except KeyError:
+            return self.send_error_body(400, f"Unknown sort key {sort!r}")
+        self.send_body(report.encode(), content_type='text/plain; charset=utf-8')
+
+    def configure_profiler(self):
+        """Profile 1 in ``every`` requests from now on (0 turns it off); ``reset=1`` drops what was collected"""
+        if not self.check_admin():
+            return
+        # Parameters come in the query string; any body is ignored
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            PROFILER.configure(int(query.get('every', [PROFILER.every])[0]),
+                               reset=query.get('reset', ['0'])[0] in ('1', 'true'))
+        except ValueError as e:
+            return self.send_error_body(400, str(e))
+        print(f"🔬 Profiling {f'1 in {PROFILER.every} requests' if PROFILER.every else 'off'}")
+        self.send_body(json.dumps({'success': True, 'data': {'every': PROFILER.every,
+                                                             'samples': PROFILER.samples}}).encode(), close=True)
+
+    def import_feed(self):
+        """Stream the request body (JSON array, NDJSON or CSV) into the imported catalog"""
+        if not self.check_admin():
+            return
+        if FOLLOWER is not None:
+            # Each worker has its own copy of the imported catalog
+            return self.send_error_body(409, "Imports at run time need a single process; use --import at startup")
+        query = parse_qs(urlparse(self.path).query)
+        fmt = query.get('format', [None])[0] or detect_format(content_type=self.headers.get('Content-Type'))
+        if fmt not in IMPORT_FORMATS:
+            return self.send_error_body(400, f"format must be one of {', '.join(IMPORT_FORMATS)}")
+        # The server has refused bodies without a valid Content-Length within AHAT_MAX_BODY_MB
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return self.send_error_body(411, "Content-Length required")
+        try:
+            batch_size = int(query.get('batch_size', [IMPORT_BATCH_SIZE])[0])
+        except ValueError:
+            return self.send_error_body(400, "batch_size must be an integer")
+        if not IMPORT_LOCK.acquire(blocking=False):
+            return self.send_error_body(409, "Another import is running")
+
+        try:
+            report = import_products(text_stream(LimitedReader(self.rfile, int(length))), fmt, batch_size)
+        except ValueError as e:
+            # Nothing was imported: the catalog loaded so far is dropped
+            return self.send_error_body(400, f"Import failed: {e}")
+        finally:
+            IMPORT_LOCK.release()
+        print(describe_import(report, 'admin upload'))
+        write_snapshot('imported', IMPORTED_CATALOG)
+        record_prices(IMPORTED_CATALOG)
+        self.send_body(json.dumps({
+            'success': True,
+            'data': dict(report._asdict(), total_products=len(IMPORTED_CATALOG.store)),
+        }).encode())
+
+    def current_catalog(self):
+        """The catalog to serve: an imported feed, the cached scrape of your website, or the hardcoded fallback"""
+        # Option 1: A merchant feed loaded with --import or POST /api/admin/import
+        if len(IMPORTED_CATALOG.store):
+            CATALOG_REQUESTS.labels('imported', 'unused').inc()
+            return IMPORTED_CATALOG, "Imported Feed"
+        # Option 2: Use the last scrape of your website, published by REFRESHER (or
+        # cached by FEED and refreshed when a request finds it stale)
+        if REFRESHER.running or FOLLOWER is not None:
+            catalog, state = _live_catalog, 'scheduled'
+        else:
+            catalog, state = FEED.get()
+        if catalog is not None:
+            CATALOG_REQUESTS.labels('live', state).inc()
+            return catalog, "SixSevenDeals.com Live"
+        # Option 3: Fallback to hardcoded products
+        CATALOG_REQUESTS.labels('hardcoded', state).inc()
+        return HARDCODED_CATALOG, "Hardcoded SixSevenDeals Products"
+
+    def get_your_real_products(self, catalog=None, source=None):
+        """Get your 7 real SixSevenDeals products"""
+        if catalog is None:
+            catalog, source = self.current_catalog()
+        if catalog is HARDCODED_CATALOG:
+            last = refresh_status().last
+            if last is not None and last.error is not None:
+                print(f"⚠ Could not scrape website: {last.error}")
+            print("📦 Using hardcoded SixSevenDeals products")
+        return self.format_products(catalog, source)
+
     def scrape_your_website(self):
         """Scrape your actual SixSevenDeals.com website"""
         try:
-            # Your actual website URL
-            url = "https://sixsevendeals.com/"
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Parse the JavaScript products array from your HTML
-            products_js = None
-            for script in soup.find_all('script'):
-                if script.string and 'const products = [' in script.string:
-                    products_js = script.string
-                    break
-            
-            if products_js:
-                # Extract JSON from JavaScript (simplified)
-                import re
-                import json as json_lib
-                
-                # Find the products array
-                match = re.search(r'const products\s*=\s*(\[.*?\]);', products_js, re.DOTALL)
-                if match:
-                    products_json = match.group(1)
-                    # Clean up the JSON
-                    products_json = products_json.replace("'", '"')
-                    products = json_lib.loads(products_json)
-                    return products
-            
-            return None
-            
+            return scrape_your_website()
         except Exception as e:
             print(f"Scraping error: {e}")
             return None
-    
+
     def get_hardcoded_products(self):
         """Your 7 real products as fallback"""
-        products = [
-            {
-                "name": "Canon EOS 3000D DSLR Camera with 18-55mm Lens - AU Version",
-                "description": "✅ 4.6★ from 1,200+ Aussie reviews | Official AU warranty | Ships Sydney. Perfect for Australian photography enthusiasts. Capture crisp 18MP detail with beautiful background blur.",
-                "price": "$633.49",
-                "originalPrice": "$685.00",
-                "discount": "8% OFF",
-                "image": "https://m.media-amazon.com/images/I/81fsA6RI10L._AC_SX425_.jpg",
-                "link": "https://amzn.to/3WYqCEC",
-                "badge": "Editor's Pick",
-                "rating": "4.6",
-                "reviewCount": "1,200+"
-            },
-            {
-                "name": "TOCOL iPhone 16 Privacy Screen Protector [2 Pack]",
-                "description": "✅ 4.7★ from 2,800+ Aussie reviews | Local warranty | Ships AU. 9H+ hardness with 25° privacy. Blocks prying eyes on trains & in offices. Perfect for Aussie commuters.",
-                "price": "$19.99",
-                "originalPrice": "$19.99",
-                "discount": "Limited Time",
-                "image": "https://m.media-amazon.com/images/I/71SfEaQzdaL._AC_SX569_.jpg",
-                "link": "https://amzn.to/4i2gR1E",
-                "badge": "Value Pick",
-                "rating": "4.7",
-                "reviewCount": "2,800+"
-            },
-            {
-                "name": "SAMSUNG T7 1TB Portable External SSD - Grey",
-                "description": "✅ 4.8★ from 4,500+ Aussie reviews | 3-year AU warranty | Ships Melbourne. Lightning-fast storage (1,050MB/s). Perfect for gamers, students, pros.",
-                "price": "$147.95",
-                "originalPrice": "$177.54",
-                "discount": "20% OFF",
-                "image": "https://m.media-amazon.com/images/I/A1sHjPpz6fL._AC_SX522_.jpg",
-                "link": "https://amzn.to/3LJ6ZxY",
-                "badge": "Performance",
-                "rating": "4.8",
-                "reviewCount": "4,500+"
-            },
-            {
-                "name": "ZZU Bluetooth Earphones - 48 Hours Playtime",
-                "description": "✅ 4.5★ from 3,200+ Aussie reviews | IPX7 waterproof | Ships Brisbane. 48hr battery, deep bass, perfect for beach runs & bush walks.",
-                "price": "$26.99",
-                "originalPrice": "$39.99",
-                "discount": "33% OFF",
-                "image": "https://m.media-amazon.com/images/I/61hAJU-6B-L._AC_SY355_.jpg",
-                "link": "https://amzn.to/49q10I5",
-                "badge": "Value Pick",
-                "rating": "4.5",
-                "reviewCount": "3,200+"
-            },
-            {
-                "name": "Xiaomi Redmi Watch 5 Active Smartwatch - Black",
-                "description": "✅ 4.6★ from 1,800+ Aussie reviews | 5ATM waterproof | Ships AU. 18-day battery, 140+ sports modes. Built for Aussie fitness enthusiasts.",
-                "price": "$53.00",
-                "originalPrice": "$59.50",
-                "discount": "11% OFF",
-                "image": "https://m.media-amazon.com/images/I/61BG7aYMZEL._AC_SY450_.jpg",
-                "link": "https://amzn.to/4r6YgG0",
-                "badge": "Trending",
-                "rating": "4.6",
-                "reviewCount": "1,800+"
-            },
-            {
-                "name": "Soundcore by Anker Q20i Noise Cancelling Headphones",
-                "description": "✅ 4.8★ from 6,300+ Aussie reviews | 40-hour battery | Ships AU. Hybrid ANC, Hi-Res audio. Block out noise on Aussie commutes.",
-                "price": "$85.99",
-                "originalPrice": "$119.95",
-                "discount": "28% OFF",
-                "image": "https://m.media-amazon.com/images/I/61E3AcWQg1L._AC_SY355_.jpg",
-                "link": "https://amzn.to/3X34ZTx",
-                "badge": "Performance",
-                "rating": "4.8",
-                "reviewCount": "6,300+"
-            },
-            {
-                "name": "Mini Drone for Kids – HS190 Pocket Quadcopter",
-                "description": "✅ 4.5★ from 1,500+ Aussie reviews | AU safety compliant | Ships Perth. Altitude hold, 3D flips. Perfect for Aussie backyards & parks.",
-                "price": "$49.99",
-                "originalPrice": "$59.99",
-                "discount": "17% OFF",
-                "image": "https://m.media-amazon.com/images/I/614A0UN52RL._AC_SX522_.jpg",
-                "link": "https://amzn.to/4rgXLZY",
-                "badge": "Value Pick",
-                "rating": "4.5",
-                "reviewCount": "1,500+"
-            }
-        ]
-        
-        return self.format_products(products, "Hardcoded SixSevenDeals Products")
+        return self.format_products(HARDCODED_CATALOG, "Hardcoded SixSevenDeals Products")
     
-    def format_products(self, raw_products, source):
-        """Format products into Ahat API response"""
-        ahat_products = []
-        
-        for i, product in enumerate(raw_products):
-            # Parse price values
-            price_str = product.get('price', '$0').replace('$', '').replace(',', '')
-            original_price_str = product.get('originalPrice', '$0').replace('$', '').replace(',', '')
-            
-            try:
-                price = float(price_str)
-                original_price = float(original_price_str)
-            except:
-                price = 0
-                original_price = 0
-            
-            # Calculate discount
-            discount_pct = 0
-            if original_price > 0 and price < original_price:
-                discount_pct = round(((original_price - price) / original_price) * 100, 0)
-            
-            # Parse rating
-            rating_str = product.get('rating', '0')
-            try:
-                rating = float(rating_str)
-            except:
-                rating = 4.5
-            
-            # Parse review count
-            review_str = product.get('reviewCount', '0').replace('+', '').replace(',', '')
-            try:
-                review_count = int(review_str)
-            except:
-                review_count = 1000
-            
-            # Extract brand from name
-            brand = "Unknown"
-            name = product.get('name', '')
-            possible_brands = ['Canon', 'TOCOL', 'Samsung', 'ZZU', 'Xiaomi', 'Redmi', 'Soundcore', 'Anker', 'HS190']
-            for pb in possible_brands:
-                if pb.lower() in name.lower():
-                    brand = pb
-                    break
-            
-            # Extract category from badge
-            category = product.get('badge', 'General').replace(' Pick', '').replace('ing', '')
-            
-            ahat_products.append({
-                'id': f'SIX7-{i+1}',
-                'asin': self.extract_asin(product.get('link', '')),
-                'title': name,
-                'description': product.get('description', ''),
-                'price': {
-                    'original': original_price,
-                    'discounted': price,
-                    'currency': 'AUD',
-                    'discount_percentage': discount_pct,
-                    'savings': round(original_price - price, 2)
-                },
-                'category': category,
-                'brand': brand,
-                'rating': rating,
-                'review_count': review_count,
-                'image': product.get('image', ''),
-                'affiliate_link': product.get('link', ''),
-                'trending_score': min(100, int(rating * 20 + review_count / 100)),
-                'deal_score': min(100, int((discount_pct * 2) + (rating * 10))),
-                'status': 'active'
-            })
-        
-        # Apply pagination
+    def format_products(self, catalog, source):
+        """Format one page of a normalized catalog into Ahat API response"""
+        store = catalog.store
+
+        # Apply filters, sorting and pagination through the catalog indexes
         query = parse_qs(urlparse(self.path).query)
-        limit = int(query.get('limit', [10])[0])
-        page = int(query.get('page', [1])[0])
-        offset = (page - 1) * limit
-        
-        paginated = ahat_products[offset:offset + limit]
+        filters = parse_product_query(query)
+        fields = parse_fields(query.get('fields'), PRODUCT_FIELDS, FIELD_PRESETS)
+        limit = int_param(query, 'limit', 10)
+        cursor = query.get('cursor', [None])[0]
+
+        if cursor:
+            # Keyset pagination: continue right after the last product of the previous page
+            sort, descending, after = decode_cursor(cursor)
+            if filters['sort'] not in (None, sort) or filters['descending'] not in (None, descending):
+                raise ValueError('cursor does not match the requested sort order')
+            filters.update(sort=sort, descending=descending)
+            page, offset = None, 0
+        else:
+            page = int_param(query, 'page', 1)
+            offset, after = (page - 1) * limit, None
+            if filters['descending'] is None:
+                filters['descending'] = filters['sort'] in DESCENDING_BY_DEFAULT
+
+        # One extra product tells us whether another page exists
+        total, paginated = store.query(offset=offset, limit=limit + 1, after=after, **filters)
+        has_more = len(paginated) > limit
+        paginated = paginated[:limit]
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(filters['sort'], filters['descending'],
+                                        store.position(paginated[-1], filters['sort']))
         
         return {
             'success': True,
-            'data': paginated,
+            'data': project(paginated, fields),
             'pagination': {
                 'page': page,
                 'limit': limit,
-                'total': len(ahat_products),
-                'pages': max(1, len(ahat_products) // limit),
-                'has_more': (offset + limit) < len(ahat_products)
+                'total': total,
+                'pages': max(1, -(-total // limit)),
+                'has_more': has_more,
+                'next_cursor': next_cursor
             },
             'source': source
         }
-    
+
+    def get_dashboard(self, catalog, source):
+        """A page of products (with the /api/products parameters), the categories and the stats in one response"""
+        # One state of the catalog throughout, even while it is updated in place
+        with catalog.store.hold():
+            products = self.get_your_real_products(catalog, source)
+            categories = self.get_categories(catalog)
+            stats = self.get_stats(catalog)
+        return {
+            'success': True,
+            'data': {
+                'products': products['data'],
+                'pagination': products['pagination'],
+                'categories': categories['data'],
+                'stats': stats['data']
+            },
+            'source': source
+        }
+
+    def batch_products(self, catalog, source, query):
+        """The products with the ``ids`` and ``asins`` asked for, in that order, and what was not found"""
+        ids, asins = parse_batch_query(query)
+        fields = parse_fields(query.get('fields'), PRODUCT_FIELDS, FIELD_PRESETS)
+        products, missing = catalog.store.batch(ids, asin=asins)
+        return {
+            'success': True,
+            'data': project(products, fields),
+            'count': len(products),
+            'missing': {'ids': missing['keys'], 'asins': missing['asin']},
+            'source': source
+        }
+
+    def search_products(self, catalog, source, query):
+        """Products matching ``q``, best first, one page at a time"""
+        text = query.get('q', [''])[0].strip()
+        if not text:
+            raise ValueError('q is required')
+        limit = int_param(query, 'limit', 10, high=100)
+        page = int_param(query, 'page', 1)
+        fields = parse_fields(query.get('fields'), PRODUCT_FIELDS, FIELD_PRESETS)
+
+        result = catalog.search.search(text, offset=(page - 1) * limit, limit=limit)
+        products = project([catalog.store.get(key) for key, _ in result.hits], fields)
+        return {
+            'success': True,
+            'data': [dict(product, relevance=round(score, 4)) for product, (_, score) in zip(products, result.hits)],
+            'pagination': {
+                'page': page,
+                'limit': limit,
+                'total': result.total,
+                'pages': max(1, -(-result.total // limit)),
+                'has_more': page * limit < result.total
+            },
+            'query': text,
+            'corrections': result.corrections,
+            'source': source
+        }
+
+    def suggest(self, catalog, query):
+        """Autocomplete for a search box: completions of the last word of ``prefix``"""
+        prefix = query.get('prefix', [''])[0]
+        limit = int_param(query, 'limit', 10, high=50)
+        return {
+            'success': True,
+            'data': [{'text': text, 'count': count} for text, count in catalog.search.suggest(prefix, limit)],
+            'prefix': prefix
+        }
+
+    def price_history(self, catalog, query):
+        """Every recorded price of one product (by ``asin`` or ``id``), oldest first"""
+        asin = query.get('asin', [None])[0]
+        product_id = query.get('id', [None])[0]
+        if asin:
+            products = catalog.store.lookup('asin', asin)
+            product = products[0] if products else None
+            key = asin
+        elif product_id:
+            product = catalog.store.get(product_id)
+            key = price_key(product) if product is not None else None
+        else:
+            raise ValueError('asin or id is required')
+        hours = positive_param(query, 'hours')
+        since = time.time() - hours * 3600 if hours is not None else None
+
+        points = PRICE_HISTORY.history(key, since) if key else None
+        if points is None:
+            raise NotFound(f"No price history for {asin or product_id}")
+        prices = [point.price for point in points]
+        return {
+            'success': True,
+            'data': {
+                'id': product['id'] if product is not None else None,
+                'asin': product['asin'] if product is not None else asin,
+                'title': product['title'] if product is not None else None,
+                'current_price': prices[-1],
+                'lowest_price': min(prices),
+                'highest_price': max(prices),
+                'changes': len(points) - 1,
+                'points': [{'at': iso_time(point.at), 'price': point.price} for point in points]
+            }
+        }
+
+    def price_drops(self, catalog, source, query):
+        """Products whose price fell the most in the last ``hours``"""
+        hours = positive_param(query, 'hours', 24)
+        limit = int_param(query, 'limit', 20, high=100)
+        by = query.get('by', ['percent'])[0]
+        fields = parse_fields(query.get('fields'), PRODUCT_FIELDS, FIELD_PRESETS)
+
+        store = catalog.store
+        drops = PRICE_HISTORY.drops(hours, limit, by, include=lambda key: bool(store.lookup('price_key', key)))
+        products = project([store.lookup('price_key', drop.key)[0] for drop in drops], fields)
+        return {
+            'success': True,
+            'data': [
+                dict(product, price_drop={
+                    'previous_price': drop.previous,
+                    'current_price': drop.current,
+                    'amount': drop.amount,
+                    'percentage': drop.percent,
+                    'changed_at': iso_time(drop.changed_at)
+                })
+                for product, drop in zip(products, drops)
+            ],
+            'hours': hours,
+            'by': by,
+            'source': source
+        }
+
+    def top_products(self, catalog, source, query):
+        """The best ``k`` products by one ranking, in the whole catalog or one category"""
+        by = query.get('by', ['trending'])[0]
+        k = int_param(query, 'k', 10, high=100)
+        category = query.get('category', [None])[0]
+        if by not in RANKINGS:
+            raise ValueError(f"by must be one of {', '.join(RANKINGS)}")
+        fields = parse_fields(query.get('fields'), PRODUCT_FIELDS, FIELD_PRESETS)
+        return {
+            'success': True,
+            'data': project(catalog.rankings.top(by, k, category), fields),
+            'by': by,
+            'k': k,
+            'category': category,
+            'source': source
+        }
+
     def extract_asin(self, url):
         """Extract ASIN from Amazon URL"""
-        import re
-        patterns = [
-            r'/dp/([A-Z0-9]{10})',
-            r'/product/([A-Z0-9]{10})',
-            r'ASIN=([A-Z0-9]{10})'
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, url, re.IGNORECASE)
-            if match:
-                return match.group(1)
-        return 'UNKNOWN-ASIN'
+        return extract_asin(url)
     
-    def get_categories(self):
-        """Get categories from your products"""
-        categories = [
-            {'id': 1, 'name': 'Cameras', 'count': 1, 'icon': '📷'},
-            {'id': 2, 'name': 'Phone Accessories', 'count': 1, 'icon': '📱'},
-            {'id': 3, 'name': 'Storage', 'count': 1, 'icon': '💾'},
-            {'id': 4, 'name': 'Audio', 'count': 2, 'icon': '🎧'},
-            {'id': 5, 'name': 'Wearables', 'count': 1, 'icon': '⌚'},
-            {'id': 6, 'name': 'Toys', 'count': 1, 'icon': '🚁'},
-            {'id': 7, 'name': 'All Products', 'count': 7, 'icon': '🎯'}
-        ]
+    def get_categories(self, catalog=None):
+        """Get categories from the products currently being served, in the order they first appear"""
+        if catalog is None:
+            catalog, _ = self.current_catalog()
+        with catalog.store.hold():
+            stats = catalog.stats
+            categories = [
+                {'id': i, 'name': name, 'count': totals.count, 'icon': CATEGORY_ICONS.get(name, DEFAULT_CATEGORY_ICON)}
+                for i, (name, totals) in enumerate(stats.categories.items(), 1)
+            ]
+            categories.append({'id': len(categories) + 1, 'name': 'All Products', 'count': stats.totals.count,
+                               'icon': '🎯'})
         return {'success': True, 'data': categories}
     
-    def get_stats(self):
-        """Get stats from your 7 products"""
+    def get_stats(self, catalog=None):
+        """Get stats from the products currently being served"""
+        if catalog is None:
+            catalog, _ = self.current_catalog()
+        stats = catalog.stats
+        totals = stats.totals
+        status = refresh_status()
         return {
             'success': True,
             'data': {
-                'total_products': 7,
-                'active_products': 7,
-                'categories_count': 6,
-                'average_price': 145.06,
-                'average_discount': 16.71,
-                'last_sync': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'total_products': totals.count,
+                'active_products': totals.count,
+                'categories_count': len(stats.categories),
+                'average_price': round(totals.average_price, 2),
+                'average_discount': round(totals.average_discount_percentage, 2),
+                'last_sync': last_sync(status),
+                'last_refresh': last_refresh(status),
                 'top_categories': [
-                    {'name': 'Audio', 'count': 2},
-                    {'name': 'Cameras', 'count': 1},
-                    {'name': 'Storage', 'count': 1}
+                    {'name': category.name, 'count': category.count}
+                    for category in stats.top_categories(3)
+                ],
+                'categories': [
+                    {
+                        'name': category.name,
+                        'count': category.count,
+                        'average_price': round(category.average_price, 2),
+                        'average_discount': round(category.average_discount_percentage, 2),
+                        'average_rating': round(category.average_rating, 2),
+                        'total_reviews': category.total_reviews,
+                        'total_savings': round(category.total_savings, 2)
+                    }
+                    for category in stats.top_categories()
                 ],
                 'performance': {
-                    'total_reviews': 21200,
-                    'average_rating': 4.64,
-                    'total_savings': 144.56
+                    'total_reviews': totals.total_reviews,
+                    'average_rating': round(totals.average_rating, 2),
+                    'total_savings': round(totals.total_savings, 2)
                 }
             }
         }
 
-def main():
-    with socketserver.TCPServer(("", PORT), AhatAPIHandler) as httpd:
-        print(f"🎩 Ahat API Server running at http://localhost:{PORT}")
-        print(f"📊 Serving YOUR REAL SixSevenDeals products!")
-        print(f"   • http://localhost:{PORT}/api/products")
-        print(f"   • http://localhost:{PORT}/api/products/categories")
-        print(f"   • http://localhost:{PORT}/api/products/stats")
-        print("   • http://localhost:{PORT}/api/products?limit=3 (test pagination)")
-        print()
-        print("📈 Features:")
-        print("   • Your 7 real products from SixSevenDeals.com")
-        print("   • Real prices, discounts, and savings")
-        print("   • Real ratings and review counts")
-        print("   • Real affiliate links")
-        print("   • Pagination support")
-        print()
-        print("Press Ctrl+C to stop the server")
+
+def main(argv=None):
+    global SNAPSHOT_DIR
+    parser = argparse.ArgumentParser(description='Ahat API Server')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE,
+                        help='threaded: bounded worker pool; asyncio: event loop with a worker pool for handlers')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='maximum concurrent request handlers')
+    parser.add_argument('--import', dest='feeds', action='append', default=[], metavar='FEED',
+                        help='load a product feed (.json, .ndjson/.jsonl or .csv, optionally .gz) before serving')
+    parser.add_argument('--import-format', choices=IMPORT_FORMATS, help='feed format when the extension is not enough')
+    parser.add_argument('--import-batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--import-only', action='store_true', help='import the feeds, report and exit')
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR,
+                        help="where catalog snapshots are saved and restored from ('' disables them)")
+    parser.add_argument('--price-history', default=PRICE_HISTORY_FILE, metavar='FILE',
+                        help="append-only price history log ('' keeps it in memory only)")
+    parser.add_argument('--click-log', default=CLICK_LOG_FILE, metavar='FILE',
+                        help="append-only log of /go/ clicks, one file per day ('' counts them in memory only)")
+    parser.add_argument('--image-cache', default=IMAGE_CACHE_DIR, metavar='DIR',
+                        help="where /img/ thumbnails are cached ('' keeps them in memory only)")
+    parser.add_argument('--processes', type=int, default=PROCESSES,
+                        help='serving processes; above 1, a separate refresher process scrapes for all of them')
+    parser.add_argument('--refresh-interval', type=float, default=REFRESH_INTERVAL, metavar='SECONDS',
+                        help='scrape in the background this often (0 = when a request finds the scrape stale)')
+    parser.add_argument('--refresh-jitter', type=float, default=REFRESH_JITTER, metavar='FRACTION',
+                        help='randomize each refresh interval by up to this fraction')
+    parser.add_argument('--profile-sample', type=int, default=PROFILE_SAMPLE, metavar='N',
+                        help='cProfile 1 in N requests (0 = off); see /api/admin/profile')
+    args = parser.parse_args(argv)
+    PROFILER.configure(args.profile_sample)
+    SNAPSHOT_DIR = args.snapshot_dir
+    restore_snapshots()
+    if args.price_history:
+        try:
+            points = PRICE_HISTORY.open(args.price_history)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Price history kept in memory only: {e}")
+        else:
+            print(f"📈 Loaded {points:,} price changes of {len(PRICE_HISTORY):,} products from {args.price_history}")
+    click_log = None
+    if args.click_log:
+        try:
+            clicks = CLICKS.open(args.click_log)
+        except OSError as e:
+            print(f"⚠ Clicks counted in memory only: {e}")
+        else:
+            click_log = args.click_log
+            print(f"🖱 Loaded {clicks:,} clicks on {len(CLICKS):,} products in the last 24 hours from {args.click_log}")
+
+    for feed in args.feeds:
         try:
-            httpd.serve_forever()
-        except KeyboardInterrupt:
-            print("\n🛑 Server stopped")
+            stream, fmt = open_feed(feed, args.import_format)
+            with stream:
+                report = import_products(stream, fmt, args.import_batch_size, pause_gc=True)
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"❌ Import of {feed} failed: {e}\n")
+        print(describe_import(report, feed))
+    if args.feeds:
+        write_snapshot('imported', IMPORTED_CATALOG)
+        record_prices(IMPORTED_CATALOG)
+    if args.import_only:
+        return
+    if args.image_cache:
+        try:
+            IMAGES.cache = ImageCache(args.image_cache, memory_bytes=int(IMAGE_MEMORY_MB * 2**20),
+                                      disk_bytes=int(IMAGE_CACHE_MB * 2**20))
+        except OSError as e:
+            print(f"⚠ Thumbnails cached in memory only: {e}")
+    if not IMAGES.resizing:
+        print("⚠ Pillow is not installed: /img/ serves the image CDN's own sizes (full-size images "
+              "where it has none); pip install Pillow to resize thumbnails here")
+
+    if not 0 <= args.refresh_jitter < 1:
+        parser.error('--refresh-jitter must be a fraction between 0 and 1')
+    if args.processes > 1 and args.refresh_interval <= 0:
+        parser.error('--processes above 1 needs a --refresh-interval above 0')
+    if args.processes > 1 and click_log is None:
+        print("⚠ No click log: with --processes, clicks do not change the trending scores of the live catalog")
+    if args.refresh_interval > 0:
+        REFRESHER.interval, REFRESHER.jitter = args.refresh_interval, args.refresh_jitter
+    if args.refresh_interval > 0 and args.processes == 1:
+        if _live_catalog is None:
+            # Nothing to serve yet: scrape before taking requests rather than serve the fallback
+            outcome = REFRESHER.run()
+            print(f"🔄 First scrape: {outcome or REFRESHER.last.error} ({REFRESHER.last.seconds:.2f}s)")
+        REFRESHER.start(run_first=_live_catalog is not None and REFRESHER.last is None)
+    if args.processes == 1:
+        threading.Thread(target=materialize_catalogs, name='ahat-materialize', daemon=True).start()
+        CLICK_WRITER.start(run_first=False)
+        CLICK_SCORER.start()
+    else:
+        # Workers rescore the imported catalog by their clicks; built before the fork, it is built once
+        materialize_catalogs(('imported',))
+
+    httpd = make_server(args.engine, ("", args.port), AhatAPIHandler, workers=args.workers,
+                        max_body_bytes=int(MAX_BODY_MB * 2**20))
+    port = args.port
+
+    processes = f", {args.processes} processes" if args.processes > 1 else ""
+    print(f"🎩 Ahat API Server running at http://localhost:{port} ({args.engine}, {args.workers} workers{processes})")
+    print(f"📊 Serving YOUR REAL SixSevenDeals products!")
+    print(f"   • http://localhost:{port}/api/products")
+    print(f"   • http://localhost:{port}/api/products/categories")
+    print(f"   • http://localhost:{port}/api/products/stats")
+    print(f"   • http://localhost:{port}/api/dashboard (products, categories and stats at once)")
+    print(f"   • http://localhost:{port}/api/products/batch?ids=SIX7-1,SIX7-2 (and/or asins=)")
+    print(f"   • http://localhost:{port}/api/products?limit=3 (test pagination)")
+    print(f"   • http://localhost:{port}/api/products?fields=card (card fields only)")
+    print(f"   • http://localhost:{port}/api/products/search?q=wireless+earbuds")
+    print(f"   • http://localhost:{port}/api/products/suggest?prefix=wire")
+    print(f"   • http://localhost:{port}/api/products/top?by=deal&k=5")
+    print(f"   • http://localhost:{port}/api/products/price-drops?hours=24")
+    print(f"   • http://localhost:{port}/api/products/price-history?id=SIX7-1")
+    print(f"   • http://localhost:{port}/go/SIX7-1 (affiliate redirect, counts the click)")
+    print(f"   • http://localhost:{port}/img/SIX7-1?w={IMAGE_DEFAULT_WIDTH} (product image thumbnail)")
+    print(f"   • http://localhost:{port}/metrics (Prometheus)")
+    print()
+    print("📈 Features:")
+    print("   • Your 7 real products from SixSevenDeals.com")
+    print("   • Real prices, discounts, and savings")
+    print("   • Real ratings and review counts")
+    print("   • Real affiliate links")
+    print("   • Pagination support")
+    print()
+    print("Press Ctrl+C to stop the server")
+    if args.processes > 1:
+        serve_processes(httpd, args.processes)
+    else:
+        serve(httpd)
+        print("\n🛑 Stopping: finishing in-flight requests...")
+        httpd.server_close()
+        # The clicks of the last requests
+        CLICK_WRITER.run()
+    print("🛑 Server stopped")
+
+
+def serve(httpd):
+    """Serve until Ctrl+C or SIGTERM, then stop scraping (the caller drains the server)"""
+    # SIGTERM (e.g. from a process manager) drains like Ctrl+C does
+    def request_shutdown(signum, frame):
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, request_shutdown)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    REFRESHER.stop(timeout=5)
+    if FOLLOWER is not None:
+        FOLLOWER.stop(timeout=5)
+    CLICK_SCORER.stop(timeout=5)
+    CLICK_WRITER.stop(timeout=5)
+    IMAGES.close()
+
+
+def serve_processes(httpd, processes):
+    """Pre-fork mode: a refresher process scrapes and publishes, ``processes`` workers serve
+
+    Every process starts with what this one loaded (snapshots, imports, price
+    history) and the listening socket; the workers then follow the catalogs
+    the refresher publishes through SHARED. The refresher writes each one as
+    a catalog image, products and indexes, which every worker maps and
+    serves in place: a new catalog costs a worker no decoding or indexing,
+    and the workers share its pages rather than holding a copy each. The
+    refresher also rescores trending by the clicks and publishes the result,
+    so clicks only reach the live catalog through a click log every process
+    shares (--click-log).
+    """
+    global SHARED
+    SHARED = SharedCatalog.create()
+    # Every worker is woken for each new connection and only one gets it: the
+    # others must not block in accept(), where they would not see a SIGTERM
+    httpd.socket.setblocking(False)
+    targets = [('refresher', lambda: run_refresher(httpd))]
+    targets += [(f'worker {i}', lambda: run_worker(httpd)) for i in range(1, processes + 1)]
+
+    def restarting(name, pid, code):
+        print(f"⚠ The {name} process ({pid}) exited with status {code}; restarting it")
+    try:
+        run_children(targets, on_exit=restarting)
+    finally:
+        SHARED.destroy()
+    httpd.server_close()
+
+
+def run_refresher(httpd):
+    """The refresher process: scrape on schedule and publish every changed catalog to the workers"""
+    httpd.socket.close()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    REFRESHER.job = publish_live_catalog
+    REFRESHER.on_schedule = publish_refresh_status
+    # A live catalog restored from its snapshot is only published, rescored, once materialized
+    threading.Thread(target=materialize_catalogs, args=(('live',),), name='ahat-materialize', daemon=True).start()
+    REFRESHER.start()
+    # No clicks of its own, but scrapes and rescores score trending by everyone's
+    CLICK_WRITER.start(run_first=False)
+    CLICK_SCORER.job = rescore_and_publish
+    CLICK_SCORER.start()
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    REFRESHER.stop(timeout=30)
+    CLICK_SCORER.stop(timeout=5)
+    CLICK_WRITER.stop(timeout=5)
+
+
+def run_worker(httpd):
+    """A worker process: follow what the refresher publishes and serve until SIGTERM"""
+    global FOLLOWER
+    PRICE_HISTORY.follow()
+    FOLLOWER = RefreshScheduler(follow_shared_catalog, interval=SHARED_POLL, jitter=0)
+    if _live_catalog is None:
+        # Nothing to serve yet: wait for the first scrape rather than serve the fallback
+        deadline = time.monotonic() + FIRST_SCRAPE_WAIT
+        while not refresh_status().runs and time.monotonic() < deadline:
+            time.sleep(0.05)
+    FOLLOWER.run()
+    FOLLOWER.start(run_first=False)
+    CLICK_WRITER.start(run_first=False)
+    CLICK_SCORER.start()
+    serve(httpd)
+    httpd.server_close()
+    CLICK_WRITER.run()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,13 +1,51 @@
 # main.py - Complete AHAT Affiliate API
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict
+from fastapi.responses import RedirectResponse
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional
+from urllib.parse import parse_qs
+import hmac
 import json
+import argparse
+import os
+import socket
+import time
+
+from backend.ahat.classifier import extract_asin
+from backend.ahat.clicks import ClickTracker, click_score
+from backend.ahat.fields import parse_fields, project
+from backend.ahat.feed_import import PARSERS, gc_paused, open_feed
+from backend.ahat.http_client import UpstreamClient
+from backend.ahat.images import DEFAULT_WIDTH, DEFAULT_WORKERS, ImageCache, ImageError, ImageProxy
+from backend.ahat.prefork import run_children
+from backend.ahat.rankings import Rankings
+from backend.ahat.scheduler import RefreshScheduler
+from backend.ahat.shared_catalog import SharedCatalog
+from backend.ahat.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry, RequestMetrics, SamplingProfiler, register_cache
+from backend.ahat.records import record_type, to_json
+from backend.ahat.response_cache import GZIP_MIN_BYTES, ResponseCache
+from backend.ahat.search import SearchIndex
+from backend.ahat.snapshot import load_snapshot, save_snapshot
+from backend.ahat.stats import ProductFigures, StatsAggregator
+from backend.ahat.store import ProductStore, parse_batch_query, parse_product_query
+
+@asynccontextmanager
+async def lifespan(app):
+    # In every serving process, uvicorn workers and the reloader's server alike
+    if not IMAGES.resizing:
+        print("⚠ Pillow is not installed: /img/ serves the image CDN's own sizes (full-size images "
+              "where it has none); pip install Pillow to resize thumbnails here")
+    start_click_tracking()
+    yield
+    stop_click_tracking()
+    IMAGES.close()
 
 app = FastAPI(
     title="AHAT Affiliate API",
     description="Complete affiliate platform for SixSevenDeals",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS for frontend
@@ -19,6 +57,46 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Admin endpoints (profiling) are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get("AHAT_ADMIN_TOKEN")
+
+# Timing and cache figures, served in the Prometheus text format at /metrics
+METRICS = Registry()
+PROFILER = SamplingProfiler(int(os.environ.get("AHAT_PROFILE_SAMPLE", 0)))
+HTTP_METRICS = RequestMetrics(METRICS, PROFILER)
+
+
+class MetricsMiddleware:
+    """Time every HTTP request and record its status and body size, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        tracked = HTTP_METRICS.track(scope["method"], "other")
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                tracked.status = message["status"]
+            elif message["type"] == "http.response.body":
+                tracked.size = (tracked.size or 0) + len(message.get("body", b""))
+            await send(message)
+
+        with tracked:
+            try:
+                await self.app(scope, receive, send_and_record)
+            finally:
+                # The router leaves the matched route in the scope; unmatched paths stay "other"
+                route = scope.get("route")
+                if route is not None:
+                    tracked.route = route.path
+
+
+# Added last so it wraps everything, CORS included
+app.add_middleware(MetricsMiddleware)
+
 # Real SixSevenDeals Products Data
 PRODUCTS = [
     {
@@ -170,6 +248,320 @@ PRODUCTS = [
     }
 ]
 
+def product_figures(product: Dict) -> ProductFigures:
+    """The numbers the stats aggregator tracks for one PRODUCTS entry"""
+    return ProductFigures(
+        key=product["id"],
+        title=product["title"],
+        category=product["category"],
+        price=product["current_price"],
+        original_price=product["original_price"],
+        rating=product["rating"],
+        review_count=product["review_count"],
+        discount_percentage=product_discount(product)
+    )
+
+
+def product_discount(product: Dict) -> float:
+    original, current = product["original_price"], product["current_price"]
+    return (original - current) / original * 100 if original > 0 else 0
+
+
+def product_deal_score(product: Dict) -> int:
+    # The backend's deal_score: discount and rating, capped at 100
+    return min(100, int(product_discount(product) * 2 + product["rating"] * 10))
+
+
+def product_brand(product: Dict) -> str:
+    # Titles lead with the brand ("Samsung T7 Shield...", "Oral-B Pro 1000...")
+    return product.get("brand") or product["title"].split(" ", 1)[0]
+
+
+def product_asin(product: Dict) -> Optional[str]:
+    return extract_asin(product.get("affiliate_url", ""), default=None)
+
+
+def click_key(product: Dict) -> Optional[str]:
+    # Clicks are counted per ASIN (or link), which stays the same when the catalog is reloaded
+    return product_asin(product) or product.get("affiliate_url") or None
+
+
+def store_key(product_id: str):
+    """The STORE key of a product id from a request: the built-in catalog's ids are numbers, a file's may be strings"""
+    return int(product_id) if product_id.isascii() and product_id.isdigit() else product_id
+
+
+# The catalog holds compact read-only records in place of the dicts above (see
+# backend.ahat.records); they serialize to the same JSON
+Product = record_type(
+    "Product",
+    ("id", "title", "category", "current_price", "original_price", "rating", "review_count", "image_url",
+     "affiliate_url", "ai_trending_score", "features", "shipping", "warranty"),
+    shared=("category", "shipping", "warranty")
+)
+
+# Running totals behind /api/products/stats
+STATS = StatsAggregator(product_figures)
+
+# The catalog with its indexes; STATS follows every change made through it
+STORE = ProductStore(
+    key=lambda p: p["id"],
+    hash_fields={"asin": product_asin, "category": lambda p: p["category"], "brand": product_brand,
+                 "click_key": click_key},
+    sort_fields={
+        "price": lambda p: p["current_price"],
+        "rating": lambda p: p["rating"],
+        "discount": product_discount,
+        "trending": lambda p: p["ai_trending_score"]
+    }
+)
+STORE.subscribe(STATS)
+
+# Full-text index behind /api/products/search and /suggest, kept in step with STORE
+SEARCH = SearchIndex(
+    key=lambda p: p["id"],
+    fields={
+        "title": (lambda p: p["title"], 3),
+        "brand": (product_brand, 2),
+        "category": (lambda p: p["category"], 2),
+        "description": (lambda p: p.get("description"), 1),
+        "features": (lambda p: p.get("features"), 1)
+    }
+)
+STORE.subscribe(SEARCH)
+
+# Best-first orders behind /api/products/top; scores are computed when a product changes
+RANKINGS = Rankings(
+    key=lambda p: p["id"],
+    category=lambda p: p["category"],
+    scores={
+        "trending": lambda p: p["ai_trending_score"],
+        "deal": product_deal_score,
+        "discount": product_discount,
+        "rating": lambda p: p["rating"]
+    }
+)
+STORE.subscribe(RANKINGS)
+
+
+def load_products_file(path: str) -> List[Dict]:
+    """Read a catalog in the PRODUCTS shape from a JSON array or NDJSON file, as Product records"""
+    stream, fmt = open_feed(path)
+    if fmt == "csv":
+        raise ValueError("AHAT_PRODUCTS_FILE must be JSON or NDJSON")
+    with stream:
+        return [Product.from_dict(product) for product in PARSERS[fmt](stream)]
+
+
+def file_identity(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"source": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_catalog(path: str, snapshot_path: Optional[str]) -> List[Dict]:
+    """Products from ``path``, read from its snapshot when the file has not changed since
+
+    Without a snapshot every start parses the whole file; when the file cannot be
+    read at all, the snapshot (the last catalog that loaded) is served instead.
+    """
+    if not snapshot_path:
+        return load_products_file(path)
+    try:
+        snapshot = load_snapshot(snapshot_path, convert=Product.from_dict)
+    except ValueError as e:
+        print(f"⚠ Ignoring {snapshot_path}: {e}")
+        snapshot = None
+    try:
+        identity = file_identity(path)
+        if snapshot is not None and snapshot.meta == identity:
+            return snapshot.products
+        products = load_products_file(path)
+    except (OSError, ValueError) as e:
+        if snapshot is None:
+            raise
+        saved = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot.saved_at))
+        print(f"⚠ Could not load {path} ({e}); serving the snapshot saved {saved}")
+        return snapshot.products
+    try:
+        save_snapshot(snapshot_path, products, **identity)
+    except OSError as e:
+        print(f"⚠ Could not save {snapshot_path}: {e}")
+    return products
+
+
+# AHAT_PRODUCTS_FILE replaces the built-in products, e.g. with a large synthetic catalog;
+# AHAT_SNAPSHOT_FILE keeps it parsed on disk for the next start
+PRODUCTS_FILE = os.environ.get("AHAT_PRODUCTS_FILE")
+SNAPSHOT_FILE = os.environ.get("AHAT_SNAPSHOT_FILE")
+with gc_paused():
+    STORE.load(load_catalog(PRODUCTS_FILE, SNAPSHOT_FILE) if PRODUCTS_FILE
+               else [Product.from_dict(product) for product in PRODUCTS])
+
+# Encoded responses per endpoint and query; STORE.version changes with every catalog edit.
+# Bodies under AHAT_GZIP_MIN_BYTES are never gzipped.
+RESPONSES = ResponseCache(gzip_min_bytes=int(os.environ.get("AHAT_GZIP_MIN_BYTES", GZIP_MIN_BYTES)))
+
+# Fields /api/products?fields= can select, in response order, and the named presets
+PRODUCT_FIELDS = ("id", "title", "category", "current_price", "original_price", "rating", "review_count",
+                  "image_url", "affiliate_url", "ai_trending_score", "features", "shipping", "warranty")
+FIELD_PRESETS = {
+    # What a product card shows: no features list, shipping or warranty text
+    "card": ("id", "title", "category", "current_price", "original_price", "rating", "review_count",
+             "image_url", "affiliate_url"),
+    "full": None
+}
+
+# Clicks on affiliate links made through /go/{product_id} over the last 24 hours, logged to
+# AHAT_CLICK_LOG (one file per day) when set; trending scores follow them every AHAT_CLICK_SCORE_INTERVAL seconds
+CLICKS = ClickTracker()
+CLICK_LOG = os.environ.get("AHAT_CLICK_LOG")
+CLICK_FLUSH_INTERVAL = float(os.environ.get("AHAT_CLICK_FLUSH_INTERVAL", 1.0))
+CLICK_SCORE_INTERVAL = float(os.environ.get("AHAT_CLICK_SCORE_INTERVAL", 60))
+# Points a heavily clicked product gains on top of its ai_trending_score (at most 100)
+CLICK_BOOST = 20
+
+# Thumbnails of product images served by /img/{product_id}: cached in AHAT_IMAGE_CACHE_DIR
+# when set (in memory only otherwise), and by clients for AHAT_IMAGE_MAX_AGE seconds.
+# Resized here with Pillow installed, otherwise the image CDN's own sizes (see backend.ahat.images)
+IMAGES = ImageProxy(UpstreamClient(), ImageCache(os.environ.get("AHAT_IMAGE_CACHE_DIR") or None),
+                    workers=int(os.environ.get("AHAT_IMAGE_WORKERS", DEFAULT_WORKERS)))
+IMAGE_MAX_AGE = int(os.environ.get("AHAT_IMAGE_MAX_AGE", 7 * 24 * 3600))
+
+register_cache(METRICS, RESPONSES, "response_cache", "Encoded response cache")
+register_cache(METRICS, IMAGES, "image_cache", "Thumbnail cache (memory or disk)")
+METRICS.callback("ahat_catalog_products", "Products in the catalog", lambda: len(STORE))
+METRICS.callback("ahat_clicks_total", "Affiliate clicks redirected by /go/", lambda: CLICKS.recorded, kind="counter")
+METRICS.callback("ahat_clicks_dropped_total", "Clicks lost because the click buffer was full",
+                 lambda: CLICKS.dropped, kind="counter")
+METRICS.callback("ahat_click_buffer", "Clicks waiting to be logged and counted", lambda: CLICKS.buffered)
+METRICS.callback("ahat_image_cache_bytes", "Bytes of thumbnails cached",
+                 lambda: {("memory",): IMAGES.cache.memory_size, ("disk",): IMAGES.cache.disk_size},
+                 labelnames=("tier",))
+METRICS.callback("ahat_image_fetches_total", "Images downloaded from upstream", lambda: IMAGES.fetches, kind="counter")
+METRICS.callback("ahat_profile_sample_every", "Requests per cProfile sample (0 = profiling off)",
+                 lambda: PROFILER.every)
+
+
+def upsert_product(product: Dict):
+    """Add a product, or replace the one with the same id"""
+    STORE.upsert(Product.from_dict(product))
+
+
+def remove_product(product_id: int) -> bool:
+    """Remove a product by id; returns False if it was not in the catalog"""
+    return STORE.remove(product_id) is not None
+
+
+def replace_catalog(products: List[Dict]):
+    """Make the catalog ``products``, touching only the products that differ"""
+    current = {product["id"]: product for product in STORE.all()}
+    STORE.load([product for product in products if current.get(product["id"]) != product])
+    for product_id in current.keys() - {product["id"] for product in products}:
+        STORE.remove(product_id)
+
+
+# product id -> (the record rescore_clicks stored, the ai_trending_score it had before)
+_click_scored: Dict = {}
+
+
+def rescore_clicks():
+    """Move the ai_trending_score of every product whose clicks changed by its share of the clicks"""
+    counts = CLICKS.counts()
+    changed = []
+    for key in CLICKS.take_changed() | counts.keys():
+        for product in STORE.lookup("click_key", key):
+            scored = _click_scored.get(product["id"])
+            # A product loaded since it was last scored brings its own score
+            base = scored[1] if scored is not None and scored[0] is product else product["ai_trending_score"]
+            score = min(100, base + round(click_score(counts.get(key, 0)) * CLICK_BOOST / 100))
+            if score != product["ai_trending_score"]:
+                record = Product.from_dict(dict(product, ai_trending_score=score))
+                _click_scored[product["id"]] = (record, base)
+                changed.append(record)
+    if changed:
+        STORE.load(changed)
+    return "changed" if changed else "not_modified"
+
+
+def flush_clicks():
+    CLICKS.flush()
+    return "flushed"
+
+
+CLICK_WRITER = RefreshScheduler(flush_clicks, interval=CLICK_FLUSH_INTERVAL, jitter=0)
+CLICK_SCORER = RefreshScheduler(rescore_clicks, interval=CLICK_SCORE_INTERVAL, jitter=0)
+
+
+def start_click_tracking():
+    if CLICK_LOG:
+        try:
+            CLICKS.open(CLICK_LOG)
+        except (OSError, ValueError) as e:
+            print(f"⚠ Clicks counted in memory only: {e}")
+    CLICK_WRITER.start(run_first=False)
+    CLICK_SCORER.start()
+
+
+def stop_click_tracking():
+    CLICK_SCORER.stop(timeout=5)
+    CLICK_WRITER.stop(timeout=5)
+    # The clicks of the last requests
+    CLICK_WRITER.run()
+
+
+# With --processes N: the catalog the refresher process publishes for the workers
+# (each new version of AHAT_PRODUCTS_FILE), checked for every AHAT_SHARED_POLL seconds
+SHARED: Optional[SharedCatalog] = None
+SHARED_POLL = float(os.environ.get("AHAT_SHARED_POLL", 1.0))
+RELOAD_INTERVAL = float(os.environ.get("AHAT_RELOAD_INTERVAL", 5.0))
+_published_identity: Optional[Dict] = None
+_shared_generation = 0
+
+
+def publish_products_file():
+    """The refresher process's job: publish AHAT_PRODUCTS_FILE again whenever it changes"""
+    global _published_identity
+    identity = file_identity(PRODUCTS_FILE)
+    if identity == _published_identity:
+        return "not_modified"
+    SHARED.publish(load_catalog(PRODUCTS_FILE, SNAPSHOT_FILE), **identity)
+    _published_identity = identity
+    return "changed"
+
+
+def follow_shared_catalog():
+    """A worker's job: pick up the catalog the refresher process published"""
+    global _shared_generation
+    if SHARED.generation == _shared_generation:
+        return "not_modified"
+    generation, products = SHARED.load(convert=Product.from_dict)
+    # No gc_paused() here: requests are being served
+    replace_catalog(products)
+    _shared_generation = generation
+    # The new records carry the file's trending scores, without the clicks
+    CLICK_SCORER.trigger()
+    return "changed"
+
+
+def encode_json(content):
+    """Encode exactly like FastAPI's default JSONResponse"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"),
+                      default=to_json).encode("utf-8")
+
+
+def cached_response(request: Request, endpoint: str, build) -> Response:
+    """Serve the cached encoding of build() for this query, or 304 if the client has it"""
+    query = parse_qs(request.url.query)
+    representation = RESPONSES.get(endpoint, query, STORE.version, lambda: encode_json(build()))
+    body, etag, encoding = representation.select(request.headers.get("accept-encoding"))
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if representation.not_modified(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=representation.content_type, headers=headers)
+
+
 @app.get("/")
 async def root():
     return {
@@ -177,64 +569,236 @@ async def root():
         "version": "1.0.0",
         "status": "running",
         "endpoints": {
+            "/api/dashboard": "Products, categories and stats in one response",
             "/api/products": "Get all products",
+            "/api/products/batch?ids=&asins=": "Get many products by id and ASIN",
             "/api/products/categories": "Get product categories",
             "/api/products/stats": "Get statistics",
+            "/api/products/search?q=": "Search products",
+            "/api/products/suggest?prefix=": "Autocomplete search words",
+            "/api/products/top?by=": "Top products by trending, deal, discount or rating",
+            "/go/{product_id}": "Redirect to the product's affiliate link, counting the click",
+            "/img/{product_id}?w=": "The product's image as a thumbnail about w pixels wide",
+            "/metrics": "Prometheus metrics",
             "/docs": "API documentation (Swagger UI)"
         }
     }
 
 @app.get("/api/products")
-async def get_products():
-    """Get all products"""
-    return {
-        "products": PRODUCTS,
-        "count": len(PRODUCTS),
-        "total": len(PRODUCTS)
-    }
+async def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    min_discount: Optional[float] = None,
+    sort: Optional[str] = Query(None, pattern="^-?(price|rating|discount|trending)$"),
+    order: Optional[str] = Query(None, pattern="^(asc|desc)$"),
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = Query(None, description="Comma-separated fields and presets (card, full)")
+):
+    """Get all products, optionally filtered, sorted, paged and narrowed to some fields"""
+    query = parse_product_query({
+        "category": category, "brand": brand,
+        "min_price": min_price, "max_price": max_price,
+        "min_rating": min_rating, "min_discount": min_discount,
+        "sort": sort, "order": order
+    })
+    try:
+        projection = parse_fields(fields, PRODUCT_FIELDS, FIELD_PRESETS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def build():
+        total, products = STORE.query(offset=offset, limit=limit, **query)
+        return {
+            "products": project(products, projection),
+            "count": len(products),
+            "total": total
+        }
+    return cached_response(request, "products", build)
+
+@app.get("/api/dashboard")
+async def dashboard(
+    request: Request,
+    limit: int = Query(10, ge=1),
+    fields: Optional[str] = Query(None, description="Comma-separated fields and presets (card, full)")
+):
+    """The first products, the categories and the stats in one response, all from one catalog version"""
+    try:
+        projection = parse_fields(fields, PRODUCT_FIELDS, FIELD_PRESETS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def build():
+        # Clicks and reloads update the catalog in place; hold it still while reading
+        with STORE.hold():
+            total, products = STORE.query(limit=limit)
+            return {
+                "products": project(products, projection),
+                "count": len(products),
+                "total": total,
+                "categories": build_categories(),
+                "stats": build_stats()
+            }
+    return cached_response(request, "dashboard", build)
+
+@app.get("/api/products/batch")
+async def batch_products(
+    request: Request,
+    ids: Optional[List[str]] = Query(None, description="Comma-separated product ids"),
+    asins: Optional[List[str]] = Query(None, description="Comma-separated ASINs"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields and presets (card, full)")
+):
+    """The products with the ids and ASINs asked for, in that order, and what was not found"""
+    try:
+        ids, asins = parse_batch_query({"ids": ids, "asins": asins})
+        projection = parse_fields(fields, PRODUCT_FIELDS, FIELD_PRESETS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    keys = [store_key(i) for i in ids]
+
+    def build():
+        products, missing = STORE.batch(keys, asin=asins)
+        return {
+            "products": project(products, projection),
+            "count": len(products),
+            "missing": {"ids": missing["keys"], "asins": missing["asin"]}
+        }
+    return cached_response(request, "batch", build)
+
+@app.get("/api/products/search")
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=100),
+    fields: Optional[str] = Query(None, description="Comma-separated fields and presets (card, full)")
+):
+    """Products matching the query, best first"""
+    try:
+        projection = parse_fields(fields, PRODUCT_FIELDS, FIELD_PRESETS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def build():
+        result = SEARCH.search(q, offset=offset, limit=limit)
+        products = project([STORE.get(key) for key, _ in result.hits], projection)
+        return {
+            "products": [dict(product, relevance=round(score, 4))
+                         for product, (_, score) in zip(products, result.hits)],
+            "count": len(products),
+            "total": result.total,
+            "corrections": result.corrections
+        }
+    return cached_response(request, "search", build)
+
+@app.get("/api/products/suggest")
+async def suggest(request: Request, prefix: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)):
+    """Completions of the last word of a search box"""
+    def build():
+        return {"suggestions": [{"text": text, "count": count} for text, count in SEARCH.suggest(prefix, limit)]}
+    return cached_response(request, "suggest", build)
+
+@app.get("/api/products/top")
+async def top_products(
+    request: Request,
+    by: str = Query("trending", pattern="^(trending|deal|discount|rating)$"),
+    k: int = Query(10, ge=1, le=100),
+    category: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated fields and presets (card, full)")
+):
+    """The best k products by one ranking, in the whole catalog or one category"""
+    try:
+        projection = parse_fields(fields, PRODUCT_FIELDS, FIELD_PRESETS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def build():
+        products = project(RANKINGS.top(by, k, category), projection)
+        return {"products": products, "count": len(products), "by": by, "category": category}
+    return cached_response(request, "top", build)
+
+@app.get("/go/{product_id}")
+async def go(product_id: str):
+    """Redirect to the product's affiliate link; the click counts towards its trending score"""
+    product = STORE.get(store_key(product_id))
+    if product is None or not product["affiliate_url"]:
+        raise HTTPException(status_code=404, detail="Product not found")
+    # Just a buffer append: CLICK_WRITER logs and counts it off the request path
+    CLICKS.record(click_key(product))
+    return RedirectResponse(product["affiliate_url"], status_code=302, headers={"Cache-Control": "no-store"})
+
+@app.get("/img/{product_id}")
+def image(product_id: str, request: Request, w: int = Query(DEFAULT_WIDTH, ge=1)):
+    """The product's image scaled down for a card ``w`` pixels wide, cached here and by clients"""
+    # A plain def: the first request for an image waits on the download and resize in a worker thread
+    product = STORE.get(store_key(product_id))
+    if product is None or not product["image_url"]:
+        raise HTTPException(status_code=404, detail="Product not found")
+    try:
+        thumbnail = IMAGES.get(product["image_url"], w)
+    except ImageError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    headers = {"ETag": thumbnail.etag, "Cache-Control": f"public, max-age={IMAGE_MAX_AGE}"}
+    if thumbnail.etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=thumbnail.body, media_type=thumbnail.content_type, headers=headers)
 
 @app.get("/api/products/categories")
-async def get_categories():
+async def get_categories(request: Request):
     """Get all unique categories with product counts"""
-    categories = {}
-    for product in PRODUCTS:
-        cat = product["category"]
-        categories[cat] = categories.get(cat, 0) + 1
-    
-    # Convert to list format
-    result = [{"name": cat, "count": count} for cat, count in categories.items()]
-    
-    return result
+    return cached_response(request, "categories", build_categories)
+
+def build_categories():
+    # STATS keeps one entry per category, in the order categories first appeared
+    return [{"name": cat, "count": totals.count} for cat, totals in STATS.categories.items()]
 
 @app.get("/api/products/stats")
-async def get_stats():
+async def get_stats(request: Request):
     """Get comprehensive product statistics"""
-    total_products = len(PRODUCTS)
-    avg_rating = sum(p["rating"] for p in PRODUCTS) / total_products
-    total_savings = sum(p["original_price"] - p["current_price"] for p in PRODUCTS)
-    total_original = sum(p["original_price"] for p in PRODUCTS)
-    avg_discount = (total_savings / total_original) * 100 if total_original > 0 else 0
-    
-    # Find best deals
-    best_discount_product = max(PRODUCTS, key=lambda x: (x["original_price"] - x["current_price"]) / x["original_price"])
-    best_rating_product = max(PRODUCTS, key=lambda x: x["rating"])
-    
+    return cached_response(request, "stats", build_stats)
+
+def build_stats():
+    totals = STATS.totals
     return {
-        "total_products": total_products,
-        "average_rating": round(avg_rating, 2),
-        "total_savings": round(total_savings, 2),
-        "average_discount": round(avg_discount, 2),
-        "best_discount": {
-            "product": best_discount_product["title"],
-            "discount_percentage": round((best_discount_product["original_price"] - best_discount_product["current_price"]) / best_discount_product["original_price"] * 100, 2),
-            "savings": round(best_discount_product["original_price"] - best_discount_product["current_price"], 2)
-        },
-        "best_rating": {
-            "product": best_rating_product["title"],
-            "rating": best_rating_product["rating"],
-            "reviews": best_rating_product["review_count"]
+        "total_products": totals.count,
+        "average_rating": round(totals.average_rating, 2),
+        "total_savings": round(totals.total_savings, 2),
+        "average_discount": round(totals.weighted_discount_percentage, 2),
+        **leader_stats(totals),
+        "total_reviews": totals.total_reviews,
+        "categories": [
+            {
+                "name": category.name,
+                "count": category.count,
+                "average_rating": round(category.average_rating, 2),
+                "total_savings": round(category.total_savings, 2),
+                "average_discount": round(category.weighted_discount_percentage, 2),
+                **leader_stats(category),
+                "total_reviews": category.total_reviews
+            }
+            for category in STATS.top_categories()
+        ]
+    }
+
+def leader_stats(totals):
+    """best_discount / best_rating entries for a catalog or category Totals"""
+    best_discount = totals.best_discount
+    best_rating = totals.best_rating
+    return {
+        "best_discount": best_discount and {
+            "product": best_discount.title,
+            "discount_percentage": round(best_discount.discount_percentage, 2),
+            "savings": round(best_discount.original_price - best_discount.price, 2)
         },
-        "total_reviews": sum(p["review_count"] for p in PRODUCTS)
+        "best_rating": best_rating and {
+            "product": best_rating.title,
+            "rating": best_rating.rating,
+            "reviews": best_rating.review_count
+        }
     }
 
 @app.get("/health")
@@ -242,6 +806,92 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "AHAT API"}
 
-if __name__ == "__main__":
+@app.get("/metrics")
+async def metrics():
+    """Request, cache and catalog figures in the Prometheus text format"""
+    return Response(content=METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set AHAT_ADMIN_TOKEN)")
+    if not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/admin/profile")
+async def profile_report(
+    route: Optional[str] = None,
+    sort: str = "cumulative",
+    limit: int = Query(30, ge=1),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Accumulated cProfile statistics of the sampled requests, as text"""
+    require_admin(x_admin_token)
+    try:
+        report = PROFILER.report(route, limit, sort)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key {sort!r}")
+    return Response(content=report, media_type="text/plain")
+
+@app.post("/api/admin/profile")
+async def configure_profiler(
+    every: int = Query(..., ge=0),
+    reset: bool = False,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Profile 1 in ``every`` requests from now on (0 turns it off)"""
+    require_admin(x_admin_token)
+    PROFILER.configure(every, reset=reset)
+    return {"every": PROFILER.every, "samples": PROFILER.samples}
+
+def serve_processes(host: str, port: int, processes: int):
+    """Pre-fork mode: ``processes`` uvicorn workers share one socket and the catalog loaded here
+
+    With AHAT_PRODUCTS_FILE set, a refresher process reloads the file whenever
+    it changes and publishes it through SHARED; every worker applies it. The
+    workers share the loaded catalog only until the first reload: each then
+    decodes and indexes its own copy, so memory grows with workers times
+    catalog size.
+    """
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    global SHARED, _published_identity
+    sock = socket.create_server((host, port))
+    SHARED = SharedCatalog.create()
+
+    def refresher():
+        sock.close()
+        scheduler = RefreshScheduler(publish_products_file, interval=RELOAD_INTERVAL, jitter=0)
+        scheduler.start(run_first=False)
+        while True:
+            time.sleep(3600)
+
+    def worker():
+        RefreshScheduler(follow_shared_catalog, interval=SHARED_POLL, jitter=0).start()
+        uvicorn.Server(uvicorn.Config(app, log_level="warning")).run(sockets=[sock])
+
+    targets = [(f"worker {i}", worker) for i in range(1, processes + 1)]
+    if PRODUCTS_FILE:
+        _published_identity = file_identity(PRODUCTS_FILE)
+        targets.append(("refresher", refresher))
+    def restarting(name, pid, code):
+        print(f"{name} ({pid}) exited with status {code}; restarting it")
+
+    print(f"AHAT API on http://{host}:{port} with {processes} worker processes")
+    try:
+        run_children(targets, on_exit=restarting)
+    finally:
+        SHARED.destroy()
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AHAT Affiliate API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--processes", type=int, default=int(os.environ.get("AHAT_PROCESSES", 1)),
+                        help="pre-forked worker processes sharing the catalog (1 = a single reloading dev server)")
+    args = parser.parse_args()
+    if args.processes > 1:
+        serve_processes(args.host, args.port, args.processes)
+    else:
+        import uvicorn
+        uvicorn.run(app, host=args.host, port=args.port, reload=True)
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""Micro-benchmark for the ingest classifier (brand, category, ASIN)
+
+Compares the Aho-Corasick brand matcher with the original per-brand substring
+loop at several dictionary sizes, memoized category rules with the chained
+str.replace, and the combined ASIN pattern with the three separate searches.
+
+    python scripts/bench/bench_classifier.py --products 20000 --brands 9,100,1000
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend'))
+
+from ahat.classifier import (DEFAULT_CONFIG, BRAND_MATCHERS, Classifier,  # noqa: E402
+                             extract_asin)
+
+WORDS = ['wireless', 'camera', 'portable', 'charger', 'pro', 'mini', 'smart', 'watch', 'earbuds',
+         'drone', 'ssd', 'usb-c', 'fast', 'pocket', 'noise', 'cancelling', 'bluetooth', 'shield']
+BADGES = ["Editor's Pick", 'Trending', 'Best Seller', 'Hot Deal', 'Staff Pick']
+LEGACY_ASIN_PATTERNS = [r'/dp/([A-Z0-9]{10})', r'/product/([A-Z0-9]{10})', r'ASIN=([A-Z0-9]{10})']
+
+
+def synthetic_brands(n, base, rnd):
+    brands = list(base)
+    while len(brands) < n:
+        brands.append(''.join(rnd.choice(string.ascii_letters) for _ in range(rnd.randint(4, 10))))
+    return brands[:n]
+
+
+def synthetic_products(n, brands, rnd):
+    products = []
+    for _ in range(n):
+        words = rnd.sample(WORDS, 6)
+        # Roughly one in four titles carries no dictionary brand at all
+        if rnd.random() < 0.75:
+            words.insert(rnd.randint(0, len(words)), rnd.choice(brands))
+        asin = 'B0' + ''.join(rnd.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+        link = rnd.choice([f'https://www.amazon.com.au/dp/{asin}?tag=six7-22',
+                           f'https://www.amazon.com.au/gp/product/{asin}',
+                           f'https://www.amazon.com.au/exec/obidos/?ASIN={asin}',
+                           'https://amzn.to/3xYzAbC'])
+        products.append((' '.join(words).title(), rnd.choice(BADGES), link))
+    return products
+
+
+def legacy_extract_asin(url):
+    for pattern in LEGACY_ASIN_PATTERNS:
+        match = re.search(pattern, url, re.IGNORECASE)
+        if match:
+            return match.group(1)
+    return 'UNKNOWN-ASIN'
+
+
+def timed(fn, items, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e9
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--brands', default='9,100,1000', help='comma-separated dictionary sizes')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    config = Classifier.from_file(DEFAULT_CONFIG)
+    base_brands = config.matcher.brands
+
+    print(f'{args.products} products, best of {args.repeat} (ns per item)')
+    print('\nbrand')
+    for size in (int(n) for n in args.brands.split(',')):
+        brands = synthetic_brands(size, base_brands, rnd)
+        names = [name for name, _, _ in synthetic_products(args.products, brands, rnd)]
+        results = {}
+        for engine, matcher_class in BRAND_MATCHERS.items():
+            start = time.perf_counter()
+            matcher = matcher_class(brands)
+            build_ms = (time.perf_counter() - start) * 1000
+            results[engine] = [matcher.match(name) for name in names]
+            print(f'  {size:>6} brands  {engine:<13} {timed(matcher.match, names, args.repeat):>9.0f}'
+                  f'   (build {build_ms:.1f} ms)')
+        assert len({tuple(r) for r in results.values()}) == 1, 'engines disagree'
+
+    products = synthetic_products(args.products, base_brands, rnd)
+    badges = [badge for _, badge, _ in products]
+    links = [link for _, _, link in products]
+
+    print('\ncategory')
+    print(f"  {'chained replace':<28} "
+          f"{timed(lambda b: b.replace(' Pick', '').replace('ing', ''), badges, args.repeat):>9.0f}")
+    print(f"  {'memoized rules':<28} {timed(config.category, badges, args.repeat):>9.0f}")
+
+    print('\nasin')
+    assert [legacy_extract_asin(u) for u in links] == [extract_asin(u) for u in links]
+    print(f"  {'three re.search calls':<28} {timed(legacy_extract_asin, links, args.repeat):>9.0f}")
+    print(f"  {'combined precompiled':<28} {timed(extract_asin, links, args.repeat):>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
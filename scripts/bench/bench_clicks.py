@@ -0,0 +1,121 @@
+"""Benchmark click tracking: buffered clicks against a log write per click, and /go/ latency
+
+First, in process: the cost of ClickTracker.record() on the request path and
+of the background flush() per click, next to appending each click to the log
+as it happens (with and without fsync, as a durable per-request write would
+need). Then backend/server.py is started against the local stand-in
+upstream and /go/<id> redirects are driven over keep-alive connections, with
+a cached /api/products/stats response as a reference point.
+
+    python scripts/bench/bench_clicks.py [--clicks 200000] [--duration 5]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from catalogs import products_page, raw_products  # noqa: E402
+from loadtest import ROOT, drive, free_port, get, percentile  # noqa: E402
+from standin_upstream import StandinUpstream  # noqa: E402
+from ahat.clicks import ClickTracker  # noqa: E402
+
+
+def per_click(seconds, clicks):
+    return seconds / clicks * 1e6
+
+
+def bench_tracker(args, directory):
+    keys = [f'B0{i:08d}' for i in range(args.keys)]
+    tracker = ClickTracker(capacity=args.clicks)
+    tracker.open(os.path.join(directory, 'buffered.log'))
+    started = time.perf_counter()
+    for i in range(args.clicks):
+        tracker.record(keys[i % len(keys)])
+    recorded = time.perf_counter() - started
+    started = time.perf_counter()
+    tracker.flush()
+    flushed = time.perf_counter() - started
+    assert sum(tracker.counts().values()) == args.clicks
+    print(f"{'record() on the request path':<36} {per_click(recorded, args.clicks):>8.2f} µs per click")
+    print(f"{'flush() in the background':<36} {per_click(flushed, args.clicks):>8.2f} µs per click")
+
+    for sync in (False, True):
+        clicks = args.clicks if not sync else min(args.clicks, 2000)
+        fd = os.open(os.path.join(directory, f'direct-{sync}.log'), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        started = time.perf_counter()
+        for i in range(clicks):
+            os.write(fd, f'{int(time.time())}\t{keys[i % len(keys)]}\n'.encode())
+            if sync:
+                os.fsync(fd)
+        elapsed = time.perf_counter() - started
+        os.close(fd)
+        label = 'write + fsync per click' if sync else 'write per click'
+        print(f"{label:<36} {per_click(elapsed, clicks):>8.2f} µs per click")
+
+
+def bench_http(args, directory):
+    upstream = StandinUpstream(products_page(raw_products(args.size)))
+    upstream.start()
+    port = free_port()
+    env = dict(os.environ, AHAT_SOURCE_URL=upstream.url, AHAT_SNAPSHOT_DIR='', AHAT_PRICE_HISTORY_FILE='',
+               AHAT_CLICK_LOG=os.path.join(directory, 'server.log'))
+    process = subprocess.Popen([sys.executable, 'server.py', '--port', str(port)],
+                               cwd=os.path.join(ROOT, 'backend'), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if get(port, '/api/products/stats', timeout=5) == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError('server did not start')
+            time.sleep(0.1)
+        print(f"{'endpoint':<22} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name, paths in (('/go/<id>', [f'/go/SIX7-{i}' for i in range(1, min(args.size, 500) + 1)]),
+                            ('/api/products/stats', ['/api/products/stats'])):
+            latencies, errors, elapsed = drive(port, paths, args.concurrency, args.duration, {})
+            print(f'{name:<22} {len(latencies) / elapsed:>8.0f} {percentile(latencies, 50) * 1000:>8.3f} '
+                  f'{percentile(latencies, 99) * 1000:>8.3f} {errors:>7}')
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        upstream.stop()
+    logged = 0
+    # One file per day (see ahat.clicks.log_file)
+    for name in os.listdir(directory):
+        if name.startswith('server.') and name != 'server.log':
+            with open(os.path.join(directory, name), 'rb') as f:
+                logged += sum(1 for _ in f)
+    print(f'{logged:,} clicks in the log')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clicks', type=int, default=200000)
+    parser.add_argument('--keys', type=int, default=5000, help='distinct products clicked in process')
+    parser.add_argument('--size', type=int, default=2000, help='products on the stand-in page')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        bench_tracker(args, directory)
+        print()
+        bench_http(args, directory)
+
+
+if __name__ == '__main__':
+    main()
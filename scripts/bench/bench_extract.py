@@ -0,0 +1,88 @@
+"""Benchmark products-array extraction from saved homepage fixtures
+
+Compares the targeted byte-scan extractor (ahat.js_literal) with the previous
+BeautifulSoup path (full DOM, regex, quote replacement, json.loads) on time per
+page and peak traced memory. Needs beautifulsoup4 for the comparison column.
+
+    python scripts/bench/bench_extract.py [fixture.html ...] [--repeat 50]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from ahat.js_literal import extract_array  # noqa: E402
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def legacy_extract(page):
+    """The extraction scrape_your_website used to do"""
+    soup = BeautifulSoup(page, 'html.parser')
+    products_js = None
+    for script in soup.find_all('script'):
+        if script.string and 'const products = [' in script.string:
+            products_js = script.string
+            break
+    if products_js:
+        match = re.search(r'const products\s*=\s*(\[.*?\]);', products_js, re.DOTALL)
+        if match:
+            return json.loads(match.group(1).replace("'", '"'))
+    return None
+
+
+def measure(extract, page, repeat):
+    """Best time in ms, peak traced memory in KiB, and the number of products (or the error)"""
+    try:
+        result = extract(page)
+    except ValueError as e:
+        return None, None, f'failed: {e}'.split('\n')[0][:60]
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract(page)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    extract(page)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best * 1000, peak / 1024, f'{len(result) if result else 0} products'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('fixtures', nargs='*', default=sorted(glob.glob(os.path.join(HERE, 'fixtures', '*.html'))))
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    extractors = [('byte scan', extract_array)]
+    if BeautifulSoup is not None:
+        extractors.append(('beautifulsoup', legacy_extract))
+    else:
+        print('beautifulsoup4 is not installed; showing the byte-scan extractor only')
+
+    print(f"{'fixture':<28} {'extractor':<14} {'ms':>8} {'peak KiB':>10}  result")
+    for path in args.fixtures:
+        with open(path, 'rb') as f:
+            page = f.read()
+        name = f'{os.path.basename(path)} ({len(page) // 1024} KiB)'
+        for label, extract in extractors:
+            ms, peak, outcome = measure(extract, page, args.repeat)
+            if ms is None:
+                print(f'{name:<28} {label:<14} {"-":>8} {"-":>10}  {outcome}')
+            else:
+                print(f'{name:<28} {label:<14} {ms:>8.2f} {peak:>10.0f}  {outcome}')
+
+
+if __name__ == '__main__':
+    main()
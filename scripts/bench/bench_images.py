@@ -0,0 +1,145 @@
+"""Benchmark /img/<id>: cold thumbnails against cached ones, and upstream fetches per image
+
+backend/server.py is started against the local stand-in upstream, whose
+products' images point at the local stand-in image CDN (standin_images.py,
+which can be made slow with --delay). Then:
+
+* a burst of concurrent requests for one uncached thumbnail, which should
+  reach the image CDN once;
+* a cold pass over the first --images products, one request each;
+* keep-alive load on the same thumbnails, now served from the cache;
+* the same thumbnails after a restart, from the on-disk cache.
+
+Resizing happens in the server's process pool when Pillow is installed;
+without it the thumbnails are the CDN's own sized variants.
+
+    python scripts/bench/bench_images.py [--images 200] [--delay 0.05] [--duration 5]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from catalogs import products_page, raw_products  # noqa: E402
+from loadtest import ROOT, drive, free_port, get, percentile  # noqa: E402
+from standin_images import StandinImages  # noqa: E402
+from standin_upstream import StandinUpstream  # noqa: E402
+
+
+def start_server(port, env):
+    process = subprocess.Popen([sys.executable, 'server.py', '--port', str(port)],
+                               cwd=os.path.join(ROOT, 'backend'), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if get(port, '/api/products/stats', timeout=5) == 200:
+                return process
+        except OSError:
+            pass
+        if time.monotonic() > deadline or process.poll() is not None:
+            process.kill()
+            raise RuntimeError('server did not start')
+        time.sleep(0.1)
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def timed(port, paths):
+    """Latencies of requesting ``paths`` one after another"""
+    latencies = []
+    for path in paths:
+        started = time.perf_counter()
+        status = get(port, path, timeout=30)
+        if status != 200:
+            raise RuntimeError(f'{path}: HTTP {status}')
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(name, latencies, elapsed, fetches):
+    latencies = sorted(latencies)
+    print(f'{name:<26} {len(latencies) / elapsed:>8.0f} {percentile(latencies, 50) * 1000:>8.2f} '
+          f'{percentile(latencies, 99) * 1000:>8.2f} {fetches:>8}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--images', type=int, default=200, help='products whose thumbnails are requested')
+    parser.add_argument('--width', type=int, default=320)
+    parser.add_argument('--size', type=int, default=1500, help='width of the original images')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds the image CDN takes per request')
+    parser.add_argument('--burst', type=int, default=16, help='concurrent requests for one cold thumbnail')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    images = StandinImages(size=args.size, delay=args.delay).start()
+    page = products_page(raw_products(args.images + 1))
+    upstream = StandinUpstream(page.replace(b'https://m.media-amazon.com', images.url.encode()))
+    upstream.start()
+    port = free_port()
+    directory = tempfile.TemporaryDirectory()
+    env = dict(os.environ, AHAT_SOURCE_URL=upstream.url, AHAT_SNAPSHOT_DIR='', AHAT_PRICE_HISTORY_FILE='',
+               AHAT_CLICK_LOG='', AHAT_IMAGE_CACHE_DIR=directory.name)
+    paths = [f'/img/SIX7-{i}?w={args.width}' for i in range(1, args.images + 1)]
+
+    def fetched():
+        return sum(images.requests.values())
+
+    process = start_server(port, env)
+    try:
+        print(f"{'pass':<26} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} {'fetches':>8}")
+        burst_path = f'/img/SIX7-{args.images + 1}?w={args.width}'
+        latencies = []
+        threads = [threading.Thread(target=lambda: latencies.extend(timed(port, [burst_path])))
+                   for _ in range(args.burst)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(f'burst of {args.burst}, one image', latencies, time.perf_counter() - started, fetched())
+
+        before = fetched()
+        started = time.perf_counter()
+        latencies = timed(port, paths)
+        report('cold, one by one', latencies, time.perf_counter() - started, fetched() - before)
+
+        before = fetched()
+        latencies, errors, elapsed = drive(port, paths, args.concurrency, args.duration, {})
+        report('cached, memory', latencies, elapsed, fetched() - before)
+        if errors:
+            print(f'{errors} errors')
+    finally:
+        stop_server(process)
+
+    process = start_server(port, env)
+    try:
+        before = fetched()
+        started = time.perf_counter()
+        latencies = timed(port, paths)
+        report('after restart, disk', latencies, time.perf_counter() - started, fetched() - before)
+    finally:
+        stop_server(process)
+        upstream.stop()
+        images.stop()
+        directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark catalog memory: plain dicts against compact records
+
+Reports traced bytes per product for the product objects alone and, for the
+backend shape, for a whole catalog (products plus store, stats and search
+indexes). "dict" is the shape the servers used to keep: a dict per product,
+a dict per price and a list per features array. Both shapes share the same
+string objects, so the product rows count only what the representation costs.
+
+    python scripts/bench/bench_memory.py [--size 100000] [--catalog-size 20000]
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+sys.path.insert(0, os.path.join(HERE, '..', '..'))
+
+from catalogs import main_products, raw_products  # noqa: E402
+from ahat.feed_import import gc_paused  # noqa: E402
+from ahat.records import Record  # noqa: E402
+import server  # noqa: E402
+
+MAIN_FIELDS = ('id', 'title', 'category', 'current_price', 'original_price', 'rating', 'review_count', 'image_url',
+               'affiliate_url', 'ai_trending_score', 'features', 'shipping', 'warranty')
+
+
+def plain(value):
+    """The dict/list shape of a record, sharing its strings"""
+    if isinstance(value, Record):
+        return {name: plain(item) for name, item in value.items()}
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def traced(build):
+    """Bytes still allocated by ``build()`` while its result is alive"""
+    gc.collect()
+    tracemalloc.start()
+    with gc_paused():
+        result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100000, help='products for the per-record figures')
+    parser.add_argument('--catalog-size', type=int, default=20000, help='products for the whole-catalog figures')
+    args = parser.parse_args(argv)
+
+    # Imported lazily: main.py builds its own catalog at import time
+    from main import Product as MainProduct
+
+    main_source = list(main_products(args.size))
+    backend_records = server.normalize_products(raw_products(args.size))
+    rows = [
+        ('main.py products', lambda: [dict(p, features=list(p['features'])) for p in main_source],
+         lambda: [MainProduct.from_dict(p) for p in main_source], args.size),
+        ('backend products', lambda: [plain(p) for p in backend_records],
+         lambda: [server.Product.from_dict(plain(p)) for p in backend_records], args.size),
+    ]
+    subset = backend_records[:args.catalog_size]
+    rows.append(('backend catalog', lambda: server.build_catalog([plain(p) for p in subset]),
+                 lambda: server.build_catalog([server.Product.from_dict(plain(p)) for p in subset]),
+                 args.catalog_size))
+
+    print(f"{'':<18} {'products':>9} {'dict B/product':>15} {'record B/product':>17} {'saved':>6}")
+    for label, before, after, count in rows:
+        dict_bytes, record_bytes = traced(before) / count, traced(after) / count
+        print(f'{label:<18} {count:>9,} {dict_bytes:>15,.0f} {record_bytes:>17,.0f} '
+              f'{1 - record_bytes / dict_bytes:>6.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark the price history under hourly refreshes of a large catalog
+
+Records ``--days`` of hourly refreshes of ``--products`` products, a
+``--churn`` fraction of which change price each hour, into a log in a
+temporary directory. Reports the time per refresh, memory and log size per
+change, the time to reopen the log, and query latencies.
+
+    python scripts/bench/bench_price_history.py [--products 100000] [--days 30] [--churn 0.05]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from ahat.price_history import PriceHistory  # noqa: E402
+
+
+def memory_bytes(history):
+    """Bytes held by the history's containers (keys are shared with the catalog)"""
+    size = sum(sys.getsizeof(d) for d in (history._series, history._changed, history._ids))
+    for series in history._series.values():
+        size += sys.getsizeof(series) + sys.getsizeof(series[0]) + sys.getsizeof(series[1])
+    return size
+
+
+def timed(call, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--churn', type=float, default=0.05, help='fraction of products repriced each hour')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    keys = [f'B0{i:08d}' for i in range(args.products)]
+    prices = [round(rnd.uniform(15, 900), 2) for _ in keys]
+    changed_per_hour = int(args.products * args.churn)
+    start = int(time.time()) - args.days * 86400
+
+    workdir = tempfile.mkdtemp(prefix='ahat-prices-')
+    path = os.path.join(workdir, 'price_history.log')
+    history = PriceHistory()
+    history.open(path)
+    refreshes = []
+    try:
+        for hour in range(args.days * 24):
+            for i in rnd.sample(range(args.products), changed_per_hour):
+                prices[i] = round(prices[i] * rnd.uniform(0.7, 1.25), 2) or 0.01
+            began = time.perf_counter()
+            history.record(zip(keys, prices), at=start + hour * 3600)
+            refreshes.append(time.perf_counter() - began)
+        history.close()
+
+        points = history.points
+        print(f'{args.days * 24:,} hourly refreshes of {args.products:,} products, '
+              f'{changed_per_hour:,} repriced per hour: {points:,} price points')
+        print(f'record: median {statistics.median(refreshes) * 1000:.1f} ms, '
+              f'max {max(refreshes) * 1000:.1f} ms per refresh')
+        print(f'memory: {memory_bytes(history) / 2**20:.1f} MB '
+              f'({memory_bytes(history) / points:.1f} B/point); '
+              f'log: {os.path.getsize(path) / 2**20:.1f} MB ({os.path.getsize(path) / points:.1f} B/point)')
+
+        reopened = PriceHistory()
+        began = time.perf_counter()
+        reopened.open(path)
+        print(f'reopen: {time.perf_counter() - began:.2f} s for {reopened.points:,} points')
+        reopened.close()
+
+        now = start + (args.days * 24 - 1) * 3600 + 1
+        for hours in (1, 24, 168):
+            drops, elapsed = timed(lambda: history.drops(hours, 20, now=now))
+            print(f'drops in the last {hours:>3} h: {elapsed:8.2f} ms (top drop {drops[0].percent if drops else 0}%)')
+        _, elapsed = timed(lambda: [history.history(key) for key in keys[:1000]], 1)
+        print(f'history of one product: {elapsed / 1000 * 1000:.1f} µs')
+    finally:
+        history.close()
+        os.unlink(path)
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark backend/server.py throughput against its number of serving processes
+
+For each ``--processes`` count this starts the server against the local
+stand-in upstream (serving a synthetic page of ``--size`` products), then
+drives /api/products pages and /api/products/stats from ``--clients`` load
+generator processes (so the client is not limited to one core either), and
+reports throughput, latency and the memory of the whole process tree: RSS
+adds up pages the workers share, PSS splits them between the processes.
+
+Scaling needs cores: with fewer CPUs than server processes plus clients,
+throughput stays flat. The CPU count is printed with the results.
+
+    python scripts/bench/bench_processes.py [--processes 1,2,4] [--size 2000] [--duration 10]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from catalogs import products_page, raw_products  # noqa: E402
+from loadtest import ROOT, drive, free_port, get, percentile, products_paths  # noqa: E402
+from standin_upstream import StandinUpstream  # noqa: E402
+
+
+def tree_memory(pid):
+    """(RSS, PSS) in bytes summed over ``pid`` and its children (Linux only, else None)"""
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        return None, None
+    rss = pss = 0
+    for each in pids:
+        try:
+            with open(f'/proc/{each}/smaps_rollup') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        rss += int(fields['Rss'].split()[0]) * 1024
+        pss += int(fields['Pss'].split()[0]) * 1024
+    return rss, pss
+
+
+def client(job):
+    port, paths, threads, duration = job
+    latencies, errors, _ = drive(port, paths, threads, duration, {})
+    return latencies, errors
+
+
+def measure(processes, args, upstream, pool):
+    port = free_port()
+    env = dict(os.environ, AHAT_SOURCE_URL=upstream.url, AHAT_SNAPSHOT_DIR='', AHAT_PRICE_HISTORY_FILE='')
+    command = [sys.executable, 'server.py', '--port', str(port), '--processes', str(processes),
+               '--workers', str(args.workers)]
+    process = subprocess.Popen(command, cwd=os.path.join(ROOT, 'backend'), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if get(port, '/api/products/stats', timeout=5) == 200:
+                    break
+            except OSError:
+                pass
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError(f'server with {processes} processes did not start')
+            time.sleep(0.1)
+        paths = products_paths('backend', 20) + ['/api/products/stats']
+        # Warm every worker's response cache before measuring
+        drive(port, paths, args.concurrency, 1, {})
+        per_client = max(1, args.concurrency // args.clients)
+        started = time.perf_counter()
+        results = pool.map(client, [(port, paths, per_client, args.duration)] * args.clients)
+        elapsed = time.perf_counter() - started
+        memory = tree_memory(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    latencies = sorted(latency for own, _ in results for latency in own)
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99), \
+        sum(errors for _, errors in results), memory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', default='1,2,4', help='comma-separated process counts')
+    parser.add_argument('--size', type=int, default=2000, help='products on the stand-in page')
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 1, help='load generator processes')
+    parser.add_argument('--concurrency', type=int, default=32, help='connections across all clients')
+    parser.add_argument('--workers', type=int, default=8, help='request threads per server process')
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args(argv)
+
+    upstream = StandinUpstream(products_page(raw_products(args.size)))
+    upstream.start()
+    print(f'{os.cpu_count()} CPUs, {args.size:,} products, {args.clients} client processes, '
+          f'{args.concurrency} connections')
+    print(f"{'processes':>9} {'rps':>9} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'RSS MB':>7} {'PSS MB':>7}")
+    baseline = None
+    try:
+        with multiprocessing.get_context('fork').Pool(args.clients) as pool:
+            for processes in (int(n) for n in args.processes.split(',')):
+                rps, p50, p99, errors, (rss, pss) = measure(processes, args, upstream, pool)
+                baseline = baseline or rps
+                mb = lambda value: f'{value / 2**20:.0f}' if value else '-'  # noqa: E731
+                print(f'{processes:>9} {rps:>9.0f} {rps / baseline:>7.2f}x {p50 * 1000:>8.2f} {p99 * 1000:>8.2f} '
+                      f'{errors:>7} {mb(rss):>7} {mb(pss):>7}')
+    finally:
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark the full-text SearchIndex on a synthetic catalog
+
+Builds the index the way main.py does (title, brand, category, description,
+features) and reports build time and memory, then per query the first
+(cold) and warm latency next to a linear substring scan over every title,
+autocomplete latency, and the cost of catalog updates.
+
+    python scripts/bench/bench_search.py [--size 100000] [--repeat 5] [--updates 2000]
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from catalogs import main_products  # noqa: E402
+from ahat.search import SearchIndex  # noqa: E402
+
+QUERIES = ['wireless', 'sony headphones', 'kitchen', 'anker 4521', 'sony wireless pro headphones 4521',
+           'wireles headphnes', 'portable usb-c charger', 'zzzz']
+PREFIXES = ['w', 'wi', 'sony hea', 'anker power b']
+
+
+def new_index():
+    return SearchIndex(
+        key=lambda p: p['id'],
+        fields={
+            'title': (lambda p: p['title'], 3),
+            'brand': (lambda p: p['title'].split(' ', 1)[0], 2),
+            'category': (lambda p: p['category'], 2),
+            'description': (lambda p: p.get('description'), 1),
+            'features': (lambda p: p.get('features'), 1),
+        },
+    )
+
+
+def linear_scan(products, query):
+    words = query.lower().split()
+    return [p['id'] for p in products if all(word in p['title'].lower() for word in words)]
+
+
+def timed(call, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--updates', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    products = list(main_products(args.size))
+    index = new_index()
+    before = rss_mb()
+    start = time.perf_counter()
+    for product in products:
+        index.add(product)
+    print(f'{args.size} products indexed in {time.perf_counter() - start:.2f} s, '
+          f'peak RSS +{rss_mb() - before:.0f} MB')
+
+    print(f"{'query':<36} {'total':>8} {'first ms':>9} {'warm ms':>9} {'scan ms':>9}")
+    for query in QUERIES:
+        result, first = timed(lambda: index.search(query))
+        _, warm = timed(lambda: index.search(query), args.repeat)
+        _, scan = timed(lambda: linear_scan(products, query))
+        print(f'{query:<36} {result.total:>8} {first:>9.2f} {warm:>9.2f} {scan:>9.1f}')
+
+    print(f"{'suggest':<36} {'top':>18} {'warm ms':>9}")
+    for prefix in PREFIXES:
+        completions, warm = timed(lambda: index.suggest(prefix), args.repeat)
+        top = completions[0][0] if completions else '-'
+        print(f'{prefix:<36} {top:>18} {warm:>9.2f}')
+
+    updated = [dict(p, title=p['title'] + ' Refurbished') for p in products[:args.updates]]
+    _, elapsed = timed(lambda: [index.update(p) for p in updated])
+    print(f'{len(updated)} updates: {elapsed / len(updated) * 1000:.1f} µs each')
+    _, elapsed = timed(lambda: index.search('refurbished wireless'))
+    print(f'first query after updates: {elapsed:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark startup: a cold scrape against restoring a catalog snapshot
+
+Times each phase of getting a servable catalog into a fresh process, best of
+``--repeat`` runs:
+
+* cold scrape: fetch the page from the local stand-in upstream and extract
+  the products array, normalize, build the catalog (indexes, stats, search)
+* SQLite: read and decode a products-only snapshot (ahat.snapshot, as
+  main.py keeps and earlier versions of server.py saved), build the catalog
+* image: map a catalog image, as server.py saves snapshots, and open its
+  catalog; then answer a first page, search and top-K from it, since the
+  image is read on demand. server.py then builds a writable copy in the
+  background (materialize_catalogs), reported on its own line
+
+    python scripts/bench/bench_startup.py [--size 100000] [--delay 0.05] [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from catalogs import products_page, raw_products  # noqa: E402
+from standin_upstream import StandinUpstream  # noqa: E402
+from ahat.feed_import import gc_paused  # noqa: E402
+from ahat.http_client import UpstreamClient  # noqa: E402
+from ahat.catalog_image import CatalogImage, write_image  # noqa: E402
+from ahat.snapshot import load_snapshot, save_snapshot  # noqa: E402
+import server  # noqa: E402
+
+
+def best(phases, runs):
+    """Per-phase minimum over runs of ``phases()``, which returns ``{phase: seconds}``"""
+    timings = [phases() for _ in range(runs)]
+    return {phase: min(t[phase] for t in timings) for phase in timings[0]}
+
+
+def report(label, timings):
+    total = sum(timings.values())
+    parts = ', '.join(f'{phase} {seconds * 1000:,.0f}' for phase, seconds in timings.items())
+    print(f'{label:<12} {total * 1000:>10,.0f} ms   ({parts})')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--delay', type=float, default=0.05, help='simulated upstream latency in seconds')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    upstream = StandinUpstream(products_page(raw_products(args.size)), delay=args.delay).start()
+    workdir = tempfile.mkdtemp(prefix='ahat-startup-')
+    path = os.path.join(workdir, 'live.sqlite3')
+    image_path = os.path.join(workdir, 'live.catalog')
+
+    def cold_scrape():
+        client = UpstreamClient(headers={'User-Agent': 'ahat-bench'})
+        try:
+            with gc_paused():
+                started = time.perf_counter()
+                raw, _ = client.get(upstream.url, server.extract_products)
+                fetched = time.perf_counter()
+                products = server.normalize_products(raw)
+                normalized = time.perf_counter()
+                server.build_catalog(products)
+                built = time.perf_counter()
+        finally:
+            client.close()
+        return {'fetch+extract': fetched - started, 'normalize': normalized - fetched, 'build': built - normalized}
+
+    def restore():
+        with gc_paused():
+            started = time.perf_counter()
+            snapshot = load_snapshot(path)
+            loaded = time.perf_counter()
+            server.build_catalog(snapshot.products)
+            built = time.perf_counter()
+        return {'read+decode': loaded - started, 'build': built - loaded}
+
+    later = []
+
+    def restore_image():
+        with gc_paused():
+            started = time.perf_counter()
+            catalog = server.open_catalog(CatalogImage(image_path))
+            opened = time.perf_counter()
+            catalog.store.query(sort='price', limit=20)
+            catalog.search.search('wireless headphones')
+            catalog.rankings.top('trending', 10)
+            served = time.perf_counter()
+            server.build_catalog(catalog.store.all())
+            later.append(time.perf_counter() - served)
+        return {'map+open': opened - started, 'first requests': served - opened}
+
+    try:
+        products = server.normalize_products(raw_products(args.size))
+        started = time.perf_counter()
+        save_snapshot(path, products, catalog='live')
+        saved = time.perf_counter() - started
+        catalog = server.build_catalog(products)
+        started = time.perf_counter()
+        write_image(image_path, catalog.store, catalog.stats, server.make_search_index(), server.make_rankings(),
+                    sync=True)
+        written = time.perf_counter() - started
+        print(f'{args.size:,} products: page {len(upstream.page) / 2**20:.1f} MB, '
+              f'SQLite snapshot {os.path.getsize(path) / 2**20:.1f} MB written in {saved * 1000:,.0f} ms, '
+              f'image {os.path.getsize(image_path) / 2**20:.1f} MB in {written * 1000:,.0f} ms; '
+              f'{args.delay * 1000:g} ms simulated upstream latency')
+        report('cold scrape', best(cold_scrape, args.repeat))
+        report('SQLite', best(restore, args.repeat))
+        report('image', best(restore_image, args.repeat))
+        print(f"{'then':<12} {min(later) * 1000:>10,.0f} ms   (writable copy, in the background)")
+    finally:
+        upstream.stop()
+        os.unlink(path)
+        os.unlink(image_path)
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark top-K rankings against scoring and sorting the catalog per request
+
+Builds the backend's rankings (trending, deal, discount, rating) over a
+synthetic catalog, then reports the top-K latency overall and for one
+category next to the per-request scan (score every product, sort, slice),
+and the cost of the catalog updates that keep the rankings current.
+
+    python scripts/bench/bench_top.py [--size 100000] [--k 20] [--updates 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from catalogs import raw_products  # noqa: E402
+from ahat.rankings import Rankings  # noqa: E402
+import server  # noqa: E402
+
+
+def timed(call, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = call()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def scan_top(products, score, k, category=None):
+    """What a request cost before: score every product, then sort"""
+    if category is not None:
+        products = [p for p in products if p['category'] == category]
+    return sorted(products, key=lambda p: -score(p))[:k]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    products = server.normalize_products(raw_products(args.size))
+    rankings = Rankings(key=lambda p: p['id'], category=lambda p: p['category'], scores=server.RANKINGS)
+    began = time.perf_counter()
+    for product in products:
+        rankings.add(product)
+    category = products[0]['category']
+    for name in rankings.names:
+        rankings.top(name, 1)
+        rankings.top(name, 1, category)
+    print(f'{args.size:,} products, {len(rankings.names)} rankings: built in {time.perf_counter() - began:.2f} s')
+
+    print(f"{'ranking':<10} {'scope':<12} {'top-K ms':>9} {'scan ms':>9}")
+    for name, score in server.RANKINGS.items():
+        for scope in (None, category):
+            top, fast = timed(lambda: rankings.top(name, args.k, scope), args.repeat)
+            scanned, slow = timed(lambda: scan_top(products, score, args.k, scope), max(1, args.repeat // 10))
+            assert [score(p) for p in top] == [score(p) for p in scanned]
+            print(f'{name:<10} {scope or "catalog":<12} {fast:>9.3f} {slow:>9.1f}')
+
+    rnd = random.Random(0)
+    changed = []
+    for product in rnd.sample(products, args.updates):
+        rating = round(rnd.uniform(3, 5), 1)
+        changed.append(dict(product, rating=rating, trending_score=min(100, int(rating * 20))))
+    began = time.perf_counter()
+    for product in changed:
+        rankings.add(product)
+        rankings.top('trending', args.k)
+    elapsed = time.perf_counter() - began
+    print(f'update + top-K read: {elapsed / args.updates * 1e6:.0f} µs per change ({args.updates:,} changes)')
+
+
+if __name__ == '__main__':
+    main()
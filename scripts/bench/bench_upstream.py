@@ -0,0 +1,80 @@
+"""Benchmark upstream refreshes against the local stand-in
+
+Runs the same number of catalog refreshes three ways and reports connections
+opened, full responses, 304s and time per refresh:
+
+* ``requests.get``: a fresh connection and a full parse every time (the old path)
+* ``pooled``: the shared UpstreamClient with validators dropped before each fetch
+* ``pooled + conditional``: the UpstreamClient as the server uses it
+
+    python scripts/bench/bench_upstream.py [--refreshes 200] [--delay 0.002] [--fixture page.html]
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'backend'))
+
+from standin_upstream import DEFAULT_FIXTURE, StandinUpstream  # noqa: E402
+from ahat.http_client import UpstreamClient  # noqa: E402
+import server  # noqa: E402
+
+
+def run(label, refresh, upstream, refreshes):
+    upstream.connections = upstream.full = upstream.not_modified = 0
+    start = time.perf_counter()
+    for _ in range(refreshes):
+        catalog = refresh()
+        assert catalog is not None and len(catalog.store)
+    elapsed = time.perf_counter() - start
+    print(f'{label:<22} {upstream.connections:>11} {upstream.full:>6} {upstream.not_modified:>6} '
+          f'{elapsed / refreshes * 1000:>10.2f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--refreshes', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.002, help='simulated upstream latency in seconds')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE)
+    args = parser.parse_args(argv)
+
+    with open(args.fixture, 'rb') as f:
+        upstream = StandinUpstream(f.read(), delay=args.delay).start()
+    headers = {'User-Agent': 'ahat-bench'}
+
+    def legacy():
+        response = requests.get(upstream.url, headers=headers, timeout=10)
+        response.raise_for_status()
+        return server.parse_live_catalog(response.content)
+
+    pooled = UpstreamClient(headers=headers)
+
+    def unconditional():
+        pooled.forget()
+        return pooled.get(upstream.url, server.parse_live_catalog)[0]
+
+    conditional = UpstreamClient(headers=headers)
+
+    def revalidated():
+        return conditional.get(upstream.url, server.parse_live_catalog)[0]
+
+    print(f'{args.refreshes} refreshes of {os.path.basename(args.fixture)}, '
+          f'{args.delay * 1000:g} ms simulated upstream latency')
+    print(f"{'client':<22} {'connections':>11} {'200s':>6} {'304s':>6} {'ms/refresh':>10}")
+    try:
+        run('requests.get', legacy, upstream, args.refreshes)
+        run('pooled', unconditional, upstream, args.refreshes)
+        run('pooled + conditional', revalidated, upstream, args.refreshes)
+    finally:
+        pooled.close()
+        conditional.close()
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Synthetic catalogs for benchmarks
+
+* ``main_products``: records in the shape of main.py's ``PRODUCTS``
+* ``raw_products``: records as scraped from the website (and as normalized by
+  backend/server.py), i.e. what the ``const products = [...]`` array holds
+
+Generation is deterministic for a given seed and streams, so catalogs of a
+million products can be written without holding them in memory.
+
+    python scripts/bench/catalogs.py main 100000 /tmp/products.ndjson
+"""
+import argparse
+import json
+import random
+
+BRANDS = ['Anker', 'Samsung', 'Logitech', 'Apple', 'Oral-B', 'Canon', 'Xiaomi', 'Soundcore', 'Sony',
+          'JBL', 'TP-Link', 'Philips', 'Garmin', 'Fitbit', 'Bose', 'Kindle', 'Razer', 'Dyson']
+CATEGORIES = ['Audio', 'Storage', 'Electronics', 'Wearables', 'Computer Accessories', 'Health',
+              'Cameras', 'Phone Accessories', 'Toys', 'Home', 'Kitchen', 'Gaming']
+BADGES = ["Editor's Pick", 'Trending', 'Best Seller', 'Value Pick', 'Performance Pick', 'Hot Deal']
+WORDS = ['Wireless', 'Portable', 'Pro', 'Mini', 'Smart', 'Ultra', 'Noise Cancelling', 'Fast Charging',
+         'Bluetooth', 'USB-C', 'Waterproof', 'Compact', 'Rechargeable', '4K', 'Ergonomic', 'Slim']
+NOUNS = ['Headphones', 'SSD', 'Power Bank', 'Smartwatch', 'Mouse', 'Keyboard', 'Toothbrush', 'Camera',
+         'Speaker', 'Earbuds', 'Charger', 'Drone', 'Router', 'Monitor', 'Tracker', 'Hub']
+
+
+def _asin(rnd):
+    return 'B0' + ''.join(rnd.choice('ABCDEFGHJKLMNPQRSTUVWXYZ0123456789') for _ in range(8))
+
+
+def _title(rnd, brand):
+    return f"{brand} {' '.join(rnd.sample(WORDS, 2))} {rnd.choice(NOUNS)} {rnd.randint(100, 9999)}"
+
+
+def main_products(n, seed=0):
+    """Yield ``n`` products shaped like main.py's PRODUCTS"""
+    rnd = random.Random(seed)
+    for i in range(n):
+        brand = rnd.choice(BRANDS)
+        original = round(rnd.uniform(15, 900), 2)
+        current = round(original * rnd.uniform(0.5, 1.0), 2)
+        yield {
+            'id': i + 1,
+            'title': _title(rnd, brand),
+            'category': rnd.choice(CATEGORIES),
+            'current_price': current,
+            'original_price': original,
+            'rating': round(rnd.uniform(3.5, 5.0), 1),
+            'review_count': rnd.randint(0, 50000),
+            'image_url': f'https://m.media-amazon.com/images/I/{rnd.randint(10**9, 10**10)}._AC_SL1500_.jpg',
+            'affiliate_url': f'https://www.amazon.com.au/dp/{_asin(rnd)}?tag=sixsevendeals-22',
+            'ai_trending_score': rnd.randint(40, 100),
+            'features': [f"{rnd.choice(WORDS)} {rnd.choice(NOUNS).lower()} support" for _ in range(5)],
+            'shipping': 'Free shipping in Australia',
+            'warranty': f'{rnd.randint(1, 3)}-year warranty',
+        }
+
+
+def raw_products(n, seed=0):
+    """Yield ``n`` products as they appear in the website's products array"""
+    rnd = random.Random(seed)
+    for _ in range(n):
+        brand = rnd.choice(BRANDS)
+        original = round(rnd.uniform(15, 900), 2)
+        current = round(original * rnd.uniform(0.5, 1.0), 2)
+        rating = round(rnd.uniform(3.5, 5.0), 1)
+        reviews = rnd.randint(0, 50000)
+        yield {
+            'name': _title(rnd, brand),
+            'description': f"✅ {rating}★ from {reviews:,}+ Aussie reviews | Ships from Sydney.",
+            'price': f'${current:,.2f}',
+            'originalPrice': f'${original:,.2f}',
+            'discount': f'{round((original - current) / original * 100)}% OFF',
+            'image': f'https://m.media-amazon.com/images/I/{rnd.randint(10**9, 10**10)}._AC_SX522_.jpg',
+            'link': f'https://www.amazon.com.au/dp/{_asin(rnd)}?tag=sixsevendeals-22',
+            'badge': rnd.choice(BADGES),
+            'rating': str(rating),
+            'reviewCount': f'{reviews:,}+',
+        }
+
+
+SHAPES = {'main': main_products, 'raw': raw_products}
+
+
+def write_ndjson(products, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for product in products:
+            f.write(json.dumps(product, ensure_ascii=False))
+            f.write('\n')
+
+
+def products_page(products):
+    """A minimal homepage embedding ``products`` the way the website does"""
+    body = json.dumps(list(products), ensure_ascii=False)
+    return f'<html><body><script>\nconst products = {body};\n</script></body></html>'.encode()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic catalog as NDJSON')
+    parser.add_argument('shape', choices=SHAPES)
+    parser.add_argument('size', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    write_ndjson(SHAPES[args.shape](args.size, args.seed), args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Load test both API servers against synthetic catalogs
+
+For every server and catalog size this starts the server in a subprocess,
+drives /api/products, /api/products/categories and /api/products/stats with
+keep-alive clients at a fixed concurrency, and reports throughput, latency
+percentiles and the server's RSS. Results can be written as JSON and compared
+with an earlier run to spot regressions between commits.
+
+* main.py loads its catalog from AHAT_PRODUCTS_FILE (synthetic NDJSON).
+* backend/server.py never reaches the real website: AHAT_SOURCE_URL points at a
+  local stand-in upstream serving a synthetic products page. Catalogs above
+  --page-limit are loaded with --import instead (the stand-in still answers).
+
+The load generator runs in this process, so on a small machine it competes
+with the server for CPU; compare runs made on the same machine.
+
+    python scripts/bench/loadtest.py --sizes 1000,10000,100000 --concurrency 16 --duration 10 \\
+        --output results.json [--baseline previous.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.normpath(os.path.join(HERE, '..', '..'))
+sys.path.insert(0, HERE)
+
+from catalogs import main_products, products_page, raw_products, write_ndjson  # noqa: E402
+from standin_upstream import StandinUpstream  # noqa: E402
+
+ENDPOINTS = ('products', 'categories', 'stats')
+
+
+def products_paths(server, variants):
+    """A rotating set of product pages, so the products endpoint is not a single cached query"""
+    paths = []
+    for k in range(variants):
+        if server == 'main':
+            paths.append(f'/api/products?limit=20&offset={k * 20}' + ('&sort=price' if k % 2 else ''))
+        else:
+            paths.append(f'/api/products?limit=20&page={k + 1}' + ('&sort=price' if k % 2 else ''))
+    return paths
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get(port, path, timeout=600):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def rss(pid):
+    """Current and peak resident set size of a process in bytes (Linux only, else None)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None, None
+    kib = lambda name: int(fields[name].split()[0]) * 1024 if name in fields else None  # noqa: E731
+    return kib('VmRSS'), kib('VmHWM')
+
+
+class ServerProcess:
+    """One API server in a subprocess, ready to take requests"""
+
+    def __init__(self, server, size, args, workdir, upstream):
+        self.port = free_port()
+        env = dict(os.environ)
+        if server == 'main':
+            path = os.path.join(workdir, f'main-{size}.ndjson')
+            write_ndjson(main_products(size, args.seed), path)
+            env['AHAT_PRODUCTS_FILE'] = path
+            command = [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                       '--port', str(self.port), '--log-level', 'warning']
+            cwd, self.ready_path = ROOT, '/health'
+        else:
+            env.update(AHAT_SOURCE_URL=upstream.url, AHAT_FEED_TTL='86400', AHAT_FEED_STALE_TTL='86400')
+            command = [sys.executable, 'server.py', '--port', str(self.port),
+                       '--engine', args.engine, '--workers', str(args.workers)]
+            if size <= args.page_limit:
+                upstream.set_page(products_page(raw_products(size, args.seed)))
+            else:
+                upstream.set_page(products_page(raw_products(1, args.seed)))
+                path = os.path.join(workdir, f'raw-{size}.ndjson')
+                write_ndjson(raw_products(size, args.seed), path)
+                command += ['--import', path]
+            cwd, self.ready_path = os.path.join(ROOT, 'backend'), '/api'
+
+        # Access logs go to a file, not the terminal; the tail is shown if the server dies
+        self.log_path = os.path.join(workdir, f'{server}-{size}.log')
+        started = time.perf_counter()
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self._wait_ready(args.startup_timeout)
+        self.startup_seconds = time.perf_counter() - started
+        # The first catalog request pays for the scrape (or the first cache fill)
+        started = time.perf_counter()
+        for endpoint in ENDPOINTS:
+            get(self.port, products_paths(server, 1)[0] if endpoint == 'products' else f'/api/products/{endpoint}')
+        self.first_response_seconds = time.perf_counter() - started
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                with open(self.log_path, 'rb') as log:
+                    tail = log.read()[-2000:].decode(errors='replace')
+                raise RuntimeError(f'server exited with status {self.process.returncode}:\n{tail}')
+            try:
+                if get(self.port, self.ready_path, timeout=2) == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f'server not ready after {timeout}s')
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def drive(port, paths, concurrency, duration, headers):
+    """Run keep-alive clients against ``paths`` for ``duration`` seconds"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def client(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        k = i
+        mine = latencies[i]
+        while time.perf_counter() < deadline:
+            path = paths[k % len(paths)]
+            k += concurrency
+            sent = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            if ok:
+                mine.append(time.perf_counter() - sent)
+            else:
+                errors[i] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    merged = sorted(latency for own in latencies for latency in own)
+    return merged, sum(errors), elapsed
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(server, size, endpoint, latencies, errors, elapsed, process):
+    ms = lambda value: None if value is None else round(value * 1000, 3)  # noqa: E731
+    current, peak = rss(process.process.pid)
+    return {
+        'server': server,
+        'size': size,
+        'endpoint': endpoint,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'rss_bytes': current,
+        'peak_rss_bytes': peak,
+        'startup_seconds': round(process.startup_seconds, 3),
+        'first_response_seconds': round(process.first_response_seconds, 3),
+    }
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_row(result):
+    mb = f"{result['rss_bytes'] / 2**20:.0f}" if result['rss_bytes'] else '-'
+    print(f"{result['server']:<8} {result['size']:>8} {result['endpoint']:<11} {result['rps']:>9} "
+          f"{result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {result['errors']:>6} {mb:>7}")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r['server'], r['size'], r['endpoint']): r for r in json.load(f)['results']}
+    print(f'\nagainst {baseline_path}')
+    print(f"{'server':<8} {'size':>8} {'endpoint':<11} {'rps':>9} {'p99':>9}")
+    for result in results:
+        before = baseline.get((result['server'], result['size'], result['endpoint']))
+        if not before or not before['rps'] or not before['p99_ms']:
+            continue
+        change = lambda new, old: f'{(new - old) / old * 100:+.1f}%'  # noqa: E731
+        print(f"{result['server']:<8} {result['size']:>8} {result['endpoint']:<11} "
+              f"{change(result['rps'], before['rps']):>9} {change(result['p99_ms'], before['p99_ms']):>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--servers', default='main,backend', help='comma-separated: main, backend')
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated catalog sizes')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of load per endpoint')
+    parser.add_argument('--variants', type=int, default=10, help='distinct /api/products queries to rotate')
+    parser.add_argument('--gzip', action='store_true', help='send Accept-Encoding: gzip')
+    parser.add_argument('--engine', default='threaded', help='backend/server.py engine')
+    parser.add_argument('--workers', type=int, default=16, help='backend/server.py workers')
+    parser.add_argument('--page-limit', type=int, default=100000,
+                        help='largest catalog the stand-in serves as a page; bigger ones are imported')
+    parser.add_argument('--startup-timeout', type=float, default=900)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    servers = args.servers.split(',')
+    sizes = [int(size) for size in args.sizes.split(',')]
+    endpoints = args.endpoints.split(',')
+    headers = {'Accept-Encoding': 'gzip'} if args.gzip else {}
+    upstream = StandinUpstream(b'').start()
+    results = []
+
+    print(f"{'server':<8} {'size':>8} {'endpoint':<11} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'errors':>6} {'RSS MB':>7}")
+    try:
+        with tempfile.TemporaryDirectory(prefix='ahat-bench-') as workdir:
+            for server in servers:
+                for size in sizes:
+                    process = ServerProcess(server, size, args, workdir, upstream)
+                    try:
+                        for endpoint in endpoints:
+                            paths = (products_paths(server, args.variants) if endpoint == 'products'
+                                     else [f'/api/products/{endpoint}'])
+                            latencies, errors, elapsed = drive(process.port, paths, args.concurrency,
+                                                               args.duration, headers)
+                            result = summarize(server, size, endpoint, latencies, errors, elapsed, process)
+                            results.append(result)
+                            print_row(result)
+                    finally:
+                        process.stop()
+    finally:
+        upstream.stop()
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nwrote {args.output}')
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Local stand-in for an image CDN
+
+Answers every path with a generated grayscale PNG (no imaging library
+needed). The image is square, ``--size`` pixels wide unless the file name
+carries an Amazon-style size modifier (``name._AC_SX160_.jpg`` is 160 wide),
+as the real CDN resizes on request. Paths containing "missing" get a 404.
+Requests are counted per path, so clients can be checked for fetching each
+image once.
+
+    python scripts/bench/standin_images.py --port 8798 [--size 1500] [--delay 0.05]
+"""
+import argparse
+import hashlib
+import http.server
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+_MODIFIER = re.compile(r'\._AC_[A-Z]{2}(\d+)_\.')
+
+
+def png(width, height, shade=0):
+    """A ``width`` x ``height`` 8-bit grayscale PNG with a horizontal gradient"""
+    row = b'\x00' + bytes((x * 255 // max(1, width - 1) + shade) % 256 for x in range(width))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height, 6))
+            + chunk(b'IEND', b''))
+
+
+class StandinImages:
+    """A threaded HTTP server of generated images, with per-path request counters"""
+
+    def __init__(self, port=0, size=1500, delay=0.0):
+        self.size = size
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self._images = {}
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f'http://127.0.0.1:{self.port}'
+        self._thread = None
+
+    def image(self, path):
+        """The PNG served at ``path``; the same path always gets the same bytes"""
+        with self.lock:
+            body = self._images.get(path)
+            if body is None:
+                match = _MODIFIER.search(path)
+                width = int(match.group(1)) if match else self.size
+                shade = hashlib.blake2b(path.encode(), digest_size=1).digest()[0]
+                body = self._images[path] = png(width, width, shade)
+            return body
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        images = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if images.delay:
+                    time.sleep(images.delay)
+                with images.lock:
+                    images.requests[self.path] += 1
+                if 'missing' in self.path:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = images.image(self.path)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8798)
+    parser.add_argument('--size', type=int, default=1500, help='width and height of unsized images')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    args = parser.parse_args(argv)
+
+    images = StandinImages(args.port, args.size, args.delay)
+    print(f'Stand-in images at {images.url}/<any path>')
+    try:
+        images.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    images.httpd.server_close()
+    print(f'{sum(images.requests.values())} requests for {len(images.requests)} paths')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Local stand-in for the upstream website
+
+Serves one page (by default the saved homepage fixture) over keep-alive
+HTTP/1.1 with an ETag and Last-Modified, answers conditional requests with 304,
+and counts connections and responses so clients can be checked for connection
+reuse and revalidation.
+
+    python scripts/bench/standin_upstream.py --port 8799 [--fixture page.html] [--delay 0.05]
+"""
+import argparse
+import hashlib
+import http.server
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FIXTURE = os.path.join(HERE, 'fixtures', 'homepage.html')
+
+
+class StandinUpstream:
+    """A threaded HTTP server for one page, with request counters"""
+
+    def __init__(self, page, port=0, delay=0.0, validators=True):
+        self.delay = delay
+        self.validators = validators
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.full = 0
+        self.not_modified = 0
+        self.set_page(page)
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f'http://127.0.0.1:{self.port}/'
+        self._thread = None
+
+    def set_page(self, page):
+        """Replace the page; clients holding the old validators get a 200 again"""
+        with self.lock:
+            self.page = page
+            self.etag = '"%s"' % hashlib.blake2b(page, digest_size=8).hexdigest()
+            # Whole seconds, like the header, and strictly newer than any earlier page
+            self.modified = max(int(time.time()), getattr(self, 'modified', 0) + 1)
+
+    @property
+    def requests(self):
+        return self.full + self.not_modified
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with upstream.lock:
+                    upstream.connections += 1
+
+            def do_GET(self):
+                if upstream.delay:
+                    time.sleep(upstream.delay)
+                with upstream.lock:
+                    page, etag, modified = upstream.page, upstream.etag, upstream.modified
+                    if upstream.validators and self.not_modified(etag, modified):
+                        upstream.not_modified += 1
+                        status = 304
+                    else:
+                        upstream.full += 1
+                        status = 200
+                self.send_response(status)
+                if upstream.validators:
+                    self.send_header('ETag', etag)
+                    self.send_header('Last-Modified', formatdate(modified, usegmt=True))
+                if status == 304:
+                    self.end_headers()
+                    return
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def not_modified(self, etag, modified):
+                if_none_match = self.headers.get('If-None-Match')
+                if if_none_match is not None:
+                    return etag in [tag.strip() for tag in if_none_match.split(',')]
+                if_modified_since = self.headers.get('If-Modified-Since')
+                if if_modified_since:
+                    try:
+                        return parsedate_to_datetime(if_modified_since).timestamp() >= modified
+                    except (TypeError, ValueError):
+                        return False
+                return False
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--no-validators', action='store_true', help='send neither ETag nor Last-Modified')
+    args = parser.parse_args(argv)
+
+    with open(args.fixture, 'rb') as f:
+        upstream = StandinUpstream(f.read(), args.port, args.delay, not args.no_validators)
+    print(f'Stand-in upstream at {upstream.url} serving {args.fixture}')
+    try:
+        upstream.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    upstream.httpd.server_close()
+    print(f'{upstream.connections} connections, {upstream.full} full responses, {upstream.not_modified} 304s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+
+from backend.ahat.clicks import LOG_PERIOD, ClickTracker, log_file
+
+DAY = 20000 * LOG_PERIOD
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_a_click_expires_with_its_bucket():
+    clock = Clock(9)
+    tracker = ClickTracker(window=100, buckets=10, clock=clock)
+    tracker.record('a')
+    clock.now = 15
+    tracker.record('a')
+    tracker.flush()
+    assert tracker.clicks('a') == 2
+    assert tracker.take_changed() == {'a'}
+
+    # The first click's bucket ends at 10, so it stops counting at 100, 91 seconds after it was made
+    clock.now = 99.9
+    tracker.flush()
+    assert tracker.clicks('a') == 2
+    clock.now = 100
+    tracker.flush()
+    assert tracker.clicks('a') == 1
+    clock.now = 110
+    tracker.flush()
+    assert (tracker.clicks('a'), len(tracker), tracker.counts()) == (0, 0, {})
+    assert tracker.take_changed() == {'a'}
+
+
+def test_clicks_past_capacity_are_dropped():
+    tracker = ClickTracker(capacity=2, clock=Clock(0))
+    for key in ('a', 'b', 'c', 'bad\tkey'):
+        tracker.record(key)
+    assert tracker.flush() == 1
+    assert (tracker.counts(), tracker.skipped, tracker.dropped) == ({'c': 1}, 1, 2)
+
+
+def test_log_rotates_daily_and_deletes_expired_days(tmp_path):
+    path = str(tmp_path / 'clicks.log')
+    clock = Clock(DAY + LOG_PERIOD - 60)
+    tracker = ClickTracker(window=3600, buckets=6, clock=clock)
+    assert tracker.open(path) == 0
+    tracker.record('a')
+    tracker.flush()
+    clock.now = DAY + LOG_PERIOD + 60
+    tracker.record('b')
+    tracker.flush()
+    assert sorted(os.listdir(tmp_path)) == ['clicks.2024-10-04.log', 'clicks.2024-10-05.log']
+    assert log_file(path, DAY // LOG_PERIOD) == str(tmp_path / 'clicks.2024-10-04.log')
+
+    # A second process replays the window from both files, and counts what the first appends after
+    other = ClickTracker(window=3600, buckets=6, clock=clock)
+    assert other.open(path) == 2
+    tracker.record('b')
+    tracker.flush()
+    other.flush()
+    assert other.counts() == {'a': 1, 'b': 2}
+
+    # Once every click of a day has expired (with some slack), its file goes
+    clock.now = DAY + LOG_PERIOD + 3600 + 300
+    tracker.flush()
+    assert sorted(os.listdir(tmp_path)) == ['clicks.2024-10-05.log']
+    assert tracker.counts() == {}
+    tracker.close()
+    other.close()
+
+
+def test_reopening_replays_only_the_window(tmp_path):
+    path = str(tmp_path / 'clicks.log')
+    clock = Clock(DAY)
+    tracker = ClickTracker(window=3600, buckets=6, clock=clock)
+    tracker.open(path)
+    tracker.record('old')
+    tracker.flush()
+    clock.now = DAY + 3000
+    tracker.record('new')
+    tracker.flush()
+    tracker.close()
+
+    clock.now = DAY + 4000
+    reopened = ClickTracker(window=3600, buckets=6, clock=clock)
+    reopened.open(path)
+    assert reopened.counts() == {'new': 1}
+    reopened.close()
@@ -0,0 +1,69 @@
+import os
+
+from backend.ahat.images import ImageCache, make_thumbnail
+
+
+def thumbnail(fill, size=100, content_type='image/jpeg'):
+    return make_thumbnail(fill.encode() * size, content_type)
+
+
+def files(directory):
+    return sorted(name for name in os.listdir(directory))
+
+
+def test_memory_evicts_least_recently_used():
+    cache = ImageCache(memory_bytes=250)
+    cache.put('a', thumbnail('a'))
+    cache.put('b', thumbnail('b'))
+    assert cache.get('a') == thumbnail('a')
+    cache.put('c', thumbnail('c'))
+    assert (cache.get('b'), len(cache), cache.memory_size) == (None, 2, 200)
+    # Replacing an entry counts its new size only, and a thumbnail larger than the whole LRU is not kept
+    cache.put('a', thumbnail('a', 50))
+    cache.put('big', thumbnail('x', 300))
+    assert (cache.get('big'), cache.memory_size) == (None, 150)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_disk_evicts_least_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path), memory_bytes=0, disk_bytes=250)
+    cache.put('a', thumbnail('a'))
+    cache.put('b', thumbnail('b', content_type='image/png'))
+    assert cache.get('a') == thumbnail('a')
+    cache.put('c', thumbnail('c'))
+    assert cache.get('b') is None
+    assert cache.get('c') == thumbnail('c')
+    assert (cache.disk_size, cache.disk_hits, len(files(tmp_path))) == (200, 2, 2)
+
+
+def test_disk_only_entries_stay_out_of_memory(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    cache.put('original', thumbnail('o'), memory=False)
+    assert cache.get('original', memory=False) == thumbnail('o')
+    assert (len(cache), cache.memory_size, cache.disk_hits) == (0, 0, 1)
+    cache.get('original')
+    assert len(cache) == 1
+
+
+def test_directory_is_reused_oldest_first_out(tmp_path):
+    first = ImageCache(str(tmp_path))
+    for at, key in enumerate('abc'):
+        first.put(key, thumbnail(key))
+        name, = (name for name in files(tmp_path) if name.startswith(first._hash(key)))
+        os.utime(tmp_path / name, (1000 + at, 1000 + at))
+
+    second = ImageCache(str(tmp_path), disk_bytes=200)
+    assert (second.disk_size, len(files(tmp_path))) == (200, 2)
+    assert [second.get(key) for key in 'abc'] == [None, thumbnail('b'), thumbnail('c')]
+
+
+def test_files_written_by_another_process_are_found(tmp_path):
+    writer = ImageCache(str(tmp_path))
+    reader = ImageCache(str(tmp_path), memory_bytes=0)
+    writer.put('a', thumbnail('a', content_type='image/webp'))
+    assert reader.get('a') == thumbnail('a', content_type='image/webp')
+    assert reader.disk_size == 100
+    # Removed by the other process meanwhile: a miss, and forgotten
+    os.unlink(tmp_path / files(tmp_path)[0])
+    assert reader.get('a') is None
+    assert (reader.disk_size, reader.misses) == (0, 1)
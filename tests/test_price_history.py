@@ -0,0 +1,63 @@
+import pytest
+
+from backend.ahat.price_history import PriceHistory, PricePoint
+
+
+def write_log(path):
+    """A log of two refreshes; returns the size after each"""
+    history = PriceHistory()
+    history.open(path)
+    history.record([('a', 10.0), ('b', 5.0)], at=100)
+    first = path.stat().st_size
+    # The second refresh defines a new key, so its tail is a K record then a B record
+    history.record([('a', 8.0), ('c', 3.0)], at=200)
+    history.close()
+    return first, path.stat().st_size
+
+
+def test_a_torn_last_record_is_dropped_and_cut_off(tmp_path):
+    path = tmp_path / 'prices.log'
+    first, full = write_log(path)
+    data = path.read_bytes()
+    # A complete definition of 'c' before a torn batch is kept; its id stays valid
+    key_record = first + len(b'K') + 2 + len(b'c')
+    for size in range(first, full):
+        path.write_bytes(data[:size])
+        history = PriceHistory()
+        assert history.open(path) == 2
+        assert history.history('a') == [PricePoint(100, 10.0)]
+        assert 'c' not in history
+        assert path.stat().st_size == (first if size < key_record else key_record)
+        # Appends carry on from the last complete record, and survive a reopen
+        history.record([('c', 4.0)], at=300)
+        history.close()
+        reopened = PriceHistory()
+        assert reopened.open(path) == 3
+        assert reopened.history('c') == [PricePoint(300, 4.0)]
+        reopened.close()
+
+
+def test_a_reader_leaves_a_torn_record_for_its_writer(tmp_path):
+    path = tmp_path / 'prices.log'
+    first, full = write_log(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:full - 3])
+    reader = PriceHistory()
+    assert reader.open(path, readonly=True) == 2
+    assert path.stat().st_size == full - 3
+    with open(path, 'ab') as f:
+        f.write(data[full - 3:])
+    assert reader.catch_up() == 2
+    assert reader.history('a') == [PricePoint(100, 10.0), PricePoint(200, 8.0)]
+    assert reader.history('c') == [PricePoint(200, 3.0)]
+    with pytest.raises(ValueError):
+        reader.record([('a', 1.0)])
+    reader.close()
+
+
+def test_a_foreign_file_is_not_replayed(tmp_path):
+    path = tmp_path / 'prices.log'
+    path.write_bytes(b'not a log')
+    with pytest.raises(ValueError, match='not a price history log'):
+        PriceHistory().open(path)
+    assert path.read_bytes() == b'not a log'
@@ -0,0 +1,81 @@
+import gzip
+
+import pytest
+
+from backend.ahat.response_cache import Representation, ResponseCache, accepts_gzip, canonical_query
+
+LARGE = b'{"products": [' + b'{"title": "thing"}, ' * 200 + b'{}]}'
+
+
+def test_small_bodies_are_never_compressed():
+    representation = Representation(b'{}')
+    assert representation.gzip_body is None
+    assert representation.select('gzip') == (b'{}', representation.etag, None)
+
+
+def test_each_encoding_has_its_own_strong_etag():
+    representation = Representation(LARGE)
+    body, etag, encoding = representation.select('br, gzip;q=0.8')
+    assert (gzip.decompress(body), etag, encoding) == (LARGE, representation.gzip_etag, 'gzip')
+    assert representation.select('identity') == (LARGE, representation.etag, None)
+    assert representation.etag.startswith('"') and representation.gzip_etag == representation.etag[:-1] + '-gz"'
+    # Rebuilding the same bytes gives the same tags, so clients keep revalidating after a restart
+    assert Representation(LARGE).gzip_etag == representation.gzip_etag
+
+
+@pytest.mark.parametrize('header, matches', [
+    (None, False),
+    ('"other"', False),
+    ('*', True),
+    ('{etag}', True),
+    ('W/{etag}', True),
+    ('"other", {gzip_etag}', True),
+])
+def test_not_modified(header, matches):
+    representation = Representation(LARGE)
+    if header is not None:
+        header = header.format(etag=representation.etag, gzip_etag=representation.gzip_etag)
+    assert representation.not_modified(header) is matches
+
+
+@pytest.mark.parametrize('header, accepted', [
+    (None, False),
+    ('identity', False),
+    ('gzip', True),
+    ('GZIP', True),
+    ('x-gzip', True),
+    ('*', True),
+    ('gzip;q=0', False),
+    ('gzip; q=0.5', True),
+    ('br, gzip;q=0', False),
+    ('gzip;q=bad', False),
+])
+def test_accepts_gzip(header, accepted):
+    assert accepts_gzip(header) is accepted
+
+
+def test_entries_are_rebuilt_when_the_version_changes():
+    cache, builds = ResponseCache(), []
+
+    def build():
+        builds.append(1)
+        return b'[%d]' % len(builds)
+
+    first = cache.get('/products', {'q': 'a', 'page': '1'}, 1, build)
+    assert cache.get('/products', {'page': '1', 'q': 'a'}, 1, build) is first
+    assert cache.get('/products', {'page': '1', 'q': 'a'}, 2, build).body == b'[2]'
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_oldest_entry_is_evicted_when_full():
+    cache = ResponseCache(max_entries=2)
+    for query in ('a', 'b', 'c'):
+        cache.get('/search', {'q': query}, 1, lambda: query.encode())
+    cache.get('/search', {'q': 'c'}, 1, lambda: b'rebuilt')
+    cache.get('/search', {'q': 'a'}, 1, lambda: b'rebuilt')
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_canonical_query_ignores_order_and_list_type():
+    assert canonical_query({'b': ['1', '2'], 'a': 'x'}) == canonical_query({'a': 'x', 'b': ('1', '2')})
+    assert canonical_query(None) == canonical_query({}) == ()
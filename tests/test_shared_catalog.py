@@ -0,0 +1,88 @@
+import os
+import threading
+
+import pytest
+
+from backend.ahat.shared_catalog import _SEQUENCE, _SEQUENCE_OFFSET, MAX_META_BYTES, SharedCatalog
+
+
+@pytest.fixture
+def shared(tmp_path):
+    catalog = SharedCatalog.create(str(tmp_path))
+    yield catalog
+    catalog.destroy()
+
+
+def write_bytes(body):
+    def write(path):
+        with open(path, 'wb') as f:
+            f.write(body)
+    return write
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_read_waits_out_a_write_in_progress(shared):
+    shared.update(status='ok')
+    reader = SharedCatalog.open(shared.directory)
+    # Leave the sequence odd, as a writer does halfway through
+    sequence = _SEQUENCE.unpack_from(shared._map, _SEQUENCE_OFFSET)[0]
+    _SEQUENCE.pack_into(shared._map, _SEQUENCE_OFFSET, sequence + 1)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(reader.read()))
+    thread.start()
+    thread.join(0.1)
+    assert thread.is_alive() and not result
+    _SEQUENCE.pack_into(shared._map, _SEQUENCE_OFFSET, sequence + 2)
+    thread.join(5)
+    assert result == [(0, {'status': 'ok'})]
+    reader.close()
+
+
+def test_readers_never_see_a_torn_write(shared):
+    reader = SharedCatalog.open(shared.directory)
+    done = threading.Event()
+
+    def publish():
+        for generation in range(1, 2001):
+            # Metadata of varying length, so a torn read would mix two of them
+            shared._write(generation, {'generation': generation, 'padding': 'x' * (generation % 97)})
+        done.set()
+
+    writer = threading.Thread(target=publish)
+    writer.start()
+    reads = 0
+    while not done.is_set() or not reads:
+        generation, meta = reader.read()
+        if generation:
+            assert meta == {'generation': generation, 'padding': 'x' * (generation % 97)}
+        reads += 1
+    writer.join()
+    assert reader.read()[0] == 2000
+    reader.close()
+
+
+def test_images_are_published_and_opened_by_generation(shared):
+    reader = SharedCatalog.open(shared.directory)
+    assert reader.open_image(read_bytes) == (0, None)
+    for generation in (1, 2, 3):
+        assert shared.publish_image(write_bytes(b'image %d' % generation), refreshed=generation) == generation
+    assert reader.open_image(read_bytes) == (3, b'image 3')
+    assert reader.read() == (3, {'refreshed': 3})
+    # The previous generation stays for readers still opening it; older ones are removed
+    assert sorted(name for name in os.listdir(shared.directory) if name != 'control') == [
+        'catalog-2.image', 'catalog-3.image']
+    reader.close()
+
+
+def test_readers_cannot_write(shared):
+    reader = SharedCatalog.open(shared.directory)
+    with pytest.raises(ValueError, match='read-only'):
+        reader.update(status='no')
+    with pytest.raises(ValueError, match='does not fit'):
+        shared.update(padding='x' * MAX_META_BYTES)
+    assert reader.read() == (0, {})
+    reader.close()
@@ -0,0 +1,77 @@
+import pytest
+
+from backend.ahat.store import CATALOG_ORDER, ProductStore, decode_cursor, encode_cursor
+
+
+def make_product(n, price, category):
+    return {'id': f'p{n}', 'price': price, 'category': category}
+
+
+def make_store(count=40):
+    # Prices repeat, so pages have to break ties by catalog order; every seventh has none
+    products = [make_product(n, None if n % 7 == 3 else (n * 37) % 11, 'ab'[n % 2]) for n in range(count)]
+    return ProductStore(key=lambda p: p['id'], hash_fields={'category': lambda p: p['category']},
+                        sort_fields={'price': lambda p: p['price']}, products=products)
+
+
+def pages(store, limit=3, **query):
+    """Every page of a query, each started from the keyset position of the last product of the one before"""
+    sort, descending = query.get('sort', CATALOG_ORDER), query.get('descending', False)
+    seen, after = [], None
+    while True:
+        _, page = store.query(limit=limit, after=after, **query)
+        if not page:
+            return seen
+        seen += [p['id'] for p in page]
+        after = store.position(page[-1], sort)
+
+
+@pytest.mark.parametrize('sort', [CATALOG_ORDER, 'price'])
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('filters', [
+    {},
+    {'equals': {'category': 'a'}},
+    {'ranges': {'price': (2, 8)}},
+    {'equals': {'category': 'b'}, 'ranges': {'price': (0, 5)}},
+])
+def test_keyset_pages_walk_the_query_once(sort, descending, filters):
+    store = make_store()
+    _, everything = store.query(sort=sort, descending=descending, **filters)
+    assert pages(store, sort=sort, descending=descending, **filters) == [p['id'] for p in everything]
+
+
+def test_keyset_page_is_stable_when_earlier_products_change():
+    store = make_store()
+    _, first = store.query(sort='price', limit=5)
+    after = store.position(first[-1], 'price')
+    _, expected = store.query(sort='price', limit=5, after=after)
+    store.remove(first[0]['id'])
+    store.upsert(make_product(100, -1, 'a'))
+    _, page = store.query(sort='price', limit=5, after=after)
+    assert page == expected
+
+
+def test_after_bounds_narrows_a_range_to_after_the_position():
+    store = make_store()
+    index = store._sorted['price']
+    lo, hi = store._range_bounds('price', 2, 8)
+    value, seq, _ = index[lo + 3]
+    assert store._after_bounds('price', False, (lo, hi), (value, seq)) == (lo + 4, hi)
+    assert store._after_bounds('price', True, (lo, hi), (value, seq)) == (lo, lo + 3)
+    # Past either end the bounds are empty, never inverted
+    first, last = index[lo], index[hi - 1]
+    assert store._after_bounds('price', True, (lo, hi), first[:2]) == (lo, lo)
+    assert store._after_bounds('price', False, (lo, hi), last[:2]) == (hi, hi)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor('price', True, (4.5, 17))
+    assert decode_cursor(cursor) == ('price', True, (4.5, 17))
+    assert decode_cursor(encode_cursor(None, False, (3, 3))) == (None, False, (3, 3))
+
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor', encode_cursor('color', False, (1, 1)),
+                                    encode_cursor('price', False, (True, 1)), encode_cursor('price', False, (1, 1.5))])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match='invalid cursor'):
+        decode_cursor(cursor)